@@ -0,0 +1,78 @@
+import collections
+
+import cachetools
+
+import settings
+
+
+def percentile(samples, percent):
+    ordered = sorted(samples)
+    index = int(round((len(ordered) - 1) * percent / 100))
+    return ordered[index]
+
+
+class LatencyTracker:
+    """Keeps latencies of recent answered checks and derives timeout from
+    them: percentile of latency multiplied by factor, limited by floor and
+    by timeout of check definition. Until enough samples are collected
+    timeout of check definition is used as is."""
+
+    def __init__(self, window=None, min_samples=None, percent=None, factor=None, floor=None, per_proxy=None):
+        self.window = settings.ADAPTIVE_TIMEOUT_WINDOW if window is None else window
+        self.min_samples = settings.ADAPTIVE_TIMEOUT_MIN_SAMPLES if min_samples is None else min_samples
+        self.percent = settings.ADAPTIVE_TIMEOUT_PERCENTILE if percent is None else percent
+        self.factor = settings.ADAPTIVE_TIMEOUT_FACTOR if factor is None else factor
+        self.floor = settings.ADAPTIVE_TIMEOUT_FLOOR if floor is None else floor
+        self.per_proxy = settings.ADAPTIVE_TIMEOUT_PER_PROXY if per_proxy is None else per_proxy
+        self.proxy_window = 10
+        self.proxy_min_samples = 3
+
+        self._by_check = {}
+        self._by_proxy = cachetools.LRUCache(maxsize=65536)
+        # percentile is recalculated only after some new samples, not on
+        # every check
+        self.recalculate_every = max(1, self.window // 10)
+        self._recorded = collections.Counter()
+        self._latency_by_check = {}
+
+    def record(self, check_id, proxy_id, latency):
+        samples = self._by_check.get(check_id)
+        if samples is None:
+            samples = self._by_check[check_id] = collections.deque(maxlen=self.window)
+        samples.append(latency)
+        self._recorded[check_id] += 1
+
+        if self.per_proxy:
+            key = (check_id, proxy_id)
+            proxy_samples = self._by_proxy.get(key)
+            if proxy_samples is None:
+                proxy_samples = self._by_proxy[key] = collections.deque(maxlen=self.proxy_window)
+            proxy_samples.append(latency)
+
+    def get_latency(self, check_id):
+        samples = self._by_check.get(check_id)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        if check_id not in self._latency_by_check or self._recorded[check_id] >= self.recalculate_every:
+            self._latency_by_check[check_id] = percentile(samples, self.percent)
+            self._recorded[check_id] = 0
+        return self._latency_by_check[check_id]
+
+    def get_timeout(self, check_id, timeout, proxy_id=None):
+        latency = None
+        if self.per_proxy and proxy_id is not None:
+            proxy_samples = self._by_proxy.get((check_id, proxy_id))
+            if proxy_samples and len(proxy_samples) >= self.proxy_min_samples:
+                latency = max(proxy_samples)
+        if latency is None:
+            latency = self.get_latency(check_id)
+        if latency is None:
+            return timeout
+        return min(timeout, max(self.floor, latency * self.factor))
+
+
+def get_latency_tracker():
+    if get_latency_tracker.tracker is None:
+        get_latency_tracker.tracker = LatencyTracker()
+    return get_latency_tracker.tracker
+get_latency_tracker.tracker = None
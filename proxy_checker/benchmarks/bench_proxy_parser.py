@@ -0,0 +1,58 @@
+"""
+Measures how many lines per second proxy_parser.parse_many handles for
+lists of already canonical IPv4 proxies, which take the fast path, and for
+mixed ones with schemes, hostnames, IPv6 addresses and leading zeros.
+
+Usage: cd proxy_checker && PYTHONPATH=. python benchmarks/bench_proxy_parser.py
+"""
+import argparse
+import random
+import time
+
+import proxy_parser
+
+
+def make_ipv4_lines(count):
+    return ['{}.{}.{}.{}:{}'.format(
+        random.randint(1, 255), random.randint(0, 255), random.randint(0, 255), random.randint(0, 255),
+        random.randint(1, 65535),
+    ) for i in range(count)]
+
+
+def make_mixed_lines(count):
+    templates = [
+        'http://{0}.{1}.{2}.{3}:{4}',
+        'SOCKS5://{0}.{1}.{2}.{3}:{4:05d}',
+        'proxy{0}-{1}.example.com:{4}',
+        '[2001:db8::{0:x}:{1:x}]:{4}',
+        '  {0}.{1}.{2}.{3}:{4}  ',
+    ]
+    return [random.choice(templates).format(
+        random.randint(1, 255), random.randint(0, 255), random.randint(0, 255), random.randint(0, 255),
+        random.randint(1, 65535),
+    ) for i in range(count)]
+
+
+def bench(name, lines, repeat):
+    best = None
+    for i in range(repeat):
+        start_time = time.perf_counter()
+        proxies, rejected = proxy_parser.parse_many(lines)
+        delta_time = time.perf_counter() - start_time
+        best = delta_time if best is None else min(best, delta_time)
+    print('{:<10} {:0.0f} lines per second, {} rejected'.format(name, len(lines)/best, len(rejected)))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('-l', '--lines', type=int, default=200000)
+    arg_parser.add_argument('-n', '--repeat', type=int, default=5)
+    args = arg_parser.parse_args()
+
+    random.seed(0)
+    bench('ipv4', make_ipv4_lines(args.lines), args.repeat)
+    bench('mixed', make_mixed_lines(args.lines), args.repeat)
+
+
+if __name__ == '__main__':
+    main()
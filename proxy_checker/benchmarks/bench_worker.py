@@ -0,0 +1,56 @@
+"""
+Measures worker scheduling overhead per task with a fake check which does
+no network I/O, so the time spent is only the worker's own bookkeeping.
+
+Usage: cd proxy_checker && PYTHONPATH=. python benchmarks/bench_worker.py
+"""
+import argparse
+import asyncio
+import logging
+import time
+
+from worker import Worker
+
+
+class FakeItem:
+    check_definitions = ()
+
+
+class FakeCheckWorker(Worker):
+    async def _fake_check(self, item):
+        await asyncio.sleep(0)
+
+    def make_check(self, item):
+        return self._fake_check(item)
+
+
+async def run(tasks_count, concurent_requests):
+    worker = FakeCheckWorker(concurent_requests=concurent_requests)
+    worker.logger.disabled = True
+    item = FakeItem()
+    for i in range(tasks_count):
+        worker.put(item)
+
+    start_time = time.perf_counter()
+    future = asyncio.ensure_future(worker.start())
+    await worker.stop()
+    await worker.wait_stop()
+    await future
+    return time.perf_counter() - start_time
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('-n', '--tasks', type=int, default=100000)
+    arg_parser.add_argument('-c', '--concurent_requests', type=int, default=50)
+    args = arg_parser.parse_args()
+
+    logging.disable(logging.INFO)
+    loop = asyncio.get_event_loop()
+    delta_time = loop.run_until_complete(run(args.tasks, args.concurent_requests))
+    print('{} tasks with {} concurent requests: {:0.3f} s total, {:0.2f} us per task'.format(
+        args.tasks, args.concurent_requests, delta_time, delta_time/args.tasks*1000000))
+
+
+if __name__ == '__main__':
+    main()
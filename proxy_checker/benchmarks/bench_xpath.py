@@ -0,0 +1,55 @@
+"""
+Compares per-response cost of evaluating check xpaths as strings, which
+recompiles every expression, against precompiled lxml.etree.XPath objects.
+
+Usage: cd proxy_checker && PYTHONPATH=. python benchmarks/bench_xpath.py
+"""
+import argparse
+import time
+
+import lxml.etree
+import lxml.html
+
+
+XPATH_LIST = [
+    './/span[contains(text(), "Xiaomi MI A1 (64GB, 4GB RAM")]',
+    './/*[contains(text(), "To discuss automated access to Amazon data please contact")]',
+    './/*[contains(@alt, "Something went wrong on our end. Please go back and")]',
+    './/*[contains(text(), "Type the characters you see in this image")]',
+    './/input[@id="headerSearch"]',
+    './/img[contains(@src, "failover")]',
+]
+
+
+def make_page(rows):
+    row = '<div class="item"><img src="/img/{0}.png" alt="item {0}"><span>Item number {0}</span></div>'
+    body = ''.join(row.format(i) for i in range(rows))
+    return '<html><head><title>Test</title></head><body><input id="headerSearch">{}</body></html>'.format(body).encode()
+
+
+def bench(name, func, doc, repeat):
+    start_time = time.perf_counter()
+    for i in range(repeat):
+        func(doc)
+    delta_time = time.perf_counter() - start_time
+    print('{:<10} {:0.1f} us per response'.format(name, delta_time/repeat*1000000))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('-r', '--rows', type=int, default=2000)
+    arg_parser.add_argument('-n', '--repeat', type=int, default=200)
+    args = arg_parser.parse_args()
+
+    content = make_page(args.rows)
+    doc = lxml.html.fromstring(content)
+    compiled_list = [lxml.etree.XPath(x) for x in XPATH_LIST]
+    print('Page size: {} KB, {} xpaths'.format(len(content)//1024, len(XPATH_LIST)))
+
+    bench('string', lambda doc: [doc.xpath(x) for x in XPATH_LIST], doc, args.repeat)
+    bench('compiled', lambda doc: [x(doc) for x in compiled_list], doc, args.repeat)
+    bench('parse', lxml.html.fromstring, content, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
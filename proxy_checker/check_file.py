@@ -2,24 +2,36 @@ import asyncio
 import argparse
 import logging
 import os
+import sys
 import time
 import warnings
 
 from sqlalchemy import exc as sa_exc
 import tqdm
 import entity
+import parse_executor
+import proxy_parser
 import settings
 from worker import Worker
 from manager import Manager
-from entity import parse_proxy_string
+from pipeline import Pipeline, output_writers
+import records
+from protocol_sniffer import ProtocolSniffer, expand_protocols
+from shard import ShardWorker
 from xpath_check import XPathCheck, BanXPathCheck
 
 
 
 arg_parser = argparse.ArgumentParser()
 arg_parser.add_argument('--debug', action='store_true', required=False)
+arg_parser.add_argument('--no-sniff', action='store_true', default=False, required=False, help='check proxies without scheme with all protocols instead of detecting them')
 arg_parser.add_argument('-q', '--quiet', action='store_true', default=True, required=False)
 arg_parser.add_argument('-pb', '--progress_bar', action='store_true', default=False, required=False)
+arg_parser.add_argument('--processes', type=int, default=0, required=False, help='run checks in that many worker processes')
+arg_parser.add_argument('--use-database', action='store_true', default=False, required=False, help='store proxies and results in temporary sqlite database instead of memory')
+arg_parser.add_argument('--stream', action='store_true', default=False, required=False, help='read proxies lazily and print alive ones as soon as they are checked, use - as file path to read stdin')
+arg_parser.add_argument('--format', choices=sorted(output_writers), default='text', required=False, help='output format of streaming mode')
+arg_parser.add_argument('--window', type=int, default=None, required=False, help='proxies checked at once in streaming mode')
 arg_parser.add_argument('--default_file_path',  default='proxy_checker/proxies.list', required=False)
 
 
@@ -37,44 +49,55 @@ def main():
     if args.debug:
         settings.enable_debug_mode()
         args.quiet = False
-
-    tmp_database_file_name = 'tmp_database.db'
-    tmp_database_file_path = entity.get_sqlite_database_path(db_file_name=tmp_database_file_name)
-    database_url = entity.get_sqlite_database_url(db_path=tmp_database_file_path)
-    session = entity.get_session(database_url=database_url, force=True)
-    entity.create_models()
+    if args.stream and args.use_database:
+        arg_parser.error('--stream can not be used with --use-database')
+
+    if args.use_database:
+        tmp_database_file_name = 'tmp_database.db'
+        tmp_database_file_path = entity.get_sqlite_database_path(db_file_name=tmp_database_file_name)
+        database_url = entity.get_sqlite_database_url(db_path=tmp_database_file_path)
+        session = entity.get_session(database_url=database_url, force=True)
+        entity.create_models()
+
+        def make_check(check_id, *args, **kwargs):
+            # id is given by database
+            return entity.Check(*args, **kwargs)
+    else:
+        result_writer = entity.get_result_writer.writer = records.MemoryResultWriter()
+        make_check = records.make_check_definition
 
     manager = Manager()
+    if not args.use_database:
+        manager.sync_every = None
     manager.logger.disabled = args.quiet
     logging.getLogger('asyncio').disabled = args.quiet
 
-    try:
-        if not len(opts):
-            raise FileNotFoundError
+    if args.stream:
         file_path = opts[0]
-        with open(file_path, 'r') as f:
-            proxies = [x.strip() for x in f.readlines()]
-            proxies = [x for x in proxies if x]
-    except FileNotFoundError:
-        manager.logger.warning('File not exist by path: {}'.format(file_path))
-        manager.logger.info('Trying to use opts as proxies input')
-        proxies = opts
-
-    if not proxies:
-        manager.logger.critical('No any proxies found')
-        return False
-
-    manager.logger.debug('Trying to check these proxies: {}'.format(', '.join(proxies)))
+        if file_path == '-':
+            proxies = sys.stdin
+        elif os.path.exists(file_path):
+            proxies = open(file_path, 'r')
+        else:
+            manager.logger.warning('File not exist by path: {}'.format(file_path))
+            proxies = iter(opts)
+    else:
+        # credentials are kept only by in-memory records
+        proxies = read_proxies(manager, opts, allow_credentials=not args.use_database)
+        if not proxies:
+            manager.logger.critical('No any proxies found')
+            return False
+        manager.logger.debug('Trying to check these proxies: {}'.format(', '.join(proxies)))
 
     start_time = time.time()
-    checks = []
-    checks.append(entity.Check(
-        'http://google.com',
+    check_list = []
+    check_list.append(dict(
+        url='http://google.com',
         status=[200, 301],
         xpath_list=(XPathCheck('.//input[contains(@name, "btn") and @type="submit"]'), )
     ))
-    checks.append(entity.Check(
-        'https://www.amazon.com/s/ref=nb_sb_noss_2?url=search-alias%3Daps&field-keywords=Xiaomi+MI+A1+(64GB%2C+4GB+RAM)&rh=i%3Aaps%2Ck%3AXiaomi+MI+A1+(64GB%5Cc+4GB+RAM)',
+    check_list.append(dict(
+        url='https://www.amazon.com/s/ref=nb_sb_noss_2?url=search-alias%3Daps&field-keywords=Xiaomi+MI+A1+(64GB%2C+4GB+RAM)&rh=i%3Aaps%2Ck%3AXiaomi+MI+A1+(64GB%5Cc+4GB+RAM)',
         status=200,
         xpath_list=(
             XPathCheck('.//span[contains(text(), "Xiaomi MI A1 (64GB, 4GB RAM")]'),
@@ -83,8 +106,8 @@ def main():
             BanXPathCheck('.//*[contains(text(), "Type the characters you see in this image")]'),
         )
     ))
-    checks.append(entity.Check(
-        'https://www.olx.ua', 
+    check_list.append(dict(
+        url='https://www.olx.ua', 
         status=200, 
         xpath_list=(
             XPathCheck('.//input[@id="headerSearch"]'),
@@ -92,39 +115,50 @@ def main():
         )
     ))
 
+    checks = [make_check(i, **x) for i, x in enumerate(check_list, start=1)]
     for check in checks:
         check.logger.disabled = args.quiet
 
     progress_bar_list = []
+    if args.processes:
+        workers_count = args.processes
+        manager.partition_by_hash = True
     for i in range(workers_count):
         if settings.PROGRESS_BAR_ENABLED or args.progress_bar:
             progress_bar = tqdm.tqdm(position=i)
             progress_bar_list.append(progress_bar)
         else:
             progress_bar = None
-        worker = Worker(
-            concurent_requests=concurent_requests,
-            progress_bar=progress_bar
-        )
+        if args.processes:
+            worker = ShardWorker(
+                i,
+                concurent_requests=concurent_requests,
+                progress_bar=progress_bar
+            )
+        else:
+            worker = Worker(
+                concurent_requests=concurent_requests,
+                progress_bar=progress_bar
+            )
         manager.workers.append(worker)
 
         worker.logger.disabled = args.quiet
-        
-    proxies = [parse_proxy_string(proxy) for proxy in proxies]
-    for proxy in proxies[:]:
-        if not proxy.protocol:
-            for protocol in settings.POSSIBLE_PROTOCOLS:
-                if protocol == 'http':
-                    continue
-                buffer_proxy = proxy.make_proxy_string(protocol=protocol)
-                buffer_proxy = parse_proxy_string(buffer_proxy)
-
-                proxies.append(buffer_proxy)
 
-    for proxy in proxies:
-        for check in checks:
-            proxy.add_check_definition(check)
-    session.commit()
+    if args.stream:
+        return run_stream(args, manager, checks, result_writer, proxies)
+
+    if args.no_sniff:
+        proxies = expand_protocols(proxies)
+    else:
+        proxies = asyncio.get_event_loop().run_until_complete(ProtocolSniffer().expand(proxies))
+    if args.use_database:
+        session.flush()
+        proxy_ids, created = entity.get_or_create_many(proxies, session=session)
+        entity.add_proxy_check_definitions([(x, check.id) for x in proxy_ids.values() for check in checks], session=session)
+        session.commit()
+        proxies = entity.load_proxies(list(proxy_ids.values()), session=session)
+    else:
+        proxies = records.make_records(proxies, checks)
 
     for proxy in proxies:
         manager.put(proxy)
@@ -138,33 +172,87 @@ def main():
     loop.run_until_complete(asyncio.gather(*[x.wait_stop() for x in manager.workers]))
     loop.run_until_complete(manager.stop())
     loop.run_until_complete(manager.wait_stop())
+    loop.run_until_complete(entity.get_result_writer().close())
+    parse_executor.shutdown()
 
     loop.close()
 
-    for proxy in proxies:
-        session.add(proxy)
-    session.commit()
+    if args.use_database:
+        for proxy in proxies:
+            session.add(proxy)
+        session.commit()
 
     if args.progress_bar:
         for x in progress_bar_list:
             x.close()
             print('')
 
-    alive = sorted(filter(lambda x: x.is_alive, proxies), key=lambda x: x.time)
+    if args.use_database:
+        verdicts = entity.get_verdicts([x.id for x in proxies], session=session)
+    else:
+        verdicts = result_writer.get_verdicts(proxies)
+    alive = sorted([x for x in proxies if verdicts[x.id].is_alive], key=lambda x: verdicts[x.id].time)
     for proxy in alive:
-        banned_on = proxy.banned_on
+        banned_on = verdicts[proxy.id].banned_on
         banned_on = ', banned on: '+(', '.join([x for x in banned_on])) if banned_on else ''
 
         if not args.quiet:
-            manager.logger.info('{:0.3f} s, {}{}'.format(proxy.time, proxy, banned_on))
+            manager.logger.info('{:0.3f} s, {}{}'.format(verdicts[proxy.id].time, proxy, banned_on))
         else:
             print(proxy, flush=True)
 
     delta_time = time.time() - start_time
     manager.logger.info('{}/{} proxies alive. Checked {} proxies for {:0.2f} s. {:0.0f} proxies per second with {} concurent requests.'.format(len(alive), len(proxies), len(proxies), delta_time, len(proxies)/delta_time, concurent_requests))
 
-    os.remove(tmp_database_file_path)
+    if args.use_database:
+        os.remove(tmp_database_file_path)
+
+def read_proxies(manager, opts, allow_credentials=True):
+    try:
+        if not len(opts):
+            raise FileNotFoundError
+        file_path = opts[0]
+        with open(file_path, 'r') as f:
+            proxies, rejected = proxy_parser.parse_many(f, allow_credentials=allow_credentials)
+    except FileNotFoundError:
+        manager.logger.warning('File not exist by path: {}'.format(file_path))
+        manager.logger.info('Trying to use opts as proxies input')
+        proxies, rejected = proxy_parser.parse_many(opts, allow_credentials=allow_credentials)
+
+    for line_number, line, error in rejected:
+        manager.logger.debug('Skipped line {}: {}'.format(line_number + 1, error))
+    if rejected:
+        manager.logger.warning('Skipped {} wrong lines'.format(len(rejected)))
+    return [str(x) for x in proxies]
+
+
+def run_stream(args, manager, checks, result_writer, lines):
+    pipeline = Pipeline(
+        manager,
+        checks,
+        result_writer,
+        sys.stdout,
+        output_format=args.format,
+        window=args.window,
+        sniffer=None if args.no_sniff else ProtocolSniffer(),
+    )
+    pipeline.logger.disabled = args.quiet
 
+    loop = asyncio.get_event_loop()
+    asyncio.ensure_future(asyncio.gather(*[x.start() for x in manager.workers]))
+    asyncio.ensure_future(manager.start())
+    try:
+        loop.run_until_complete(pipeline.run(lines))
+    finally:
+        loop.run_until_complete(asyncio.gather(*[x.stop() for x in manager.workers]))
+        loop.run_until_complete(asyncio.gather(*[x.wait_stop() for x in manager.workers]))
+        loop.run_until_complete(manager.stop())
+        loop.run_until_complete(manager.wait_stop())
+        parse_executor.shutdown()
+        loop.close()
+        if lines is not sys.stdin and hasattr(lines, 'close'):
+            lines.close()
+    return True
 
 
 if __name__ == '__main__':
@@ -0,0 +1,39 @@
+import asyncio
+import concurrent.futures
+import functools
+
+from sqlalchemy.orm import sessionmaker
+
+import entity
+import settings
+
+
+class Database:
+    """Runs blocking ORM code in a thread pool so it never stalls the event
+    loop. Every call gets its own session which is committed when the
+    function returns and rolled back if it raises."""
+
+    def __init__(self, engine=None, threads=None):
+        self.engine = engine or entity.get_engine()
+        self._sessionmaker = sessionmaker(bind=self.engine, autoflush=False, expire_on_commit=False)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads or settings.DB_THREADS)
+
+    def _call(self, func, args, kwargs):
+        session = self._sessionmaker()
+        try:
+            result = func(session, *args, **kwargs)
+            session.commit()
+            return result
+        except BaseException:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        call = functools.partial(self._call, func, args, kwargs)
+        return await loop.run_in_executor(self._executor, call)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
@@ -12,19 +12,28 @@ import aiohttp
 import async_timeout
 import aiosocksy
 from aiosocksy.connector import ProxyConnector, ProxyClientRequest
+import cachetools
 import cachetools.func
-import lxml.html
-from sqlalchemy import create_engine
+import lxml.etree
+from sqlalchemy import bindparam, create_engine, inspect, select, text
 from sqlalchemy import (Column, Boolean, Integer, String, ForeignKey, 
-                        UniqueConstraint, DateTime)
+                        UniqueConstraint, DateTime, Index)
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.orm import joinedload, object_session, relationship, sessionmaker
 from sqlalchemy.sql.expression import ClauseElement
+import sqlalchemy.exc
 from tqdm import tqdm
 
 from proxies import proxies
+import adaptive_timeout
+import host_limiter
+import parse_executor
+import probe
+import proxy_parser
+from result_writer import ResultWriter
 import session_sets
 import settings
+import sql
 import xpath_check
 
 
@@ -39,23 +48,19 @@ def random_session():
     return random.choice(session_sets.sessions)
 
 def get_proxy_parts(proxy):
-    parsed_proxy = urllib.parse.urlparse(proxy)
-
-    netloc = parsed_proxy.netloc or parsed_proxy.path
-    netloc_splitted = netloc.split(':')
-    host = netloc_splitted[0]
-    if len(netloc_splitted) > 1:
-        port = netloc_splitted[1]
-    else:
-        port = None
-
-    return parsed_proxy.scheme, host, port
-
-def parse_proxy_string(proxy):
+    """Canonical (protocol, host, port) of proxy string, raises
+    proxy_parser.ProxyParseError for wrong ones and ones with credentials,
+    as there is no place for them in proxy table. Missing protocol is the
+    default one, so the same proxy is never stored twice."""
+    parsed = proxy_parser.check_no_credentials(proxy_parser.parse_one(proxy))
+    return parsed.protocol or proxy_parser.DEFAULT_PROTOCOL, parsed.host, parsed.port
+
+def parse_proxy_string(proxy, session=None):
     protocol, host, port = get_proxy_parts(proxy)
 
     return get_or_create(
         Proxy,
+        session=session,
         host=host,
         port=port,
         protocol=protocol
@@ -65,6 +70,8 @@ def parse_proxy_string(proxy):
 class Proxy(Base):
     __tablename__ = 'proxy'
     __table_args__ = (UniqueConstraint('host', 'port', 'protocol', name='proxy_uix'), )
+    # Instances loaded from database are created without calling __init__
+    _on_all_checks_finished = None
 
     def __init__(self, *args, **kwargs):
         self._on_all_checks_finished = None
@@ -76,6 +83,7 @@ class Proxy(Base):
     protocol = Column(String(1024))
     recheck_every = Column(Integer)
     created_at = Column(DateTime, default=datetime.datetime.utcnow())
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow, index=True)
 
 
     def __str__(self):
@@ -85,23 +93,12 @@ class Proxy(Base):
         return str(self)
 
     def make_proxy_string(self, protocol=None):
-        protocol = protocol or self.protocol or 'http'
-        return '{}://{}:{}'.format(protocol, self.host, self.port)
+        protocol = protocol or self.protocol or proxy_parser.DEFAULT_PROTOCOL
+        return proxy_parser.make_proxy_string(protocol, self.host, self.port)
 
     def add_check(self, check):
         self.checks.append(check)
 
-    @property
-    def last_checks(self):
-        return (get_session().query(CheckResult)
-                    .join(Proxy)
-                    .join(ProxyCheckDefinition)
-                    .filter(CheckResult.proxy == self and ProxyCheckDefinition.proxy == self)
-                    .order_by(CheckResult.id)
-                    .group_by(CheckResult.check_id)
-                    .all()
-        )
-
     @property
     def check_definitions(self):
         # TODO: needs to move these logic to separate class "Checker"
@@ -115,23 +112,25 @@ class Proxy(Base):
         if not definition_mapping.id:
             self._check_definitions.append(definition_mapping)
 
+    @property
+    def verdict(self):
+        return get_verdicts([self.id], session=object_session(self))[self.id]
+
     @property
     def time(self):
-        if not self.checks:
-            return -1
-        return sum([x.time for x in self.checks])/len(self.checks)
+        return self.verdict.time
 
     @property
     def is_alive(self):
-        return all(self.last_checks)
+        return self.verdict.is_alive
 
     @property
     def is_banned_somewhere(self):
-        return any([x.is_banned for x in self.last_checks])
+        return bool(self.verdict.banned_on)
 
     @property
     def banned_on(self):
-        return [x.check.netloc for x in self.last_checks if x.is_banned]
+        return self.verdict.banned_on
 
     async def on_check_executed(self):
         if self._on_all_checks_finished:
@@ -152,6 +151,9 @@ class ProxyCheckDefinition(Base):
     check_definition = relationship('CheckDefinition')
 
 
+xpath_cache = cachetools.LRUCache(maxsize=1024)
+
+
 class CheckDefinition(Base):
     __tablename__ = 'check_definition'
     __table_args__ = (UniqueConstraint('definition', name='check_definition_uix'), )
@@ -190,6 +192,36 @@ class CheckDefinition(Base):
         definition['timeout'] = value
         self.decoded_definition = definition
 
+    @property
+    def target_netloc(self):
+        return self.netloc or urllib.parse.urlparse(self.url).netloc
+
+    @property
+    def host_limits(self):
+        """Limits of requests to target host, default ones from settings
+        are used for missing keys"""
+        return {
+            'max_concurrency': self.decoded_definition.get('max_concurrency'),
+            'rate_limit': self.decoded_definition.get('rate_limit'),
+            'rate_burst': self.decoded_definition.get('rate_burst'),
+        }
+
+    @property
+    def is_gate(self):
+        return bool(self.decoded_definition.get('gate'))
+
+    @property
+    def adaptive_timeout(self):
+        return self.decoded_definition.get('adaptive_timeout', settings.ADAPTIVE_TIMEOUT)
+
+    def get_timeout(self, proxy=None):
+        """Timeout for the next check, tightened by observed latency when
+        adaptive timeout is enabled."""
+        if not self.adaptive_timeout or not self.timeout:
+            return self.timeout
+        proxy_id = proxy.id if proxy is not None else None
+        return adaptive_timeout.get_latency_tracker().get_timeout(self.id, self.timeout, proxy_id=proxy_id)
+
     @property
     def url(self):
         return self.decoded_definition.get('url')
@@ -198,22 +230,75 @@ class CheckDefinition(Base):
     def status(self):
         return [int(x) for x in self.decoded_definition.get('status')]
 
+    @property
+    def stream(self):
+        return self.decoded_definition.get('stream', settings.STREAM_RESPONSE_BODY)
+
+    @property
+    def max_body_size(self):
+        return self.decoded_definition.get('max_body_size') or settings.MAX_BODY_SIZE
+
     @property
     def check_xpath(self):
-        xpath_list = self.decoded_definition.get('check_xpath')
-        if not xpath_list:
-            return []
-        buffer_xpath_list = []
-        for xpath in xpath_list:
+        return [xpath for xpath, compiled_xpath in self.compiled_xpath]
+
+    @property
+    def compiled_xpath(self):
+        """List of (XPathCheck, lxml.etree.XPath) pairs. Expressions are
+        compiled once per definition and shared between instances, as
+        instances are reinitialized every time they are taken from proxy."""
+        cache_key = self.id if self.id is not None else self.definition
+        cached = xpath_cache.get(cache_key)
+        if cached is not None and cached[0] == self.definition:
+            return cached[1]
+
+        compiled = []
+        for xpath in self.decoded_definition.get('check_xpath') or []:
             if xpath['type'] == 'ban':
                 xpath_class = xpath_check.BanXPathCheck
             else:
                 xpath_class = xpath_check.XPathCheck
-            buffer_xpath_list.append(xpath_class(xpath['xpath']))
+            xpath = xpath_class(xpath['xpath'])
+            compiled.append((xpath, lxml.etree.XPath(str(xpath))))
 
-        return buffer_xpath_list
+        xpath_cache[cache_key] = (self.definition, compiled)
+        return compiled
 
-    async def check(self, proxy):
+    async def skip(self, proxy, reason):
+        check_result = CheckResult()
+        check_result.proxy_id = proxy.id
+        check_result.is_passed = False
+        check_result.is_banned = False
+        check_result.check_id = self.id
+        check_result.time = 0
+        check_result.done_at = datetime.datetime.utcnow()
+        check_result.error = 'skipped'
+        await get_result_writer().put(check_result)
+        await proxy.on_check_executed()
+        self.logger.debug('Skipped check for {} on {}: {}'.format(proxy, self.url, reason))
+        return check_result
+
+    async def read_streamed(self, response):
+        """Reads body only while it can change result of the check and not
+        more than max_body_size bytes. Returns verdict of xpath checks."""
+        compiled_xpath = self.compiled_xpath
+        matcher = parse_executor.StreamMatcher(compiled_xpath)
+        is_status_ok = not self.status or int(response.status) in self.status
+        if not compiled_xpath or (not is_status_ok and not matcher.has_ban_xpath):
+            response.close()
+            return matcher.close()
+
+        max_body_size = self.max_body_size
+        while not matcher.is_final and matcher.size < max_body_size:
+            chunk = await response.content.read(min(settings.STREAM_CHUNK_SIZE, max_body_size - matcher.size))
+            if not chunk:
+                break
+            matcher.feed(chunk)
+        else:
+            response.close()
+        return matcher.close()
+
+    async def check(self, proxy, session_pool=None):
         possible_exceptions = (
             aiohttp.client_exceptions.ClientProxyConnectionError, 
             concurrent.futures._base.TimeoutError, 
@@ -226,18 +311,32 @@ class CheckDefinition(Base):
             aiohttp.client_exceptions.ClientPayloadError
         )
 
+        timeout = self.get_timeout(proxy)
+        verdict = None
         start_time = time.time()
-
         try:
+            # port probe dials the proxy, not the target, so it does not
+            # take target host limit
             is_port_open = await check_port_open(proxy.host, proxy.port)
             if not is_port_open:
                 raise concurrent.futures._base.TimeoutError('Could not open connection')
-            async with async_timeout.timeout(self.timeout):
-                async with aiohttp.ClientSession(connector=ProxyConnector(verify_ssl=False, limit=0), request_class=ProxyClientRequest, conn_timeout=self.timeout, read_timeout=self.timeout) as session:
-                    async with session.get(self.url, proxy=str(proxy), headers=random_session()['headers']) as response:
-                        content = await response.read()
-                        # self.logger.debug('Got response [{}]: {} bytes'.format(response.status, len(content))) #DELETE_DEBUG
-                        result = response
+            probe_time = time.time() - start_time
+            async with host_limiter.get_host_limiter().limit(self.target_netloc, **self.host_limits):
+                # waiting for target host limit is not counted in check time
+                start_time = time.time() - probe_time
+                async with async_timeout.timeout(timeout):
+                    if session_pool is None:
+                        session_context = aiohttp.ClientSession(connector=ProxyConnector(verify_ssl=False, limit=0), request_class=ProxyClientRequest, conn_timeout=timeout, read_timeout=timeout)
+                    else:
+                        session_context = session_pool.session(proxy)
+                    async with session_context as session:
+                        async with session.get(self.url, proxy=str(proxy), proxy_auth=make_proxy_auth(proxy), headers=random_session()['headers'], timeout=timeout) as response:
+                            if self.stream:
+                                verdict = await self.read_streamed(response)
+                            else:
+                                content = await response.read()
+                            # self.logger.debug('Got response [{}]: {} bytes'.format(response.status, len(content))) #DELETE_DEBUG
+                            result = response
         except possible_exceptions as e:
             result = e
         delta_time = time.time() - start_time
@@ -245,23 +344,14 @@ class CheckDefinition(Base):
         is_passed = True
         is_banned = False
         if isinstance(result, aiohttp.client_reqrep.ClientResponse):
-            if self.check_xpath:
-                any_xpath_worked = False
-                try:
-                    doc = lxml.html.fromstring(content)
+            compiled_xpath = self.compiled_xpath
+            if compiled_xpath:
+                if verdict is None:
                     if settings.SHOW_RESPONSE_BODY:
                         self.logger.info(content)
-                    for xpath in self.check_xpath:
-                        xpath_result = doc.xpath(xpath)
-                        if xpath_result:
-                            any_xpath_worked = True
-                        if xpath_result and isinstance(xpath, xpath_check.BanXPathCheck):
-                            is_banned = True
-                except (lxml.etree.ParserError, lxml.etree.XMLSyntaxError):
-                    pass
-                except lxml.etree.XPathEvalError as e:
-                    self.logger.warning('XPath is wrong: {}'.format(xpath))
-                    raise e
+                    verdict = await parse_executor.evaluate_async(content, compiled_xpath)
+                any_xpath_worked = verdict.is_matched
+                is_banned = verdict.is_banned
                 if not any_xpath_worked:
                     is_passed = False
                     # self.logger.debug('No any xpath worked for proxy {} on url {} ({}):'.format(proxy, self.url, ", ".join(self.check_xpath))) #DELETE_DEBUG
@@ -274,20 +364,22 @@ class CheckDefinition(Base):
 
         if isinstance(result, aiohttp.client_reqrep.ClientResponse):
             status = int(result.status)
+            if self.adaptive_timeout:
+                adaptive_timeout.get_latency_tracker().record(self.id, proxy.id, delta_time)
         else:
             status = None
 
         check_result = CheckResult()
-        check_result.proxy = proxy
+        check_result.proxy_id = proxy.id
         check_result.is_passed = is_passed
         check_result.is_banned = is_banned
-        check_result.check = self
+        check_result.check_id = self.id
         check_result.time = delta_time
         check_result.done_at = datetime.datetime.utcnow()
         check_result.status = status
         if isinstance(result, BaseException):
             check_result.error = str(result)
-        get_session().add(check_result)
+        await get_result_writer().put(check_result)
         await proxy.on_check_executed()
 
         error = ''
@@ -297,10 +389,24 @@ class CheckDefinition(Base):
         return check_result
 
 
-def make_check_definition(url, status=200, xpath_list=[], timeout=None):
+def make_check_definition(url, status=200, xpath_list=[], timeout=None, stream=None, max_body_size=None, adaptive_timeout=None, gate=None, max_concurrency=None, rate_limit=None, rate_burst=None):
     check = {}
     check['url'] = url
     check['timeout'] = timeout or settings.DEFAULT_TIMEOUT
+    if stream is not None:
+        check['stream'] = bool(stream)
+    if max_body_size is not None:
+        check['max_body_size'] = int(max_body_size)
+    if adaptive_timeout is not None:
+        check['adaptive_timeout'] = bool(adaptive_timeout)
+    if gate is not None:
+        check['gate'] = bool(gate)
+    if max_concurrency is not None:
+        check['max_concurrency'] = int(max_concurrency)
+    if rate_limit is not None:
+        check['rate_limit'] = float(rate_limit)
+    if rate_burst is not None:
+        check['rate_burst'] = int(rate_burst)
 
     if status is None:
         check['status'] = None
@@ -331,11 +437,12 @@ def make_check_definition(url, status=200, xpath_list=[], timeout=None):
     return check
 
 
-def Check(*args, name=None, **kwargs):
+def Check(*args, name=None, session=None, **kwargs):
     check_definition = make_check_definition(*args, **kwargs)
     netloc = urllib.parse.urlparse(check_definition['url']).netloc
     result = get_or_create(
         CheckDefinition, 
+        session=session,
         definition=json.dumps(check_definition),
         name=name,
         netloc=netloc,
@@ -344,17 +451,62 @@ def Check(*args, name=None, **kwargs):
 
 
 class MultiCheck:
-    def __init__(self, *args):
+    """Runs all checks of proxy. Policy decides how much is done when
+    proxy looks dead:
+     - 'all': every check is run
+     - 'probe': every check is skipped when port of proxy is closed
+     - 'gate': as 'probe', then gate check (definition with "gate": true or
+       with the lowest timeout) is run first and the rest are skipped when
+       proxy has not answered it
+    Skipped checks are recorded as failed results without any request."""
+
+    policies = ('all', 'probe', 'gate')
+
+    def __init__(self, *args, session_pool=None, policy=None):
         self.checks = args
+        self.session_pool = session_pool
+        self.policy = policy or settings.MULTI_CHECK_POLICY
+        if self.policy not in self.policies:
+            raise ValueError('Unknown check policy \'{}\', should be one of: {}'.format(self.policy, ', '.join(self.policies)))
+
+    @property
+    def gate_check(self):
+        gate_checks = [x for x in self.checks if x.is_gate]
+        if gate_checks:
+            return gate_checks[0]
+        return min(self.checks, key=lambda x: x.timeout or settings.DEFAULT_TIMEOUT)
+
+    async def run(self, proxy, checks):
+        return await asyncio.gather(*[check.check(proxy, session_pool=self.session_pool) for check in checks])
+
+    async def skip(self, proxy, checks, reason):
+        return [await check.skip(proxy, reason) for check in checks]
 
     async def check(self, proxy):
         max_timeout = max([x.timeout for x in self.checks])/len(self.checks)
-        await check_port_open(proxy.host, proxy.port, timeout=max_timeout) # cache warm
-        return await asyncio.gather(*[check.check(proxy) for check in self.checks])
+        # single probe for all checks, they get its result from cache
+        is_port_open = await check_port_open(proxy.host, proxy.port, timeout=max_timeout)
+        if self.policy == 'all':
+            return await self.run(proxy, self.checks)
+        if not is_port_open:
+            return await self.skip(proxy, self.checks, 'port is closed')
+        if self.policy == 'probe' or len(self.checks) == 1:
+            return await self.run(proxy, self.checks)
+
+        gate_check = self.gate_check
+        gate_result = await gate_check.check(proxy, session_pool=self.session_pool)
+        other_checks = [x for x in self.checks if x is not gate_check]
+        if gate_result.status is None:
+            other_results = await self.skip(proxy, other_checks, 'no answer on gate check')
+        else:
+            other_results = await self.run(proxy, other_checks)
+        other_results = iter(other_results)
+        return [gate_result if x is gate_check else next(other_results) for x in self.checks]
 
 
 class CheckResult(Base):
     __tablename__ = 'check_result'
+    __table_args__ = (Index('check_result_proxy_check_done_at_ix', 'proxy_id', 'check_id', 'done_at'), )
 
     id = Column(Integer, primary_key=True)
     is_passed = Column(Boolean)
@@ -376,6 +528,42 @@ class CheckResult(Base):
         return '<{} {} proxy={} time={:0.0f}ms>'.format(__class__.__name__, self.is_passed, self.proxy, self.time*1000)
 
 
+class ProxyCheckState(Base):
+    """Latest result of every check of every proxy. Maintained by the
+    result writer, so reading current state never touches check history."""
+    __tablename__ = 'proxy_check_state'
+
+    proxy_id = Column(Integer, primary_key=True, autoincrement=False)
+    check_id = Column(Integer, primary_key=True, autoincrement=False)
+    is_passed = Column(Boolean)
+    is_banned = Column(Boolean)
+    status = Column(Integer)
+    time = Column(Integer)
+    error = Column(String(1024))
+    done_at = Column(DateTime)
+
+
+class RemovedProxy(Base):
+    __tablename__ = 'removed_proxy'
+
+    id = Column(Integer, primary_key=True)
+    proxy_id = Column(Integer)
+    removed_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+
+class ProxyLease(Base):
+    """Schedule of proxies checked by checker nodes. A node owns rows it
+    leased until they are released or expires_at passes."""
+    __tablename__ = 'proxy_lease'
+    __table_args__ = (Index('proxy_lease_next_check_at_ix', 'next_check_at', 'expires_at'), )
+
+    proxy_id = Column(Integer, primary_key=True, autoincrement=False)
+    next_check_at = Column(DateTime)
+    owner = Column(String(255))
+    token = Column(String(36))
+    expires_at = Column(DateTime)
+
+
 class ProxyLevel(Base):
     __tablename__ = 'proxy_level'
 
@@ -402,10 +590,52 @@ def create_models(engine=None):
         break
     if error:
         raise error
+    upgrade_models(engine)
+
+
+def create_missing_indexes(engine, table):
+    existing = set(x['name'] for x in inspect(engine).get_indexes(table.name))
+    for index in table.indexes:
+        if index.name not in existing:
+            logger.info('Creating index {}'.format(index.name))
+            index.create(engine)
+
+
+def upgrade_models(engine=None):
+    """Brings tables created by older versions up to date, as create_all
+    only creates missing tables"""
+    if not engine:
+        engine = get_engine()
+    proxy_columns = [x['name'] for x in inspect(engine).get_columns(Proxy.__tablename__)]
+    if 'updated_at' not in proxy_columns:
+        logger.info('Adding proxy.updated_at column')
+        with engine.begin() as connection:
+            connection.execute('ALTER TABLE proxy ADD COLUMN updated_at DATETIME')
+            connection.execute(Proxy.__table__.update().values(updated_at=datetime.datetime.utcnow()))
+    create_missing_indexes(engine, Proxy.__table__)
+    create_missing_indexes(engine, CheckResult.__table__)
+
+    # State of databases with check results written by older versions,
+    # otherwise every proxy is reported dead until it is rechecked
+    with engine.connect() as connection:
+        has_state = connection.execute(select([ProxyCheckState.proxy_id]).limit(1)).first()
+        has_results = connection.execute(select([CheckResult.id]).limit(1)).first()
+    if not has_state and has_results:
+        logger.info('Rebuilding proxy_check_state from check_result')
+        rebuild_proxy_check_state(engine)
+
+
+def rebuild_proxy_check_state(engine=None):
+    if not engine:
+        engine = get_engine()
+    with engine.begin() as connection:
+        connection.execute(ProxyCheckState.__table__.delete())
+        connection.execute(sql.REBUILD_PROXY_CHECK_STATE)
 
 
 def main():
     create_models()    
+    rebuild_proxy_check_state()
 
 
 def get_database_url():
@@ -430,18 +660,204 @@ def get_engine(database_url=None, force=False):
     if not database_url:
         database_url = get_database_url()
     if not get_engine.engine or force:
-        get_engine.engine = create_engine(database_url, echo=settings.SQL_LOG_ENABLED)
+        kwargs = {}
+        if not database_url.startswith('sqlite'):
+            kwargs['pool_size'] = settings.DB_POOL_SIZE
+            kwargs['pool_recycle'] = 3600
+        get_engine.engine = create_engine(database_url, echo=settings.SQL_LOG_ENABLED, **kwargs)
     return get_engine.engine
 get_engine.engine = None
 
 
+def make_session(database_url=None):
+    return sessionmaker(bind=get_engine(database_url=database_url), autoflush=False)()
+
+
 def get_session(database_url=None, force=False):
     if not get_session.session or force:
-        get_session.session = sessionmaker(bind=get_engine(database_url=database_url), autoflush=False)()
+        get_session.session = make_session(database_url=database_url)
     return get_session.session
 get_session.session = None
 
 
+def get_result_writer(force=False):
+    if not get_result_writer.writer or force:
+        get_result_writer.writer = ResultWriter(
+            engine=get_engine(),
+            table=CheckResult.__table__,
+            state_table=ProxyCheckState.__table__,
+        )
+    return get_result_writer.writer
+get_result_writer.writer = None
+
+
+def chunks(items, size):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i+size]
+
+
+ProxyVerdict = collections.namedtuple('ProxyVerdict', ('is_alive', 'banned_on', 'time'))
+
+
+def get_verdicts(proxy_ids, session=None):
+    """Verdicts of proxies by id from the latest results of their checks,
+    with one query per chunk of ids. Proxy is alive when it has checks and
+    all of them passed, time is average time of these results."""
+    if not session:
+        session = get_session()
+    proxy_ids = list(set(proxy_ids))
+    query = text(sql.GET_PROXY_VERDICTS).bindparams(bindparam('ids', expanding=True))
+
+    rows_by_proxy = {}
+    for ids in chunks(proxy_ids, settings.DB_CHUNK_SIZE):
+        for row in session.execute(query, {'ids': ids}):
+            rows_by_proxy.setdefault(row.proxy_id, []).append(row)
+
+    verdicts = {}
+    for proxy_id in proxy_ids:
+        rows = rows_by_proxy.get(proxy_id, [])
+        times = [x.time for x in rows if x.time is not None]
+        verdicts[proxy_id] = ProxyVerdict(
+            is_alive=bool(rows) and all(x.is_passed for x in rows),
+            banned_on=[x.netloc for x in rows if x.is_banned],
+            time=sum(times)/len(times) if times else -1,
+        )
+    return verdicts
+
+
+def get_proxy_ids(keys, session=None, lock=False):
+    """Maps (protocol, host, port) of existing proxies to their ids, with
+    one query per chunk of hosts. With lock rows are read with shared lock,
+    so MySQL returns ones committed after the transaction has started."""
+    if not session:
+        session = get_session()
+    result = {}
+    hosts = list(set(x[1] for x in keys))
+    for chunk in chunks(hosts, settings.DB_CHUNK_SIZE):
+        query = (session.query(Proxy.id, Proxy.protocol, Proxy.host, Proxy.port)
+            .filter(Proxy.host.in_(chunk)))
+        if lock:
+            query = query.with_for_update(read=True)
+        rows = query.all()
+        # rows stored by older versions may have no protocol
+        result.update({(x.protocol or proxy_parser.DEFAULT_PROTOCOL, x.host, x.port): x.id for x in rows})
+    return result
+
+
+def get_or_create_many(proxies, session=None, defaults=None):
+    """Bulk version of parse_proxy_string. Proxies are proxy strings or
+    dicts of column values with protocol, host and port. Missing proxies
+    are inserted with a single executemany, the first item of duplicates
+    wins. Returns ordered dict of ids by (protocol, host, port) and list
+    of keys of created proxies."""
+    if not session:
+        session = get_session()
+    items = collections.OrderedDict()
+    for proxy in proxies:
+        if isinstance(proxy, str):
+            protocol, host, port = get_proxy_parts(proxy)
+            proxy = {'protocol': protocol, 'host': host, 'port': port}
+        elif not proxy['protocol']:
+            proxy = dict(proxy, protocol=proxy_parser.DEFAULT_PROTOCOL)
+        items.setdefault((proxy['protocol'], proxy['host'], proxy['port']), proxy)
+
+    ids = get_proxy_ids(items.keys(), session=session)
+    created = [x for x in items.keys() if x not in ids]
+    if created:
+        rows = []
+        for key in created:
+            row = dict(defaults or {})
+            row.update(items[key])
+            rows.append(row)
+        missing = created
+        try:
+            with session.begin_nested():
+                session.execute(Proxy.__table__.insert(), rows)
+        except sqlalchemy.exc.IntegrityError:
+            # Some of them were inserted by another session meanwhile
+            created = []
+            for key, row in zip(missing, rows):
+                try:
+                    with session.begin_nested():
+                        session.execute(Proxy.__table__.insert(), row)
+                    created.append(key)
+                except sqlalchemy.exc.IntegrityError:
+                    pass
+        ids.update(get_proxy_ids(missing, session=session, lock=len(created) != len(missing)))
+
+    return collections.OrderedDict((x, ids[x]) for x in items.keys()), created
+
+
+def add_proxy_check_definitions(pairs, session=None):
+    """Inserts missing (proxy_id, check_definition_id) pairs with a single
+    executemany and marks their proxies updated. Returns count of added."""
+    if not session:
+        session = get_session()
+    pairs = set(pairs)
+    proxy_ids = list(set(x[0] for x in pairs))
+    for chunk in chunks(proxy_ids, settings.DB_CHUNK_SIZE):
+        rows = (session.query(ProxyCheckDefinition.proxy_id, ProxyCheckDefinition.check_definition_id)
+            .filter(ProxyCheckDefinition.proxy_id.in_(chunk))
+            .all())
+        pairs.difference_update((x.proxy_id, x.check_definition_id) for x in rows)
+    if not pairs:
+        return 0
+
+    session.execute(ProxyCheckDefinition.__table__.insert(), [
+        {'proxy_id': proxy_id, 'check_definition_id': check_id}
+        for proxy_id, check_id in pairs
+    ])
+    changed_proxy_ids = list(set(x[0] for x in pairs))
+    for chunk in chunks(changed_proxy_ids, settings.DB_CHUNK_SIZE):
+        (session.query(Proxy)
+            .filter(Proxy.id.in_(chunk))
+            .update({'updated_at': datetime.datetime.utcnow()}, synchronize_session=False))
+    return len(pairs)
+
+
+def remove_check_definitions(check_ids, session=None):
+    """Removes check definitions with their proxy mappings and marks mapped
+    proxies updated, so managers drop the checks on the next sync. Returns
+    count of removed check definitions."""
+    if not session:
+        session = get_session()
+    check_ids = list(check_ids)
+    if not check_ids:
+        return 0
+
+    proxy_ids = [x.proxy_id for x in (session.query(ProxyCheckDefinition.proxy_id)
+        .filter(ProxyCheckDefinition.check_definition_id.in_(check_ids))
+        .distinct())]
+    for chunk in chunks(proxy_ids, settings.DB_CHUNK_SIZE):
+        (session.query(Proxy)
+            .filter(Proxy.id.in_(chunk))
+            .update({'updated_at': datetime.datetime.utcnow()}, synchronize_session=False))
+    (session.query(ProxyCheckDefinition)
+        .filter(ProxyCheckDefinition.check_definition_id.in_(check_ids))
+        .delete(synchronize_session=False))
+    return (session.query(CheckDefinition)
+        .filter(CheckDefinition.id.in_(check_ids))
+        .delete(synchronize_session=False))
+
+
+def load_proxies(ids, session=None):
+    """Proxies by ids with their check definitions, in order of ids"""
+    if not session:
+        session = get_session()
+    proxies = {}
+    for chunk in chunks(ids, settings.DB_CHUNK_SIZE):
+        query = (session.query(Proxy)
+            .options(
+                joinedload(Proxy._check_definitions)
+                .joinedload(ProxyCheckDefinition.check_definition)
+            )
+            .filter(Proxy.id.in_(chunk))
+        )
+        proxies.update({x.id: x for x in query})
+    return [proxies[x] for x in ids]
+
+
 def get_or_create(model, session=None, defaults=None, **kwargs):
     if not session:
         session = get_session()
@@ -459,20 +875,23 @@ def get_or_create(model, session=None, defaults=None, **kwargs):
         return instance
 
 
+def make_proxy_auth(proxy):
+    """Credentials of proxy in the form its protocol connector expects,
+    only in-memory records have them"""
+    username = getattr(proxy, 'username', None)
+    if not username:
+        return None
+    password = proxy.password or ''
+    if proxy.protocol == 'socks4':
+        return aiosocksy.Socks4Auth(username)
+    if proxy.protocol == 'socks5':
+        return aiosocksy.Socks5Auth(username, password)
+    return aiohttp.BasicAuth(username, password)
+
+
 async def check_port_open(host, port, timeout=3):
-    cache_key = '{}:{}'.format(host, port)
-    cache_result = check_port_open.cache.get(cache_key, None)
-    if cache_result is not None:
-        return cache_result
-    try:
-        await asyncio.wait_for(asyncio.open_connection(host, port), timeout=timeout)
-        result = True
-    except:
-        result = False
-    finally:
-        check_port_open.cache[cache_key] = result
-        return result
-check_port_open.cache = cachetools.TTLCache(maxsize=65536, ttl=60, timer=time.time)
+    result = await probe.get_port_probe().probe(host, port, timeout=timeout)
+    return result.is_open
 
 
 def serializer(obj):
@@ -0,0 +1,160 @@
+import asyncio
+import collections
+import time
+
+import settings
+
+
+class TokenBucket:
+    """Every caller reserves a token, so the balance can go below zero and
+    callers wait in order of arrival instead of competing for refills."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def reserve(self):
+        """Takes a token and returns delay before it can be used"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at)*self.rate)
+        self.updated_at = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0
+        return -self.tokens/self.rate
+
+    def tighten(self, rate, burst=None):
+        self.rate = min(self.rate, rate)
+        self.capacity = min(self.capacity, burst or max(1, rate))
+        self.tokens = min(self.tokens, self.capacity)
+
+
+class HostLimit:
+    """Limits of one target host. Check definitions of the same host may
+    set different limits, then the strictest of them are used."""
+
+    def __init__(self, max_concurrency=None, rate_limit=None, rate_burst=None):
+        self.max_concurrency = None
+        self.bucket = None
+        self.running_count = 0
+        self.acquired_count = 0
+        self.waited_count = 0
+        self.wait_total = 0
+        self.wait_max = 0
+        self._waiters = collections.deque()
+        self.update(max_concurrency, rate_limit, rate_burst)
+
+    def update(self, max_concurrency=None, rate_limit=None, rate_burst=None):
+        if max_concurrency:
+            self.max_concurrency = min(self.max_concurrency or max_concurrency, max_concurrency)
+        if rate_limit:
+            if self.bucket is None:
+                self.bucket = TokenBucket(rate_limit, rate_burst)
+            else:
+                self.bucket.tighten(rate_limit, rate_burst)
+
+    def _wake_next(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    async def _acquire(self):
+        # limit may be lowered while waiting, so it is checked again
+        while self.max_concurrency and self.running_count >= self.max_concurrency:
+            waiter = asyncio.get_event_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self._wake_next()
+                elif waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                raise
+        self.running_count += 1
+
+    def _release(self):
+        self.running_count -= 1
+        self._wake_next()
+
+    async def __aenter__(self):
+        start_time = time.time()
+        await self._acquire()
+        try:
+            if self.bucket is not None:
+                delay = self.bucket.reserve()
+                if delay:
+                    await asyncio.sleep(delay)
+        except BaseException:
+            self._release()
+            raise
+
+        waited = time.time() - start_time
+        self.acquired_count += 1
+        if waited > 0.001:
+            self.waited_count += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._release()
+
+    @property
+    def stats(self):
+        return {
+            'acquired': self.acquired_count,
+            'waited': self.waited_count,
+            'wait_total': self.wait_total,
+            'wait_max': self.wait_max,
+            'wait_avg': self.wait_total/self.acquired_count if self.acquired_count else 0,
+        }
+
+
+class NoLimit:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        pass
+
+
+class HostLimiter:
+    """Concurrency and rate limits of requests to every target host, so
+    raising total concurrency does not get checks banned by targets.
+    Limits are per process."""
+
+    no_limit = NoLimit()
+
+    def __init__(self):
+        self._limits = {}
+
+    def limit(self, netloc, max_concurrency=None, rate_limit=None, rate_burst=None):
+        max_concurrency = max_concurrency or settings.HOST_MAX_CONCURRENCY
+        rate_limit = rate_limit or settings.HOST_RATE_LIMIT
+        rate_burst = rate_burst or settings.HOST_RATE_BURST
+        host_limit = self._limits.get(netloc)
+        if host_limit is None:
+            if not max_concurrency and not rate_limit:
+                return self.no_limit
+            host_limit = self._limits[netloc] = HostLimit(max_concurrency, rate_limit, rate_burst)
+        else:
+            # one limit for all definitions of the host, so their requests
+            # are not limited separately
+            host_limit.update(max_concurrency, rate_limit, rate_burst)
+        return host_limit
+
+    @property
+    def stats(self):
+        return {netloc: host_limit.stats for netloc, host_limit in self._limits.items()}
+
+
+def get_host_limiter():
+    if get_host_limiter.limiter is None:
+        get_host_limiter.limiter = HostLimiter()
+    return get_host_limiter.limiter
+get_host_limiter.limiter = None
@@ -4,10 +4,12 @@ import logging
 import time
 
 import entity
+import parse_executor
+import proxy_parser
 import settings
 from worker import Worker
 from manager import Manager
-from entity import parse_proxy_string
+from protocol_sniffer import ProtocolSniffer, expand_protocols
 from xpath_check import XPathCheck, BanXPathCheck
 
 import tqdm
@@ -15,6 +17,7 @@ import tqdm
 
 arg_parser = argparse.ArgumentParser()
 arg_parser.add_argument('--debug', action='store_true', required=False)
+arg_parser.add_argument('--no-sniff', action='store_true', default=False, required=False, help='check proxies without scheme with all protocols instead of detecting them')
 
 
 def main():
@@ -70,21 +73,16 @@ def main():
         )
         manager.workers.append(worker)
         
-    proxies = [parse_proxy_string(proxy) for proxy in proxies]
-    for proxy in proxies[:]:
-        if not proxy.protocol:
-            for protocol in settings.POSSIBLE_PROTOCOLS:
-                if protocol == 'http':
-                    continue
-                buffer_proxy = proxy.make_proxy_string(protocol=protocol)
-                buffer_proxy = parse_proxy_string(buffer_proxy)
-
-                proxies.append(buffer_proxy)
-
-    for proxy in proxies:
-        for check in checks:
-            proxy.add_check_definition(check)
+    proxies = [str(x) for x in proxy_parser.parse_many(proxies, allow_credentials=False)[0]]
+    if args.no_sniff:
+        proxies = expand_protocols(proxies)
+    else:
+        proxies = asyncio.get_event_loop().run_until_complete(ProtocolSniffer().expand(proxies))
+    session.flush()
+    proxy_ids, created = entity.get_or_create_many(proxies, session=session)
+    entity.add_proxy_check_definitions([(x, check.id) for x in proxy_ids.values() for check in checks], session=session)
     session.commit()
+    proxies = entity.load_proxies(list(proxy_ids.values()), session=session)
 
     for proxy in proxies:
         manager.put(proxy)
@@ -98,6 +96,8 @@ def main():
     loop.run_until_complete(asyncio.gather(*[x.wait_stop() for x in manager.workers]))
     loop.run_until_complete(manager.stop())
     loop.run_until_complete(manager.wait_stop())
+    loop.run_until_complete(entity.get_result_writer().close())
+    parse_executor.shutdown()
 
     loop.close()
 
@@ -105,11 +105,12 @@ def main():
         session.add(proxy)
     session.commit()
 
-    alive = sorted(filter(lambda x: x.is_alive, proxies), key=lambda x: x.time)
+    verdicts = entity.get_verdicts([x.id for x in proxies], session=session)
+    alive = sorted([x for x in proxies if verdicts[x.id].is_alive], key=lambda x: verdicts[x.id].time)
     for proxy in alive:
-        banned_on = proxy.banned_on
+        banned_on = verdicts[proxy.id].banned_on
         banned_on = ', banned on: '+(', '.join([x for x in banned_on])) if banned_on else ''
-        manager.logger.info('{:0.3f} s, {}{}'.format(proxy.time, proxy, banned_on))
+        manager.logger.info('{:0.3f} s, {}{}'.format(verdicts[proxy.id].time, proxy, banned_on))
 
     delta_time = time.time() - start_time
     manager.logger.info('{}/{} proxies alive. Checked {} proxies for {:0.2f} s. {:0.0f} proxies per second with {} concurent requests.'.format(len(alive), len(proxies), len(proxies), delta_time, len(proxies)/delta_time, concurent_requests))
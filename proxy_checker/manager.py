@@ -1,25 +1,54 @@
 import asyncio
+import concurrent.futures
+import datetime
 import entity
+import heapq
+import host_limiter
+import itertools
 import logging
 import time
+import zlib
+
+from sqlalchemy.orm import joinedload
 
 import settings
 
 
 class ProcessItem:
     def __init__(self, item):
-        self.update(item)
+        self._created_at = time.time()
         self._last_processed_at = None
         self._next_process_at = None
+        self._process_every = None
+        self.update(item)
 
     def update(self, item):
         self.item = item
+        if item.recheck_every == self._process_every:
+            return False
         self._process_every = item.recheck_every
+        if self._last_processed_at:
+            if self._process_every:
+                self._next_process_at = self._last_processed_at + self._process_every
+            else:
+                self._next_process_at = None
+        return True
 
     def processed(self):
         self._last_processed_at = time.time()
         if self._process_every:
             self._next_process_at = self._last_processed_at + self._process_every
+        else:
+            self._next_process_at = None
+
+    def postpone(self, delay):
+        self._next_process_at = time.time() + delay
+
+    @property
+    def due_at(self):
+        if self.is_first_process:
+            return self._created_at
+        return self._next_process_at
 
     @property
     def is_ready_to_process(self):
@@ -40,33 +69,141 @@ class Manager:
         self._is_running = False
         self._is_need_to_stop = False
         self.workers = []
+        self.partition_by_hash = False
         self.logger = logging.getLogger(__class__.__name__)
         self.logger.setLevel(settings.LOG_LEVEL)
 
         self.sync_every = 5
+        # Rows updated shortly before the previous sync could be committed
+        # after it, so every sync looks back a bit further than needed
+        self.sync_overlap = 60
+        self.retry_every = 0.5
+
+        # Heap of (due_at, counter, key). Entries are never removed in place,
+        # rescheduled or removed items leave stale entries which are skipped
+        self._schedule = []
+        self._schedule_counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._lag_last = 0
+        self._lag_max = 0
+        self._lag_total = 0
+        self._lag_count = 0
 
-        self.session = entity.get_session()
+        self._sync_session = None
+        self._sync_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._synced_until = None
+        self._removed_until = 0
+        self._synced_versions = {}
+        self._keys_by_id = {}
 
     def put(self, item):
         key = str(item)
+        item_id = getattr(item, 'id', None)
+        if item_id is not None:
+            self._keys_by_id[item_id] = key
         if key not in self.queue:
-            self.queue[str(item)] = ProcessItem(item)
+            process_item = ProcessItem(item)
+            self.queue[key] = process_item
+            self._schedule_item(key, process_item)
             return True
         else:
-            self.queue[str(item)].update(item)
+            process_item = self.queue[key]
+            if process_item.update(item):
+                self._schedule_item(key, process_item)
+            return False
+
+    def remove(self, item_id):
+        key = self._keys_by_id.pop(item_id, None)
+        self._synced_versions.pop(item_id, None)
+        process_item = self.queue.get(key)
+        if process_item is None or getattr(process_item.item, 'id', None) != item_id:
             return False
+        # Its schedule entry becomes stale and is skipped when popped
+        del self.queue[key]
+        return True
+
+    def _schedule_item(self, key, process_item):
+        due_at = process_item.due_at
+        if due_at is None:
+            return
+        heapq.heappush(self._schedule, (due_at, next(self._schedule_counter), key))
+        if self._schedule[0][2] == key:
+            self._wakeup.set()
+
+    def _record_lag(self, lag):
+        self._lag_last = lag
+        self._lag_max = max(self._lag_max, lag)
+        self._lag_total += lag
+        self._lag_count += 1
+
+    @property
+    def scheduling_lag(self):
+        return {
+            'last': self._lag_last,
+            'max': self._lag_max,
+            'avg': self._lag_total/self._lag_count if self._lag_count else 0,
+            'count': self._lag_count,
+        }
+
+    @property
+    def scheduled_count(self):
+        return len(self._schedule)
 
     @property
     def is_running(self):
         return self._is_running
 
+    def _fetch_changes(self):
+        """Runs in the sync executor thread. Returns proxies created or
+        updated and ids of proxies removed since the previous call."""
+        if self._sync_session is None:
+            self._sync_session = entity.make_session()
+        session = self._sync_session
+        started_at = datetime.datetime.utcnow()
+
+        try:
+            query = session.query(entity.Proxy).options(
+                joinedload(entity.Proxy._check_definitions)
+                .joinedload(entity.ProxyCheckDefinition.check_definition)
+            )
+            if self._synced_until is not None:
+                since = self._synced_until - datetime.timedelta(seconds=self.sync_overlap)
+                query = query.filter(entity.Proxy.updated_at >= since)
+            proxies = query.all()
+
+            removed = (session.query(entity.RemovedProxy.id, entity.RemovedProxy.proxy_id)
+                .filter(entity.RemovedProxy.id > self._removed_until)
+                .order_by(entity.RemovedProxy.id)
+                .all()
+            )
+
+            # Proxies are handed over to the event loop thread, so they must
+            # not be bound to the session used by this one
+            session.expunge_all()
+        finally:
+            session.rollback()
+
+        self._synced_until = started_at
+        if removed:
+            self._removed_until = removed[-1].id
+        return proxies, [x.proxy_id for x in removed]
+
     async def _do_sync_state(self):
         self.logger.debug('Doing state sync with database')
-        for proxy in self.session.query(entity.Proxy).all():
+        loop = asyncio.get_event_loop()
+        proxies, removed_ids = await loop.run_in_executor(self._sync_executor, self._fetch_changes)
+
+        for proxy_id in removed_ids:
+            if self.remove(proxy_id):
+                self.logger.debug('Removed queue item with id: {}'.format(proxy_id))
+
+        for proxy in proxies:
+            version = (proxy.updated_at, )
+            if self._synced_versions.get(proxy.id) == version:
+                continue
+            self._synced_versions[proxy.id] = version
             if self.put(proxy):
                 self.logger.debug('Added new queue item: {}'.format(proxy))
-        self.session.flush()
-        self.session.commit()
 
     async def sync_state(self):
         self.logger.info('Manager sync state loop started')
@@ -77,28 +214,73 @@ class Manager:
 
     async def info_loop(self):
         while self._is_running and not self._is_need_to_stop:
-            self.logger.info('queue_size={}, performance={}'.format(sum([x.queue_size for x in self.workers]), sum([x.performance for x in self.workers])))
+            lag = self.scheduling_lag
+            self.logger.info('queue_size={}, performance={}, scheduling_lag={:0.3f}s (max {:0.3f}s)'.format(
+                sum([x.queue_size for x in self.workers]),
+                sum([x.performance for x in self.workers]),
+                lag['avg'],
+                lag['max'],
+            ))
+            for netloc, stats in sorted(host_limiter.get_host_limiter().stats.items()):
+                self.logger.info('host={}, requests={}, waited={}, wait_avg={:0.3f}s, wait_max={:0.3f}s'.format(
+                    netloc,
+                    stats['acquired'],
+                    stats['waited'],
+                    stats['wait_avg'],
+                    stats['wait_max'],
+                ))
             await asyncio.sleep(10)
 
     async def start(self):
         self.logger.info('Manager main loop started')
-        asyncio.ensure_future(self.sync_state())
+        # Items of one-shot runs are put directly, there is nothing to sync
+        if self.sync_every:
+            asyncio.ensure_future(self.sync_state())
         asyncio.ensure_future(self.info_loop())
 
         self._is_running = True
         while self._is_running and not self._is_need_to_stop:
-            for key, item in self.queue.items():
-                if item.is_need_to_process:
-                    self.logger.debug('Trying to process {}'.format(item.item))
-                    if self.send_to_worker(item):
-                        self.logger.debug('Successfuly processed {}'.format(item.item))
-                        item.processed()
-            await asyncio.sleep(0.5)
+            self._process_due_items()
+
+            self._wakeup.clear()
+            timeout = self._schedule[0][0] - time.time() if self._schedule else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
         self._is_running = False
+        self._sync_executor.shutdown(wait=False)
 
         self.logger.info('Manager main loop stopped')
 
+    def _process_due_items(self):
+        now = time.time()
+        while self._schedule and self._schedule[0][0] <= now:
+            due_at, _, key = heapq.heappop(self._schedule)
+            item = self.queue.get(key)
+            if item is None or item.due_at != due_at:
+                continue
+
+            self.logger.debug('Trying to process {}'.format(item.item))
+            if self.send_to_worker(item):
+                self.logger.debug('Successfuly processed {}'.format(item.item))
+                self._record_lag(now - due_at)
+                item.processed()
+            else:
+                item.postpone(self.retry_every)
+            self._schedule_item(key, item)
+
     def send_to_worker(self, process_item):
+        if self.partition_by_hash and self.workers:
+            # The same proxy always goes to the same worker, so its state
+            # such as cached sessions and probes stays in one process
+            index = zlib.crc32(str(process_item.item).encode()) % len(self.workers)
+            worker = self.workers[index]
+            if not worker.is_running:
+                return False
+            worker.put(process_item.item)
+            return True
+
         workers = [x for x in self.workers if x.is_running]
         if not workers:
             return False
@@ -109,6 +291,7 @@ class Manager:
 
     async def stop(self):
         self._is_need_to_stop = True
+        self._wakeup.set()
 
     async def wait_stop(self):
         while self.is_running:
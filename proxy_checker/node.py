@@ -0,0 +1,255 @@
+import asyncio
+import argparse
+import datetime
+import logging
+import os
+import socket
+import time
+import uuid
+
+from sqlalchemy import DateTime, and_, bindparam, literal, or_, select
+import sqlalchemy.exc
+from sqlalchemy.orm import joinedload
+
+from database import Database
+import entity
+import parse_executor
+import settings
+from worker import Worker
+
+
+class LeaseStore:
+    """Hands out due proxies to checker nodes sharing one database. On MySQL
+    due rows are locked with SELECT ... FOR UPDATE SKIP LOCKED, so nodes
+    never wait for each other. SQLite serializes writes anyway, there rows
+    are claimed by a single UPDATE and found back by the lease token."""
+
+    def __init__(self, owner, lease_time=None):
+        self.owner = owner
+        self.lease_time = lease_time or settings.NODE_LEASE_TIME
+        self.table = entity.ProxyLease.__table__
+
+    def sync(self, session):
+        """Creates lease rows for new proxies and removes rows of removed ones"""
+        proxy = entity.Proxy.__table__
+        lease = self.table
+        now = datetime.datetime.utcnow()
+        session.execute(lease.insert().from_select(
+            ['proxy_id', 'next_check_at'],
+            select([proxy.c.id, literal(now, DateTime)])
+            .where(proxy.c.id.notin_(select([lease.c.proxy_id])))
+        ))
+        session.execute(lease.delete().where(lease.c.proxy_id.notin_(select([proxy.c.id]))))
+
+    def acquire(self, session, limit):
+        """Leases up to limit due proxies. Returns proxies with their check
+        definitions loaded and token to release them with."""
+        lease = self.table
+        now = datetime.datetime.utcnow()
+        token = str(uuid.uuid4())
+        due = (select([lease.c.proxy_id])
+            .where(lease.c.next_check_at <= now)
+            .where(or_(lease.c.expires_at == None, lease.c.expires_at < now))
+            .order_by(lease.c.next_check_at)
+            .limit(limit)
+        )
+        claim = lease.update().values(
+            owner=self.owner,
+            token=token,
+            expires_at=now + datetime.timedelta(seconds=self.lease_time),
+        )
+
+        if session.get_bind().dialect.name == 'mysql':
+            ids = [x.proxy_id for x in session.execute(due.suffix_with('FOR UPDATE SKIP LOCKED'))]
+            if ids:
+                session.execute(claim.where(lease.c.proxy_id.in_(ids)))
+        else:
+            session.execute(claim.where(lease.c.proxy_id.in_(due)))
+            ids = [x.proxy_id for x in session.execute(select([lease.c.proxy_id]).where(lease.c.token == token))]
+
+        if not ids:
+            return [], token
+        proxies = (session.query(entity.Proxy)
+            .options(
+                joinedload(entity.Proxy._check_definitions)
+                .joinedload(entity.ProxyCheckDefinition.check_definition)
+            )
+            .filter(entity.Proxy.id.in_(ids))
+            .all()
+        )
+        return proxies, token
+
+    def release(self, session, items):
+        """Items are dicts with proxy_id, token and next_check_at. Leases
+        which expired and were taken by another node are left as is."""
+        lease = self.table
+        session.execute(
+            lease.update()
+            .where(and_(
+                lease.c.proxy_id == bindparam('key_proxy_id'),
+                lease.c.token == bindparam('key_token'),
+            ))
+            .values(owner=None, token=None, expires_at=None, next_check_at=bindparam('new_next_check_at')),
+            [{
+                'key_proxy_id': x['proxy_id'],
+                'key_token': x['token'],
+                'new_next_check_at': x['next_check_at'],
+            } for x in items]
+        )
+
+
+class NodeWorker(Worker):
+    def __init__(self, node, **kwargs):
+        super().__init__(**kwargs)
+        self.node = node
+
+    async def check_and_release(self, item):
+        try:
+            return await super().make_check(item)
+        finally:
+            self.node.checked(item)
+
+    def make_check(self, item):
+        return self.check_and_release(item)
+
+
+class Node:
+    """Checker which takes due proxies from the shared database instead of
+    the in-process Manager, so any number of nodes can run side by side."""
+
+    def __init__(self, name=None, concurent_requests=None, batch_size=None, lease_time=None, database=None):
+        self.name = name or '{}-{}'.format(socket.gethostname(), os.getpid())
+        self.db = database or Database()
+        self.leases = LeaseStore(self.name, lease_time=lease_time)
+        self.worker = NodeWorker(self, concurent_requests=concurent_requests)
+        self.batch_size = batch_size or self.worker.concurent_requests*2
+        self.poll_every = settings.NODE_POLL_EVERY
+        self.sync_every = settings.NODE_SYNC_EVERY
+        self.exit_when_idle = False
+        self.logger = logging.getLogger(__class__.__name__)
+        self.logger.setLevel(settings.LOG_LEVEL)
+
+        self._tokens = {}
+        self._released = []
+        self._checked_count = 0
+        self._is_running = False
+        self._stop_requested = asyncio.Event()
+        self._stopped = asyncio.Event()
+
+    @property
+    def is_running(self):
+        return self._is_running
+
+    @property
+    def leased_count(self):
+        return len(self._tokens)
+
+    def checked(self, proxy):
+        token = self._tokens.pop(proxy.id, None)
+        if token is None:
+            return
+        self._checked_count += 1
+        next_check_at = None
+        if proxy.recheck_every:
+            next_check_at = datetime.datetime.utcnow() + datetime.timedelta(seconds=proxy.recheck_every)
+        self._released.append({'proxy_id': proxy.id, 'token': token, 'next_check_at': next_check_at})
+
+    async def release(self):
+        if not self._released:
+            return
+        items, self._released = self._released, []
+        await self.db.run(self.leases.release, items)
+
+    async def acquire(self):
+        limit = self.batch_size - len(self._tokens)
+        if limit <= 0:
+            return 0
+        proxies, token = await self.db.run(self.leases.acquire, limit)
+        for proxy in proxies:
+            self._tokens[proxy.id] = token
+            self.worker.put(proxy)
+        return len(proxies)
+
+    async def _wait(self, timeout):
+        try:
+            await asyncio.wait_for(self._stop_requested.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def start(self):
+        self.logger.info('Node {} started'.format(self.name))
+        self._is_running = True
+        self._stopped.clear()
+        asyncio.ensure_future(self.worker.start())
+
+        synced_at = 0
+        while not self._stop_requested.is_set():
+            acquired = 0
+            try:
+                if time.time() - synced_at >= self.sync_every:
+                    await self.db.run(self.leases.sync)
+                    synced_at = time.time()
+                await self.release()
+                acquired = await self.acquire()
+            except sqlalchemy.exc.DBAPIError as e:
+                # e.g. another node created the same lease rows first
+                self.logger.warning('Could not update leases: {}'.format(e))
+
+            if acquired:
+                self.logger.debug('Leased {} proxies, {} in progress'.format(acquired, self.leased_count))
+            elif self.exit_when_idle and not self._tokens and not self._released:
+                break
+            else:
+                await self._wait(self.poll_every)
+
+        await self.worker.stop()
+        await self.worker.wait_stop()
+        await self.release()
+        self._is_running = False
+        self._stopped.set()
+        self.logger.info('Node {} stopped, checked {} proxies'.format(self.name, self._checked_count))
+
+    async def stop(self):
+        self._stop_requested.set()
+
+    async def wait_stop(self):
+        if self.is_running:
+            await self._stopped.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--name', required=False, help='node name stored with leases, hostname and pid by default')
+    parser.add_argument('--database-url', required=False, help='database url, MySQL database from settings by default')
+    parser.add_argument('-c', '--concurent-requests', required=False, type=int, default=settings.DEFAULT_CONCURENT_REQUESTS)
+    parser.add_argument('--batch-size', required=False, type=int, default=None)
+    parser.add_argument('--lease-time', required=False, type=int, default=None)
+    parser.add_argument('--exit-when-idle', action='store_true', default=False, help='stop when there is no due proxy')
+    args = parser.parse_args()
+
+    engine = entity.get_engine(database_url=args.database_url)
+    entity.create_models(engine=engine)
+
+    node = Node(
+        name=args.name,
+        concurent_requests=args.concurent_requests,
+        batch_size=args.batch_size,
+        lease_time=args.lease_time,
+        database=Database(engine),
+    )
+    node.exit_when_idle = args.exit_when_idle
+
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(node.start())
+    except KeyboardInterrupt:
+        loop.run_until_complete(node.stop())
+        loop.run_until_complete(node.wait_stop())
+    finally:
+        loop.run_until_complete(entity.get_result_writer().close())
+        parse_executor.shutdown()
+        node.db.close()
+
+
+if __name__ == '__main__':
+    main()
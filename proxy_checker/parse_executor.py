@@ -0,0 +1,164 @@
+import asyncio
+import collections
+import concurrent.futures
+import concurrent.futures.process
+import logging
+import threading
+
+import lxml.etree
+import lxml.html
+
+import settings
+import xpath_check
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(settings.LOG_LEVEL)
+
+Verdict = collections.namedtuple('Verdict', ('is_matched', 'is_banned', 'matched'))
+
+_local = threading.local()
+
+
+def make_xpath_specs(compiled_xpath):
+    """Plain (is_ban, xpath) tuples which can be shipped to other process."""
+    return tuple((isinstance(xpath, xpath_check.BanXPathCheck), str(xpath)) for xpath, compiled in compiled_xpath)
+
+
+def compile_xpath_specs(xpath_specs):
+    # Compiled expressions are cached per thread as lxml.etree.XPath
+    # objects should not be shared between threads
+    cache = getattr(_local, 'cache', None)
+    if cache is None or len(cache) > 1024:
+        cache = _local.cache = {}
+    compiled_xpath = cache.get(xpath_specs)
+    if compiled_xpath is None:
+        compiled_xpath = []
+        for is_ban, xpath in xpath_specs:
+            xpath_class = xpath_check.BanXPathCheck if is_ban else xpath_check.XPathCheck
+            compiled_xpath.append((xpath_class(xpath), lxml.etree.XPath(xpath)))
+        cache[xpath_specs] = compiled_xpath
+    return compiled_xpath
+
+
+def evaluate_compiled(content, compiled_xpath):
+    try:
+        doc = lxml.html.fromstring(content)
+    except (lxml.etree.ParserError, lxml.etree.XMLSyntaxError):
+        return Verdict(False, False, [])
+
+    is_matched = False
+    is_banned = False
+    matched = []
+    for xpath, compiled in compiled_xpath:
+        try:
+            xpath_result = compiled(doc)
+        except lxml.etree.XPathEvalError:
+            logger.warning('XPath is wrong: {}'.format(xpath))
+            raise
+        if xpath_result:
+            is_matched = True
+            matched.append(str(xpath))
+            if isinstance(xpath, xpath_check.BanXPathCheck):
+                is_banned = True
+    return Verdict(is_matched, is_banned, matched)
+
+
+def evaluate(content, xpath_specs):
+    return evaluate_compiled(content, compile_xpath_specs(xpath_specs))
+
+
+class StreamMatcher:
+    """Parses page incrementally and matches xpaths against partial tree,
+    so reading can be stopped as soon as verdict can not change anymore.
+    Only positive matches are taken into account before page is closed."""
+
+    def __init__(self, compiled_xpath, evaluate_every=None):
+        self.has_ban_xpath = any(isinstance(x, xpath_check.BanXPathCheck) for x, compiled in compiled_xpath)
+        self.evaluate_every = evaluate_every or settings.STREAM_EVALUATE_EVERY
+        self.size = 0
+        self.is_banned = False
+        self.matched = []
+        self._pending = list(compiled_xpath)
+        self._parser = lxml.etree.HTMLPullParser(events=('start',))
+        self._root = None
+        self._not_evaluated_size = 0
+
+    @property
+    def is_final(self):
+        return self.is_banned or (bool(self.matched) and not self.has_ban_xpath)
+
+    def feed(self, data):
+        self.size += len(data)
+        self._not_evaluated_size += len(data)
+        self._parser.feed(data)
+        for event, element in self._parser.read_events():
+            if self._root is None:
+                self._root = element.getroottree().getroot()
+
+        if self._root is not None and self._not_evaluated_size >= self.evaluate_every:
+            self._not_evaluated_size = 0
+            self._evaluate(self._root)
+
+    def _evaluate(self, root):
+        for item in list(self._pending):
+            xpath, compiled = item
+            try:
+                xpath_result = compiled(root)
+            except lxml.etree.XPathEvalError:
+                logger.warning('XPath is wrong: {}'.format(xpath))
+                raise
+            if xpath_result:
+                self._pending.remove(item)
+                self.matched.append(str(xpath))
+                if isinstance(xpath, xpath_check.BanXPathCheck):
+                    self.is_banned = True
+
+    def close(self):
+        try:
+            root = self._parser.close()
+        except (lxml.etree.ParserError, lxml.etree.XMLSyntaxError):
+            root = self._root
+        if root is not None and not self.is_final:
+            self._evaluate(root)
+        return Verdict(bool(self.matched), self.is_banned, self.matched)
+
+
+def make_executor(kind, workers=None):
+    workers = workers or settings.PARSE_EXECUTOR_WORKERS
+    if kind == 'process':
+        try:
+            return concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+        except (ImportError, NotImplementedError, OSError) as e:
+            logger.warning('Could not start parse process pool, using threads instead: {}'.format(e))
+    return concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+
+def get_parse_executor():
+    if get_parse_executor.executor is None and settings.PARSE_EXECUTOR:
+        get_parse_executor.executor = make_executor(settings.PARSE_EXECUTOR)
+    return get_parse_executor.executor
+get_parse_executor.executor = None
+
+
+async def evaluate_async(content, compiled_xpath):
+    """Matches xpaths against page, in parse executor when it is enabled
+    and page is big enough to be worth shipping there."""
+    executor = get_parse_executor()
+    if executor is None or len(content) < settings.PARSE_EXECUTOR_MIN_SIZE:
+        return evaluate_compiled(content, compiled_xpath)
+
+    loop = asyncio.get_event_loop()
+    xpath_specs = make_xpath_specs(compiled_xpath)
+    try:
+        return await loop.run_in_executor(executor, evaluate, content, xpath_specs)
+    except concurrent.futures.process.BrokenProcessPool:
+        logger.warning('Parse process pool is broken, using threads instead')
+        get_parse_executor.executor = make_executor('thread')
+        return await loop.run_in_executor(get_parse_executor.executor, evaluate, content, xpath_specs)
+
+
+def shutdown():
+    if get_parse_executor.executor is not None:
+        get_parse_executor.executor.shutdown(wait=True)
+        get_parse_executor.executor = None
@@ -0,0 +1,132 @@
+import asyncio
+import concurrent.futures
+import csv
+import itertools
+import json
+import logging
+import time
+
+import proxy_parser
+import records
+import settings
+from protocol_sniffer import expand_protocols
+
+
+def write_text(output, proxy, verdict):
+    output.write('{}\n'.format(proxy))
+
+
+def write_csv(output, proxy, verdict):
+    csv.writer(output).writerow([proxy, '{:0.3f}'.format(verdict.time), ' '.join(verdict.banned_on)])
+
+
+def write_jsonl(output, proxy, verdict):
+    output.write(json.dumps({'proxy': str(proxy), 'time': verdict.time, 'banned_on': verdict.banned_on}) + '\n')
+
+
+output_writers = {
+    'text': write_text,
+    'csv': write_csv,
+    'jsonl': write_jsonl,
+}
+
+
+class Pipeline:
+    """Checks proxies read lazily from lines of file or stdin. Not more than
+    window proxies are in flight, alive ones are written to output as soon
+    as all their checks are done. Only strings of proxies seen so far are
+    kept for the whole run, to skip duplicates."""
+
+    def __init__(self, manager, checks, result_writer, output, output_format='text', window=None, sniffer=None):
+        self.manager = manager
+        self.checks = checks
+        self.result_writer = result_writer
+        self.output = output
+        self.write = output_writers[output_format]
+        self.window = window or settings.PIPELINE_WINDOW
+        self.batch_size = min(self.window, settings.PIPELINE_READ_BATCH_SIZE)
+        self.sniffer = sniffer
+        self.idle_timeout = settings.PIPELINE_IDLE_TIMEOUT
+        self.logger = logging.getLogger(__class__.__name__)
+        self.logger.setLevel(settings.LOG_LEVEL)
+
+        self.read_count = 0
+        self.rejected_count = 0
+        self.checked_count = 0
+        self.alive_count = 0
+        self._seen = set()
+        self._in_flight = {}
+        self._slots = asyncio.Semaphore(self.window)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    @property
+    def in_flight_count(self):
+        return len(self._in_flight)
+
+    @property
+    def is_idle(self):
+        return not self.manager.scheduled_count and not any(x.is_have_item_to_process for x in self.manager.workers)
+
+    def read_batch(self, lines):
+        """Runs in executor, as reading stdin can block"""
+        return list(itertools.islice(lines, self.batch_size))
+
+    async def expand(self, proxies):
+        if self.sniffer is None:
+            return expand_protocols(proxies)
+        return await self.sniffer.expand(proxies)
+
+    def on_verdict(self, proxy, verdict):
+        self.checked_count += 1
+        self.done(proxy)
+        if verdict.is_alive:
+            self.alive_count += 1
+            self.write(self.output, proxy, verdict)
+            self.output.flush()
+
+    def done(self, proxy):
+        del self._in_flight[proxy.id]
+        self.manager.remove(proxy.id)
+        self._slots.release()
+
+    async def put(self, proxy):
+        await self._slots.acquire()
+        self._in_flight[proxy.id] = proxy
+        self.result_writer.track(proxy, self.on_verdict)
+        self.manager.put(proxy)
+
+    async def wait_in_flight(self):
+        idle_since = None
+        while self._in_flight:
+            if not self.is_idle:
+                idle_since = None
+            elif idle_since is None:
+                idle_since = time.time()
+            elif time.time() - idle_since > self.idle_timeout:
+                # e.g. check failed with unexpected error and wrote no result
+                self.logger.warning('Gave up waiting for {} proxies without verdict'.format(self.in_flight_count))
+                for proxy in list(self._in_flight.values()):
+                    self.result_writer.untrack(proxy.id)
+                    self.done(proxy)
+                break
+            await asyncio.sleep(0.1)
+
+    async def run(self, lines):
+        loop = asyncio.get_event_loop()
+        try:
+            while True:
+                batch = await loop.run_in_executor(self._executor, self.read_batch, lines)
+                if not batch:
+                    break
+                self.read_count += len(batch)
+                proxies, rejected = proxy_parser.parse_many(batch)
+                self.rejected_count += len(rejected)
+                for line_number, line, error in rejected:
+                    self.logger.debug('Skipped line {}: {}'.format(self.read_count - len(batch) + line_number + 1, error))
+                proxies = await self.expand([str(x) for x in proxies])
+                for proxy in records.iter_records(proxies, self.checks, seen=self._seen):
+                    await self.put(proxy)
+            await self.wait_in_flight()
+        finally:
+            self._executor.shutdown(wait=False)
+        self.logger.info('Read {} lines, skipped {} wrong ones, checked {} unique proxies, {} alive'.format(self.read_count, self.rejected_count, self.checked_count, self.alive_count))
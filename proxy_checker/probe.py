@@ -0,0 +1,88 @@
+import asyncio
+import collections
+import logging
+import time
+
+import cachetools
+
+import settings
+
+
+ProbeResult = collections.namedtuple('ProbeResult', ('is_open', 'latency', 'error'))
+
+
+class PortProbe:
+    """Checks that TCP port accepts connections. Concurrent probes of the
+    same host:port share one connection attempt, open and closed ports are
+    cached separately, so closed ones can be retried sooner."""
+
+    def __init__(self, open_ttl=None, closed_ttl=None, cache_size=None):
+        cache_size = cache_size or settings.PORT_PROBE_CACHE_SIZE
+        self.open_cache = cachetools.TTLCache(maxsize=cache_size, ttl=open_ttl or settings.PORT_PROBE_OPEN_TTL, timer=time.time)
+        self.closed_cache = cachetools.TTLCache(maxsize=cache_size, ttl=closed_ttl or settings.PORT_PROBE_CLOSED_TTL, timer=time.time)
+        self.latencies = cachetools.LRUCache(maxsize=cache_size)
+        self.probe_count = 0
+        self.coalesced_count = 0
+        self._in_flight = {}
+        self.logger = logging.getLogger(__class__.__name__)
+        self.logger.setLevel(settings.LOG_LEVEL)
+
+    @staticmethod
+    def make_key(host, port):
+        return (host, str(port))
+
+    def get_cached(self, host, port):
+        key = self.make_key(host, port)
+        return self.open_cache.get(key) or self.closed_cache.get(key)
+
+    def get_latency(self, host, port):
+        """Last measured connect time of open port, None if unknown"""
+        return self.latencies.get(self.make_key(host, port))
+
+    async def probe(self, host, port, timeout=3):
+        cached = self.get_cached(host, port)
+        if cached is not None:
+            return cached
+
+        key = self.make_key(host, port)
+        future = self._in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._probe(key, timeout))
+            self._in_flight[key] = future
+            future.add_done_callback(lambda x: self._in_flight.pop(key, None))
+        else:
+            self.coalesced_count += 1
+        # one of waiters being cancelled should not cancel probe for others
+        return await asyncio.shield(future)
+
+    async def _probe(self, key, timeout):
+        host, port = key
+        self.probe_count += 1
+        start_time = time.time()
+        writer = None
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout=timeout)
+            latency = time.time() - start_time
+            result = ProbeResult(True, latency, None)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            result = ProbeResult(False, None, str(e) or e.__class__.__name__)
+        finally:
+            if writer is not None:
+                writer.close()
+
+        if result.is_open:
+            self.open_cache[key] = result
+            self.latencies[key] = result.latency
+        else:
+            self.closed_cache[key] = result
+        self.logger.debug('Probed {}:{}: {}'.format(host, port, result))
+        return result
+
+
+def get_port_probe():
+    if get_port_probe.probe is None:
+        get_port_probe.probe = PortProbe()
+    return get_port_probe.probe
+get_port_probe.probe = None
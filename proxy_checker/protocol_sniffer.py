@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import socket
+import struct
+
+import probe
+import proxy_parser
+import settings
+
+
+class ProtocolSniffer:
+    """Finds out which proxy protocols are spoken on a port by sending the
+    first bytes of SOCKS5, SOCKS4 and HTTP CONNECT handshakes, so proxies
+    without scheme are checked only with protocols which answer."""
+
+    def __init__(self, timeout=None, concurrency=None, target=None):
+        self.timeout = timeout or settings.PROTOCOL_SNIFF_TIMEOUT
+        self.target = target or settings.PROTOCOL_SNIFF_TARGET
+        self.concurrency = concurrency or settings.PROTOCOL_SNIFF_CONCURRENCY
+        self._socks4_request = self.make_socks4_request(*self.target)
+        self.logger = logging.getLogger(__class__.__name__)
+        self.logger.setLevel(settings.LOG_LEVEL)
+
+    async def _handshake(self, host, port, request, response_size):
+        writer = None
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout=self.timeout)
+            writer.write(request)
+            return await asyncio.wait_for(reader.readexactly(response_size), timeout=self.timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            return b''
+        finally:
+            if writer is not None:
+                writer.close()
+
+    async def is_socks5(self, host, port):
+        # version 5, one auth method offered: no authentication
+        response = await self._handshake(host, port, b'\x05\x01\x00', 2)
+        return response[:1] == b'\x05'
+
+    @staticmethod
+    def make_socks4_request(target_host, target_port):
+        """CONNECT request to target, SOCKS4a one when target is a host
+        name, so it is resolved by the proxy"""
+        request = struct.pack('>BBH', 4, 1, target_port)
+        try:
+            return request + socket.inet_aton(target_host) + b'\x00'
+        except OSError:
+            return request + b'\x00\x00\x00\x01\x00' + target_host.encode('idna') + b'\x00'
+
+    async def is_socks4(self, host, port):
+        response = await self._handshake(host, port, self._socks4_request, 2)
+        return len(response) == 2 and response[0] == 0 and 0x5A <= response[1] <= 0x5D
+
+    async def is_http(self, host, port):
+        request = 'CONNECT {0}:{1} HTTP/1.1\r\nHost: {0}:{1}\r\n\r\n'.format(*self.target).encode()
+        response = await self._handshake(host, port, request, 5)
+        return response == b'HTTP/'
+
+    async def sniff(self, host, port):
+        """List of protocols answered on host:port"""
+        port_probe = await probe.get_port_probe().probe(host, port, timeout=self.timeout)
+        if not port_probe.is_open:
+            return []
+
+        protocols = ('http', 'socks4', 'socks5')
+        results = await asyncio.gather(
+            self.is_http(host, port),
+            self.is_socks4(host, port),
+            self.is_socks5(host, port),
+        )
+        return [protocol for protocol, is_answered in zip(protocols, results) if is_answered]
+
+    async def expand(self, proxies):
+        """Replaces every proxy string without scheme with strings for
+        protocols it answered. Proxy which answered nothing is kept as is,
+        so it is still reported as checked. Not more than concurrency
+        coroutines are running, instead of one per proxy."""
+        async def expand_one(proxy):
+            parsed = proxy_parser.parse_one(proxy)
+            if parsed.protocol:
+                return [proxy]
+            protocols = await self.sniff(parsed.host, parsed.port)
+            self.logger.debug('Protocols answered on {}: {}'.format(proxy, protocols))
+
+            result = [proxy] if 'http' in protocols or not protocols else []
+            result.extend(str(parsed._replace(protocol=x)) for x in protocols if x != 'http')
+            return result
+
+        proxies = list(proxies)
+        expanded = [None] * len(proxies)
+        items = iter(enumerate(proxies))
+
+        async def expand_next():
+            for i, proxy in items:
+                expanded[i] = await expand_one(proxy)
+
+        await asyncio.gather(*[expand_next() for i in range(min(self.concurrency, len(proxies)))])
+        return [proxy for proxy_list in expanded for proxy in proxy_list]
+
+
+def expand_protocols(proxies):
+    """Old behaviour: every proxy string without scheme is checked with all
+    possible protocols."""
+    result = []
+    for proxy in proxies:
+        result.append(proxy)
+        parsed = proxy_parser.parse_one(proxy)
+        if not parsed.protocol:
+            result.extend(str(parsed._replace(protocol=x)) for x in settings.POSSIBLE_PROTOCOLS if x != 'http')
+    return result
@@ -0,0 +1,152 @@
+# Has no dependencies, so the scraper imports it as proxy_checker.proxy_parser
+import collections
+import ipaddress
+import re
+
+
+PROTOCOLS = ('http', 'socks4', 'socks5')
+# Proxies without scheme are checked and stored as ones of this protocol
+DEFAULT_PROTOCOL = 'http'
+MAX_PORT_RANGE = 1024
+
+_proxy_re = re.compile(r'''
+    ^(?:(?P<protocol>[A-Za-z][A-Za-z0-9]*)://)?
+    (?:(?P<username>[^:@/\s]+)(?::(?P<password>[^/\s]*))?@)?
+    (?:\[(?P<ipv6>[0-9A-Fa-f:.]+)\]|(?P<host>[A-Za-z0-9._-]+))
+    :(?P<port>[0-9]{1,5})(?:-(?P<port_end>[0-9]{1,5}))?
+    /?$
+''', re.VERBOSE)
+# Already canonical IPv4 proxies, which are most of input, skip the rest
+# of parsing
+_ipv4_proxy_re = re.compile(r'^(?:(http|socks4|socks5)://)?((?:25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])(?:\.(?:25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])){3}):([1-9][0-9]{0,4})$')
+_ipv4_re = re.compile(r'^[0-9]{1,3}(?:\.[0-9]{1,3}){3}$')
+_hostname_re = re.compile(r'^(?=.{1,253}$)[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?(?:\.[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?)*$')
+
+
+class ProxyParseError(ValueError):
+    pass
+
+
+class ParsedProxy(collections.namedtuple('ParsedProxy', ('protocol', 'host', 'port', 'username', 'password'))):
+    """Protocol is empty string when it was not given. Host is lowercased,
+    IPv6 address is stored without brackets, port is string without
+    leading zeros."""
+    __slots__ = ()
+
+    def __str__(self):
+        return make_proxy_string(*self)
+
+
+def make_proxy_string(protocol, host, port, username=None, password=None):
+    if ':' in host:
+        host = '[{}]'.format(host)
+    if username:
+        host = '{}{}@{}'.format(username, ':' + password if password else '', host)
+    if protocol:
+        return '{}://{}:{}'.format(protocol, host, port)
+    return '{}:{}'.format(host, port)
+
+
+def normalize_host(host):
+    host = host.lower()
+    if _ipv4_re.match(host):
+        octets = [int(x) for x in host.split('.')]
+        if max(octets) > 255:
+            raise ProxyParseError('Wrong IPv4 address: {}'.format(host))
+        return '.'.join(str(x) for x in octets)
+    if not _hostname_re.match(host) or host.replace('.', '').isdigit():
+        raise ProxyParseError('Wrong host: {}'.format(host))
+    return host
+
+
+def normalize_ipv6(host):
+    try:
+        return ipaddress.IPv6Address(host).compressed
+    except ValueError:
+        raise ProxyParseError('Wrong IPv6 address: {}'.format(host))
+
+
+def normalize_port(port):
+    port = int(port)
+    if not 0 < port <= 65535:
+        raise ProxyParseError('Port is out of range: {}'.format(port))
+    return port
+
+
+def parse(proxy):
+    """List of proxies of string, more than one when it has range of ports
+    like host:8080-8090. Raises ProxyParseError for wrong strings.
+    Credentials are kept in username and password."""
+    proxy = proxy.strip()
+    match = _ipv4_proxy_re.match(proxy)
+    if match is not None:
+        protocol, host, port = match.groups()
+        if int(port) <= 65535:
+            return [ParsedProxy(protocol or '', host, port, None, None)]
+
+    match = _proxy_re.match(proxy)
+    if match is None:
+        raise ProxyParseError('Wrong proxy string: {}'.format(proxy))
+
+    protocol = (match.group('protocol') or '').lower()
+    if protocol and protocol not in PROTOCOLS:
+        raise ProxyParseError('Unknown protocol: {}'.format(protocol))
+
+    if match.group('ipv6') is not None:
+        host = normalize_ipv6(match.group('ipv6'))
+    else:
+        host = normalize_host(match.group('host'))
+
+    port = normalize_port(match.group('port'))
+    port_end = port
+    if match.group('port_end') is not None:
+        port_end = normalize_port(match.group('port_end'))
+        if port_end < port:
+            raise ProxyParseError('Wrong range of ports: {}-{}'.format(port, port_end))
+        if port_end - port >= MAX_PORT_RANGE:
+            raise ProxyParseError('Range of ports is longer than {}: {}-{}'.format(MAX_PORT_RANGE, port, port_end))
+
+    username = match.group('username')
+    password = match.group('password') if username else None
+    return [
+        ParsedProxy(protocol, host, str(x), username, password)
+        for x in range(port, port_end + 1)
+    ]
+
+
+def parse_one(proxy):
+    """Single proxy of string, range of ports is not allowed"""
+    result = parse(proxy)
+    if len(result) != 1:
+        raise ProxyParseError('Expected single proxy, but got range of ports: {}'.format(proxy))
+    return result[0]
+
+
+def check_no_credentials(proxy):
+    """Proxies stored in database have no place for credentials, so they
+    are rejected instead of being checked without them"""
+    if proxy.username:
+        raise ProxyParseError('Credentials are not supported here: {}'.format(make_proxy_string(proxy.protocol, proxy.host, proxy.port)))
+    return proxy
+
+
+def parse_many(lines, allow_credentials=True):
+    """Parses proxies of lines, skipping blank ones and comments starting
+    with #. Returns list of unique proxies in order of appearance and list
+    of (line number, line, error) of rejected lines."""
+    proxies = collections.OrderedDict()
+    rejected = []
+    for i, line in enumerate(lines):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            parsed = parse(line)
+            if not allow_credentials:
+                parsed = [check_no_credentials(x) for x in parsed]
+        except ProxyParseError as e:
+            rejected.append((i, line, str(e)))
+            continue
+        for proxy in parsed:
+            proxies.setdefault(proxy, None)
+    return list(proxies.keys()), rejected
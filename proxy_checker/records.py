@@ -0,0 +1,146 @@
+import json
+import urllib.parse
+
+import entity
+import proxy_parser
+
+
+class ProxyRecord:
+    """Plain proxy for one-shot runs which are not stored anywhere. Has the
+    attributes workers, manager and shards use from entity.Proxy."""
+
+    __slots__ = ('id', 'host', 'port', 'protocol', 'username', 'password', 'recheck_every', 'check_definitions', '_on_all_checks_finished')
+
+    def __init__(self, id, host, port, protocol=None, recheck_every=None, check_definitions=(), username=None, password=None):
+        self.id = id
+        self.host = host
+        self.port = port
+        self.protocol = protocol
+        self.username = username
+        self.password = password
+        self.recheck_every = recheck_every
+        self.check_definitions = check_definitions
+        self._on_all_checks_finished = None
+
+    def __str__(self):
+        return self.make_proxy_string()
+
+    def __repr__(self):
+        return str(self)
+
+    def make_proxy_string(self, protocol=None):
+        protocol = protocol or self.protocol or proxy_parser.DEFAULT_PROTOCOL
+        return proxy_parser.make_proxy_string(protocol, self.host, self.port, self.username, self.password)
+
+    async def on_check_executed(self):
+        if self._on_all_checks_finished:
+            await self._on_all_checks_finished()
+
+    def set_on_all_checks_finished(self, callback):
+        self._on_all_checks_finished = callback
+
+
+def make_check_definition(check_id, *args, name=None, **kwargs):
+    """Check definition which is not bound to any session, arguments are
+    the same as of entity.Check"""
+    check_definition = entity.make_check_definition(*args, **kwargs)
+    return entity.CheckDefinition(
+        id=check_id,
+        name=name,
+        definition=json.dumps(check_definition),
+        netloc=urllib.parse.urlparse(check_definition['url']).netloc,
+    )
+
+
+def iter_records(proxies, check_definitions, seen=None):
+    """Records of proxy strings which are not in seen yet, all sharing the
+    same checks. Strings of returned records are added to seen. Unlike
+    stored proxies, records keep credentials of proxy strings."""
+    seen = set() if seen is None else seen
+    for proxy in proxies:
+        parsed = proxy_parser.parse_one(proxy)
+        record = ProxyRecord(
+            len(seen) + 1,
+            parsed.host,
+            parsed.port,
+            parsed.protocol or None,
+            check_definitions=check_definitions,
+            username=parsed.username,
+            password=parsed.password,
+        )
+        key = str(record)
+        if key in seen:
+            continue
+        seen.add(key)
+        yield record
+
+
+def make_records(proxies, check_definitions):
+    """Records of unique proxy strings, all sharing the same checks"""
+    return list(iter_records(proxies, check_definitions))
+
+
+class MemoryResultWriter:
+    """Result writer which keeps only the latest result of every check of
+    every proxy in memory, for runs without database"""
+
+    def __init__(self):
+        self.state = {}
+        self.written_count = 0
+        self._tracked = {}
+
+    @property
+    def pending_count(self):
+        return 0
+
+    async def put(self, obj):
+        await self.put_row({
+            'proxy_id': obj.proxy_id,
+            'check_id': obj.check_id,
+            'is_passed': obj.is_passed,
+            'is_banned': obj.is_banned,
+            'time': obj.time,
+        })
+
+    async def put_row(self, row):
+        self.state[(row['proxy_id'], row['check_id'])] = (row['is_passed'], row['is_banned'], row['time'])
+        self.written_count += 1
+
+        tracked = self._tracked.get(row['proxy_id'])
+        if tracked is not None:
+            proxy, callback = tracked
+            if all((proxy.id, x.id) in self.state for x in proxy.check_definitions):
+                del self._tracked[proxy.id]
+                callback(proxy, self.get_verdict(proxy, remove=True))
+
+    def track(self, proxy, callback):
+        """Calls callback(proxy, verdict) as soon as every check of proxy
+        has result. Results of proxy are not kept after that."""
+        self._tracked[proxy.id] = (proxy, callback)
+
+    def untrack(self, proxy_id):
+        self._tracked.pop(proxy_id, None)
+
+    def get_verdict(self, proxy, remove=False):
+        """Verdict of proxy the same way entity.get_verdicts makes it"""
+        results = []
+        for check in proxy.check_definitions:
+            key = (proxy.id, check.id)
+            result = self.state.pop(key, None) if remove else self.state.get(key)
+            results.append((check.netloc, result))
+
+        times = [x[2] for netloc, x in results if x is not None and x[2] is not None]
+        return entity.ProxyVerdict(
+            is_alive=bool(results) and all(x is not None and x[0] for netloc, x in results),
+            banned_on=[netloc for netloc, x in results if x is not None and x[1]],
+            time=sum(times)/len(times) if times else -1,
+        )
+
+    def get_verdicts(self, proxies):
+        return {x.id: self.get_verdict(x) for x in proxies}
+
+    async def flush(self):
+        pass
+
+    async def close(self):
+        pass
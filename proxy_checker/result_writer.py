@@ -0,0 +1,148 @@
+import asyncio
+import concurrent.futures
+import logging
+
+from sqlalchemy import and_, bindparam
+from sqlalchemy.dialects import mysql
+import sqlalchemy.exc
+
+import settings
+
+
+class ResultWriter:
+    """Collects rows in a bounded queue and writes them in batches with a
+    single executemany per batch. When the database falls behind the queue
+    fills up and put() blocks, which holds the caller's worker slot."""
+
+    def __init__(self, engine, table, state_table=None, batch_size=None, flush_every=None, max_pending=None):
+        self.engine = engine
+        self.table = table
+        self.state_table = state_table
+        self.batch_size = batch_size or settings.RESULT_WRITER_BATCH_SIZE
+        self.flush_every = flush_every or settings.RESULT_WRITER_FLUSH_EVERY
+        self.max_pending = max_pending or settings.RESULT_WRITER_MAX_PENDING
+        self.retries = settings.RESULT_WRITER_RETRIES
+        self.retry_delay = settings.RESULT_WRITER_RETRY_DELAY
+        self.written_count = 0
+        self.lost_count = 0
+        self.logger = logging.getLogger(__class__.__name__)
+        self.logger.setLevel(settings.LOG_LEVEL)
+        self._queue = None
+        self._task = None
+        self._executor = None
+
+    @property
+    def pending_count(self):
+        return self._queue.qsize() if self._queue else 0
+
+    def _ensure_started(self):
+        if self._task is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+            self._queue = asyncio.Queue(maxsize=self.max_pending)
+            self._task = asyncio.ensure_future(self._run())
+
+    def make_row(self, obj):
+        return {
+            column.name: getattr(obj, column.name)
+            for column in self.table.columns
+            if not column.primary_key
+        }
+
+    async def put(self, obj):
+        await self.put_row(self.make_row(obj))
+
+    async def put_row(self, row):
+        self._ensure_started()
+        await self._queue.put(row)
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            rows = [await self._queue.get()]
+            flush_at = loop.time() + self.flush_every
+            while len(rows) < self.batch_size:
+                if not self._queue.empty():
+                    rows.append(self._queue.get_nowait())
+                    continue
+                timeout = flush_at - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    rows.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self._write_with_retries(rows)
+                self.written_count += len(rows)
+            except Exception as e:
+                self.lost_count += len(rows)
+                self.logger.error('Could not write {} rows to {}, {} rows lost so far: {}'.format(len(rows), self.table.name, self.lost_count, e))
+            finally:
+                for i in range(len(rows)):
+                    self._queue.task_done()
+
+    def is_transient(self, error):
+        # e.g. deadlock, lock wait timeout or lost connection
+        return isinstance(error, sqlalchemy.exc.OperationalError) or error.connection_invalidated
+
+    async def _write_with_retries(self, rows):
+        """Batch is written in single transaction, so it is safe to write
+        it again. Delay between attempts doubles every time."""
+        loop = asyncio.get_event_loop()
+        delay = self.retry_delay
+        for attempt in range(self.retries + 1):
+            try:
+                await loop.run_in_executor(self._executor, self.write, rows)
+                return
+            except sqlalchemy.exc.DBAPIError as e:
+                if attempt == self.retries or not self.is_transient(e):
+                    raise
+                self.logger.warning('Could not write {} rows to {}, retrying in {}s: {}'.format(len(rows), self.table.name, delay, e))
+            await asyncio.sleep(delay)
+            delay *= 2
+
+    def write(self, rows):
+        with self.engine.begin() as connection:
+            connection.execute(self.table.insert(), rows)
+            if self.state_table is not None:
+                self.write_state(connection, rows)
+
+    def write_state(self, connection, rows):
+        """Keeps only the latest row for every primary key of state table.
+        Rows are queued in order of completion, so the last one wins."""
+        key_columns = [x.name for x in self.state_table.primary_key.columns]
+        state_columns = [x.name for x in self.state_table.columns]
+        latest = {}
+        for row in rows:
+            latest[tuple(row[x] for x in key_columns)] = row
+        state_rows = [{x: row.get(x) for x in state_columns} for row in latest.values()]
+
+        if connection.dialect.name == 'mysql':
+            insert = mysql.insert(self.state_table)
+            update = {x: insert.inserted[x] for x in state_columns if x not in key_columns}
+            connection.execute(insert.on_duplicate_key_update(**update), state_rows)
+            return
+
+        delete = self.state_table.delete().where(and_(*[
+            self.state_table.c[x] == bindparam('key_{}'.format(x))
+            for x in key_columns
+        ]))
+        connection.execute(delete, [
+            {'key_{}'.format(x): row[x] for x in key_columns}
+            for row in state_rows
+        ])
+        connection.execute(self.state_table.insert(), state_rows)
+
+    async def flush(self):
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def close(self):
+        await self.flush()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+            self._queue = None
+            self._executor.shutdown(wait=True)
+            self._executor = None
@@ -1,5 +1,7 @@
 import asyncio
 import argparse
+import collections
+import datetime
 import json
 import logging
 import os
@@ -8,12 +10,17 @@ import uuid
 
 from aiohttp import web
 from aiohttp.web import Response
-from sqlalchemy import select, join, text
+from sqlalchemy import bindparam, select, join, text
 import sqlalchemy.exc
-from sqlalchemy.orm import aliased
+from sqlalchemy.orm import aliased, Session
 
+from database import Database
 import entity
+from entity import chunks
+import parse_executor
+import proxy_parser
 from manager import Manager
+from shard import ShardWorker
 import settings
 import sql
 from worker import Worker
@@ -25,6 +32,7 @@ class APIException(BaseException):
 
 class Server(web.Application):
     def __init__(self, *args, db=None, loop=None, **kwargs):
+        kwargs.setdefault('client_max_size', settings.SERVER_CLIENT_MAX_SIZE)
         super().__init__(*args, **kwargs)
 
         self.router.add_get('/list', self.list)
@@ -37,14 +45,18 @@ class Server(web.Application):
         self.router.add_post('/remove_check', self.remove_check)
         self.router.add_post('/add_proxy_check', self.add_proxy_check)
         self.router.add_post('/remove_proxy_check', self.remove_proxy_check)
+        self.router.add_post('/add_bulk', self.add_bulk)
+        self.router.add_post('/add_proxy_check_bulk', self.add_proxy_check_bulk)
 
         self.on_startup.append(self._load_default_checks)
 
-        if not db:
-            self.db = entity.get_session()
+        if db is None:
+            engine = entity.get_engine()
+        elif isinstance(db, Session):
+            engine = db.get_bind()
         else:
-            self.db = db
-        self._db_semaphore = asyncio.Semaphore()
+            engine = db
+        self.db = Database(engine=engine)
         entity.create_models()
 
         self.logger = logging.getLogger(self.__class__.__name__)
@@ -53,27 +65,23 @@ class Server(web.Application):
     async def close(self):
         self.db.close()
 
-    async def db_aquire(self):
-        await self._db_semaphore.acquire()
-        return self.db
+    def _execute_for_proxy_ids(self, db, query, ids_query, ids=None):
+        if ids is None:
+            return db.execute(query).fetchall()
+        ids_query = text(ids_query).bindparams(bindparam('ids', expanding=True))
+        return db.execute(ids_query, {'ids': ids}).fetchall()
 
-    async def db_release(self):
-        self._db_semaphore.release()
-
-    async def _ban_map(self):
+    def _ban_map(self, db, ids=None):
         banned_at = {}
-        db = await self.db_aquire()
-        for ban in self.db.execute(sql.GET_BANNED_AT).fetchall():
+        for ban in self._execute_for_proxy_ids(db, sql.GET_BANNED_AT, sql.GET_BANNED_AT_BY_PROXY_IDS, ids):
             ban = dict(ban)
             banned_at.setdefault(ban['id'], [])
             banned_at[ban['id']].append(ban['netloc'])
-        db = await self.db_release()
         return banned_at
 
-    async def _check_to_proxy_map(self):
+    def _check_to_proxy_map(self, db, ids=None):
         result = {}
-        db = await self.db_aquire()
-        for row in self.db.execute(sql.GET_PROXY_CHECKS).fetchall():
+        for row in self._execute_for_proxy_ids(db, sql.GET_PROXY_CHECKS, sql.GET_PROXY_CHECKS_BY_PROXY_IDS, ids):
             row = dict(row)
 
             name = row['name']
@@ -82,7 +90,6 @@ class Server(web.Application):
 
             result.setdefault(row['proxy_id'], [])
             result[row['proxy_id']].append({'id': row['check_definition_id'], 'name': name})
-        db = await self.db_release()
 
         return result
 
@@ -129,23 +136,128 @@ class Server(web.Application):
         if not isinstance(query['proxy'], str):
             raise APIException('Value of attribute \'proxy\' is wrong. Got \'{}\', but expected string'.format(query['proxy']))
         try:
-            protocol, host, port = entity.get_proxy_parts(query['proxy'])
-        except:
-            protocol = host = port = None
-        if not host or not port:
+            parsed_proxy = proxy_parser.parse_one(query['proxy'])
+        except proxy_parser.ProxyParseError:
             raise APIException('Value of attribute \'proxy\' should be containt host and port of proxy, but \'{}\' got'.format(query['proxy']))
+        if parsed_proxy.username:
+            raise APIException('Value of attribute \'proxy\' should be without credentials, as they are not stored, but \'{}\' got'.format(query['proxy']))
 
         # Recheck every checks
-        query['recheck_every'] = request.query.get('recheck_every')
-        if query['recheck_every'] is None:
-            pass
-        elif query['recheck_every'] in (False, 'False', 'false'):
-            query['recheck_every'] = False
-        else:
+        query['recheck_every'] = self._get_recheck_every(request.query.get('recheck_every'))
+
+        return query
+
+    def _get_recheck_every(self, value):
+        if value is None:
+            return value
+        elif value in (False, 'False', 'false'):
+            return False
+        try:
+            return int(value)
+        except (ValueError, TypeError):
+            raise APIException('Value of attribute \'recheck_every\' should be int, number as string or False, but \'{}\' got'.format(value))
+
+    async def _read_bulk_body(self, request):
+        """Body is either JSON list or one item per line, where every line
+        is JSON object or plain string."""
+        content = (await request.text()).strip()
+        if content.startswith('['):
+            try:
+                items = json.loads(content)
+            except json.decoder.JSONDecodeError:
+                raise APIException('Body is not valid JSON list')
+            if not isinstance(items, list):
+                raise APIException('Body should be JSON list')
+            return items
+
+        items = []
+        for line in content.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('{'):
+                try:
+                    line = json.loads(line)
+                except json.decoder.JSONDecodeError:
+                    pass
+            items.append(line)
+        return items
+
+    async def add_bulk_validate(self, request):
+        query = {}
+
+        for key in request.query.keys():
+            if key not in ('checks', 'recheck_every'):
+                raise APIException('Attribute \'{}\' is not allowed in \'add_bulk\' method'.format(key))
+
+        default_checks = [x for x in request.query.get('checks', '').split(',') if x]
+        default_recheck_every = self._get_recheck_every(request.query.get('recheck_every'))
+
+        query['proxies'] = []
+        query['rejected'] = []
+        for i, item in enumerate(await self._read_bulk_body(request)):
+            if isinstance(item, str):
+                item = {'proxy': item}
+            if not isinstance(item, dict) or not isinstance(item.get('proxy'), str):
+                query['rejected'].append({'index': i, 'item': item, 'error': 'no_proxy'})
+                continue
+
+            try:
+                parsed_proxies = proxy_parser.parse(item['proxy'])
+            except proxy_parser.ProxyParseError:
+                query['rejected'].append({'index': i, 'item': item, 'error': 'wrong_proxy'})
+                continue
+            if parsed_proxies[0].username:
+                query['rejected'].append({'index': i, 'item': item, 'error': 'credentials_not_supported'})
+                continue
+
+            checks = item.get('checks', default_checks)
+            if not isinstance(checks, list) or not all(isinstance(x, str) for x in checks):
+                query['rejected'].append({'index': i, 'item': item, 'error': 'wrong_checks'})
+                continue
+
+            try:
+                recheck_every = self._get_recheck_every(item.get('recheck_every', default_recheck_every))
+            except APIException:
+                query['rejected'].append({'index': i, 'item': item, 'error': 'wrong_recheck_every'})
+                continue
+
+            # range of ports gives a proxy for every port
+            for parsed_proxy in parsed_proxies:
+                query['proxies'].append({
+                    'index': i,
+                    'protocol': parsed_proxy.protocol or proxy_parser.DEFAULT_PROTOCOL,
+                    'host': parsed_proxy.host,
+                    'port': parsed_proxy.port,
+                    'checks': checks,
+                    'recheck_every': recheck_every,
+                })
+
+        return query
+
+    async def add_proxy_check_bulk_validate(self, request):
+        query = {'mappings': [], 'rejected': []}
+
+        for i, item in enumerate(await self._read_bulk_body(request)):
+            if not isinstance(item, dict):
+                query['rejected'].append({'index': i, 'item': item, 'error': 'wrong_item'})
+                continue
             try:
-                query['recheck_every'] = int(query['recheck_every'])
+                proxy_id = int(item.get('proxy_id'))
             except (ValueError, TypeError):
-                raise APIException('Value of attribute \'recheck_every\' should be int, number as string or False, but \'{}\' got'.format(query['recheck_every']))
+                query['rejected'].append({'index': i, 'item': item, 'error': 'wrong_proxy_id'})
+                continue
+            check_id, check_name = item.get('check_id'), item.get('check_name')
+            if bool(check_id) == bool(check_name):
+                query['rejected'].append({'index': i, 'item': item, 'error': 'wrong_check'})
+                continue
+            if check_id:
+                try:
+                    check_id = int(check_id)
+                except (ValueError, TypeError):
+                    query['rejected'].append({'index': i, 'item': item, 'error': 'wrong_check_id'})
+                    continue
+            query['mappings'].append({'index': i, 'proxy_id': proxy_id, 'check_id': check_id, 'check_name': check_name})
 
         return query
 
@@ -153,11 +265,26 @@ class Server(web.Application):
         query = {}
 
         for key in request.query.keys():
-            if key not in ('alive_only', ):
+            if key not in ('alive_only', 'limit', 'after_id', 'format'):
                 raise APIException('Attribute \'{}\' is not allowed in \'list\' method'.format(key))
 
         query['alive_only'] = self._get_bool(request.query.get('alive_only'))
 
+        for key in ('limit', 'after_id'):
+            query[key] = request.query.get(key)
+            if query[key] is None:
+                continue
+            try:
+                query[key] = int(query[key])
+            except (ValueError, TypeError):
+                query[key] = -1
+            if query[key] < 0 or (key == 'limit' and query[key] == 0):
+                raise APIException('Value of attribute \'{}\' should be positive int, but \'{}\' got'.format(key, request.query.get(key)))
+
+        query['format'] = request.query.get('format', 'json')
+        if query['format'] not in ('json', 'ndjson'):
+            raise APIException('Value of attribute \'format\' should be \'json\' or \'ndjson\', but \'{}\' got'.format(query['format']))
+
         return query
 
     def remove_validate(self, request):
@@ -196,8 +323,8 @@ class Server(web.Application):
         if error:
             raise APIException('Value of attribute \'definition\' should be dict or JSON string with dict of check definition. Got: \'{}\''.format(definition))
 
-        for key in query.keys():
-            if key not in ('url', 'status', 'xpath', 'timeout'):
+        for key in definition.keys():
+            if key not in ('url', 'status', 'xpath_list', 'timeout', 'stream', 'max_body_size', 'adaptive_timeout', 'gate', 'max_concurrency', 'rate_limit', 'rate_burst'):
                 raise APIException('Attribute \'{}\' is not allowed in check definition'.format(key))
 
         query['url'] = definition.get('url')
@@ -233,6 +360,47 @@ class Server(web.Application):
         else:
             del query['timeout']
 
+        query['stream'] = definition.get('stream')
+        if query['stream'] is not None:
+            if not isinstance(query['stream'], bool):
+                raise APIException('Value of attribute \'stream\' should be bool, but \'{}\' got'.format(query['stream']))
+        else:
+            del query['stream']
+
+        query['adaptive_timeout'] = definition.get('adaptive_timeout')
+        if query['adaptive_timeout'] is not None:
+            if not isinstance(query['adaptive_timeout'], bool):
+                raise APIException('Value of attribute \'adaptive_timeout\' should be bool, but \'{}\' got'.format(query['adaptive_timeout']))
+        else:
+            del query['adaptive_timeout']
+
+        query['gate'] = definition.get('gate')
+        if query['gate'] is not None:
+            if not isinstance(query['gate'], bool):
+                raise APIException('Value of attribute \'gate\' should be bool, but \'{}\' got'.format(query['gate']))
+        else:
+            del query['gate']
+
+        query['max_body_size'] = definition.get('max_body_size')
+        if query['max_body_size'] is not None:
+            try:
+                query['max_body_size'] = int(query['max_body_size'])
+            except (ValueError, TypeError):
+                raise APIException('Value of attribute \'max_body_size\' should be int, but \'{}\' got'.format(query['max_body_size']))
+        else:
+            del query['max_body_size']
+
+        for key, value_type in (('max_concurrency', int), ('rate_limit', float), ('rate_burst', int)):
+            value = definition.get(key)
+            if value is None:
+                continue
+            try:
+                query[key] = value_type(value)
+            except (ValueError, TypeError):
+                raise APIException('Value of attribute \'{}\' should be {}, but \'{}\' got'.format(key, value_type.__name__, value))
+            if query[key] <= 0:
+                raise APIException('Value of attribute \'{}\' should be positive, but \'{}\' got'.format(key, value))
+
         return {'definition': query, 'name': name}
 
     def list_check_validate(self, request):
@@ -329,53 +497,221 @@ class Server(web.Application):
 
         return query
 
+    def _add_proxy(self, db, query):
+        recheck_every = query['recheck_every']
+        if recheck_every is None:
+            recheck_every = self.recheck_every
+        ids, created = entity.get_or_create_many([query['proxy']], session=db, defaults={'recheck_every': recheck_every or None})
+        proxy_id = list(ids.values())[0]
+        if not created and query['recheck_every'] is not False:
+            (db.query(entity.Proxy)
+                .filter(entity.Proxy.id == proxy_id)
+                .filter(entity.Proxy.recheck_every.is_distinct_from(recheck_every))
+                .update({'recheck_every': recheck_every}, synchronize_session=False))
+        return proxy_id
+
     async def add(self, request):
         try:
             query = self.add_validate(request)
         except APIException as e:
             return Response(text=json.dumps({'result': str(e), 'error': True}))
 
-        proxy = entity.parse_proxy_string(query['proxy'])
-        if query['recheck_every']:
-            proxy.recheck_every = query['recheck_every']
-        elif query['recheck_every'] is None:
-            proxy.recheck_every = self.recheck_every
-
-        db = await self.db_aquire()
-        db.add(proxy)
-        db.commit()
-        await self.db_release()
+        proxy_id = await self.db.run(self._add_proxy, query)
         self.logger.info('Added proxy: {}'.format(query['proxy']))
 
-        return Response(text=json.dumps({'result': {'id': proxy.id}, 'error': False}))
+        return Response(text=json.dumps({'result': {'id': proxy_id}, 'error': False}))
 
-    async def list(self, request):
+    def _make_list_item(self, proxy, banned_at, proxy_checks):
+        b = {}
+        b['id'] = proxy['id']
+        b['proxy'] = proxy_parser.make_proxy_string(proxy['protocol'], proxy['host'], proxy['port'])
+        b['banned_at'] = banned_at.get(proxy['id'], [])
+        b['is_passed'] = bool(proxy['is_passed'])
+        b['recheck_every'] = int(proxy['recheck_every']) if proxy['recheck_every'] is not None else proxy['recheck_every']
+        b['checks'] = proxy_checks.get(proxy['id'], [])
+        return b
+
+    def _get_check_ids_by_name(self, db, names):
+        result = {}
+        names = list(set(names))
+        for chunk in chunks(names, settings.DB_CHUNK_SIZE):
+            rows = (db.query(entity.CheckDefinition.id, entity.CheckDefinition.name)
+                .filter(entity.CheckDefinition.name.in_(chunk))
+                .all())
+            result.update({x.name: x.id for x in rows})
+        return result
+
+    def _add_proxies_bulk(self, db, query):
+        # duplicates of proxy get checks of all of them and recheck_every
+        # of the last one which sets it
+        proxies = collections.OrderedDict()
+        for item in query['proxies']:
+            key = (item['protocol'], item['host'], item['port'])
+            if key not in proxies:
+                proxies[key] = dict(item, checks=[])
+            proxy = proxies[key]
+            proxy['checks'].extend(x for x in item['checks'] if x not in proxy['checks'])
+            if item['recheck_every'] is not None:
+                proxy['recheck_every'] = item['recheck_every']
+
+        rows = []
+        for item in proxies.values():
+            recheck_every = item['recheck_every']
+            if recheck_every is None:
+                recheck_every = self.recheck_every
+            rows.append({
+                'protocol': item['protocol'],
+                'host': item['host'],
+                'port': item['port'],
+                'recheck_every': recheck_every or None,
+            })
+        proxy_ids, created = entity.get_or_create_many(rows, session=db)
+
+        check_ids = self._get_check_ids_by_name(db, [x for item in proxies.values() for x in item['checks']])
+        pairs = []
+        for key, item in proxies.items():
+            pairs.extend((proxy_ids[key], check_ids[x]) for x in item['checks'] if x in check_ids)
+
+        rejected = list(query['rejected'])
+        # range of ports gives several items of the same index
+        missing_checks = collections.OrderedDict()
+        for item in query['proxies']:
+            for name in item['checks']:
+                if name not in check_ids:
+                    missing_checks[(item['index'], name)] = None
+        rejected.extend({'index': index, 'item': name, 'error': 'check_not_exists'} for index, name in missing_checks)
+        rejected.sort(key=lambda x: x['index'])
+        checks_added = entity.add_proxy_check_definitions(pairs, session=db)
+
+        return {
+            'ids': list(proxy_ids.values()),
+            'added': len(created),
+            'existing': len(proxies) - len(created),
+            'checks_added': checks_added,
+            'rejected': rejected,
+        }
+
+    async def add_bulk(self, request):
         try:
-            filters = self.list_validate(request)
+            query = await self.add_bulk_validate(request)
+        except APIException as e:
+            return Response(text=json.dumps({'result': str(e), 'error': True}))
+
+        result = await self.db.run(self._add_proxies_bulk, query)
+        self.logger.info('Added {} proxies, {} already existed'.format(result['added'], result['existing']))
+
+        return self._response({'result': result, 'error': False})
+
+    def _add_proxy_checks_bulk(self, db, query):
+        rejected = list(query['rejected'])
+        mappings = query['mappings']
+
+        check_ids = self._get_check_ids_by_name(db, [x['check_name'] for x in mappings if x['check_name']])
+        known_check_ids = set(check_ids.values())
+        unknown_check_ids = list(set(x['check_id'] for x in mappings if x['check_id']))
+        for chunk in chunks(unknown_check_ids, settings.DB_CHUNK_SIZE):
+            rows = db.query(entity.CheckDefinition.id).filter(entity.CheckDefinition.id.in_(chunk)).all()
+            known_check_ids.update(x.id for x in rows)
+
+        existing_proxy_ids = set()
+        for chunk in chunks(list(set(x['proxy_id'] for x in mappings)), settings.DB_CHUNK_SIZE):
+            rows = db.query(entity.Proxy.id).filter(entity.Proxy.id.in_(chunk)).all()
+            existing_proxy_ids.update(x.id for x in rows)
+
+        pairs = []
+        for mapping in mappings:
+            check_id = mapping['check_id'] or check_ids.get(mapping['check_name'])
+            if mapping['proxy_id'] not in existing_proxy_ids:
+                rejected.append({'index': mapping['index'], 'error': 'proxy_not_exists'})
+            elif check_id not in known_check_ids:
+                rejected.append({'index': mapping['index'], 'error': 'check_not_exists'})
+            else:
+                pairs.append((mapping['proxy_id'], check_id))
+
+        added = entity.add_proxy_check_definitions(pairs, session=db)
+        return {'added': added, 'existing': len(set(pairs)) - added, 'rejected': rejected}
+
+    async def add_proxy_check_bulk(self, request):
+        try:
+            query = await self.add_proxy_check_bulk_validate(request)
         except APIException as e:
             return Response(text=json.dumps({'result': str(e), 'error': True}))
 
+        result = await self.db.run(self._add_proxy_checks_bulk, query)
+
+        return self._response({'result': result, 'error': False})
+
+    def _list_proxies(self, db, filters):
         if filters.get('alive_only'):
             query = text(sql.GET_ALIVE_PROXIES)
         else:
             query = text(sql.GET_PROXIES)
-        proxies = self.db.execute(query).fetchall()
-        await self.db_release()
-
-        result = []
-        banned_at = await self._ban_map()
-        proxy_checks = await self._check_to_proxy_map()
-        for proxy in proxies:
-            b = {}
-            b['id'] = proxy['id']
-            b['proxy'] = '{}://{}:{}'.format(proxy['protocol'], proxy['host'], proxy['port'])
-            b['banned_at'] = banned_at.get(proxy['id'], [])
-            b['is_passed'] = bool(proxy['is_passed'])
-            b['recheck_every'] = int(proxy['recheck_every']) if proxy['recheck_every'] is not None else proxy['recheck_every']
-            b['checks'] = proxy_checks.get(proxy['id'], [])
-            result.append(b)
-
-        return Response(text=json.dumps({'result': result, 'error': False}, default=entity.serializer))
+        proxies = db.execute(query).fetchall()
+
+        banned_at = self._ban_map(db)
+        proxy_checks = self._check_to_proxy_map(db)
+        return [self._make_list_item(x, banned_at, proxy_checks) for x in proxies]
+
+    def _list_proxies_page(self, db, filters, after_id, limit):
+        if filters.get('alive_only'):
+            query = text(sql.GET_ALIVE_PROXIES_PAGE)
+        else:
+            query = text(sql.GET_PROXIES_PAGE)
+        proxies = db.execute(query, {'after_id': after_id, 'limit': limit}).fetchall()
+        if not proxies:
+            return []
+
+        ids = [x['id'] for x in proxies]
+        banned_at = self._ban_map(db, ids)
+        proxy_checks = self._check_to_proxy_map(db, ids)
+        return [self._make_list_item(x, banned_at, proxy_checks) for x in proxies]
+
+    async def _stream_list(self, request, filters):
+        response = web.StreamResponse()
+        response.content_type = 'application/x-ndjson'
+        await response.prepare(request)
+
+        after_id = filters['after_id'] or 0
+        left = filters['limit']
+        while left is None or left > 0:
+            page_size = settings.LIST_PAGE_SIZE if left is None else min(left, settings.LIST_PAGE_SIZE)
+            page = await self.db.run(self._list_proxies_page, filters, after_id, page_size)
+            if page:
+                lines = [json.dumps(x, default=entity.serializer) for x in page]
+                await response.write(('\n'.join(lines) + '\n').encode())
+                after_id = page[-1]['id']
+            if len(page) < page_size:
+                break
+            if left is not None:
+                left -= len(page)
+
+        await response.write_eof()
+        return response
+
+    async def list(self, request):
+        try:
+            filters = self.list_validate(request)
+        except APIException as e:
+            return Response(text=json.dumps({'result': str(e), 'error': True}))
+
+        if filters['format'] == 'ndjson':
+            return await self._stream_list(request, filters)
+
+        if filters['limit'] is None and filters['after_id'] is None:
+            result = await self.db.run(self._list_proxies, filters)
+            return Response(text=json.dumps({'result': result, 'error': False}, default=entity.serializer))
+
+        limit = filters['limit'] or settings.LIST_PAGE_SIZE
+        result = await self.db.run(self._list_proxies_page, filters, filters['after_id'] or 0, limit)
+        next_after_id = result[-1]['id'] if len(result) == limit else None
+
+        return Response(text=json.dumps({'result': result, 'next_after_id': next_after_id, 'error': False}, default=entity.serializer))
+
+    def _remove_proxy(self, db, proxy_id):
+        is_really_removed = db.query(entity.Proxy).filter(entity.Proxy.id == proxy_id).delete()
+        if is_really_removed:
+            db.add(entity.RemovedProxy(proxy_id=proxy_id))
+        return is_really_removed
 
     async def remove(self, request):
         try:
@@ -383,31 +719,25 @@ class Server(web.Application):
         except APIException as e:
             return Response(text=json.dumps({'result': str(e), 'error': True}))
 
-        db = await self.db_aquire()
-        is_really_removed = db.query(entity.Proxy).filter(entity.Proxy.id == query['id']).delete()
-        db.commit()
-        await self.db_release()
+        is_really_removed = await self.db.run(self._remove_proxy, query['id'])
 
         result = {'result': 'ok' if is_really_removed else 'not_exists', 'error': False}
 
         return Response(text=json.dumps(result, default=entity.serializer))
 
-    async def _do_add_check(self, definition, name=None):
-        is_exists, check = False, None
-        db = await self.db_aquire()
+    def _add_check(self, db, definition, name=None):
         try:
-            check = entity.Check(name=name, **definition)
-            db.add(check)
+            check = entity.Check(name=name, session=db, **definition)
+            is_exists = getattr(check, '__is_exists')
             db.commit()
-            db.flush()
         except sqlalchemy.exc.IntegrityError:
             db.rollback()
-            is_exists = True
-        finally:
-            await self.db_release()
-        is_exists = is_exists or getattr(check, '__is_exists')
+            return True, None
         return is_exists, check
 
+    async def _do_add_check(self, definition, name=None):
+        return await self.db.run(self._add_check, definition, name=name)
+
     async def add_check(self, request):
         try:
             query = self.add_check_validate(request)
@@ -432,20 +762,21 @@ class Server(web.Application):
 
         return Response(text=json.dumps(result, default=entity.serializer))
 
+    def _get_check(self, db, check_id=None, name=None):
+        check = db.query(entity.CheckDefinition)
+        if check_id:
+            check = check.filter(entity.CheckDefinition.id == check_id)
+        else:
+            check = check.filter(entity.CheckDefinition.name == name)
+        return check.first()
+
     async def list_check(self, request):
         try:
             query = self.list_check_validate(request)
         except APIException as e:
             return Response(text=json.dumps({'result': str(e), 'error': True}))
 
-        db = await self.db_aquire()
-        check = db.query(entity.CheckDefinition)
-        if query.get('id'):
-            check.filter(entity.CheckDefinition.id == query['id'])
-        else:
-            check.filter(entity.CheckDefinition.name == query['name'])
-        check = check.first()
-        await self.db_release()
+        check = await self.db.run(self._get_check, check_id=query.get('id'), name=query.get('name'))
 
         if not check:
             return self._response({'result': 'not_exists', 'error': True})
@@ -454,63 +785,54 @@ class Server(web.Application):
 
         return Response(text=json.dumps(result, default=entity.serializer))
 
+    def _remove_check(self, db, check_id=None, name=None):
+        result = db.query(entity.CheckDefinition.id)
+        if check_id:
+            result = result.filter(entity.CheckDefinition.id == check_id)
+        else:
+            result = result.filter(entity.CheckDefinition.name == name)
+        return entity.remove_check_definitions([x.id for x in result], session=db)
+
     async def remove_check(self, request):
         try:
             query = self.remove_check_validate(request)
         except APIException as e:
             return Response(text=json.dumps({'result': str(e), 'error': True}))
 
-        db = await self.db_aquire()
-        result = db.query(entity.CheckDefinition)
-        if query.get('id'):
-            result = result.filter(entity.CheckDefinition.id == query['id'])
-        else:
-            result = result.filter(entity.CheckDefinition.name == query['name'])
-        result = result.delete()
-        db.commit()
-        await self.db_release()
+        result = await self.db.run(self._remove_check, check_id=query.get('id'), name=query.get('name'))
 
         result = {'result': 'ok' if result else 'not_exists', 'error': False}
 
         return Response(text=json.dumps(result, default=entity.serializer))
 
-    async def add_proxy_check(self, request):
-        try:
-            query = self.add_proxy_check_validate(request)
-        except APIException as e:
-            return Response(text=json.dumps({'result': str(e), 'error': True}))
-
-        db = await self.db_aquire()
+    def _add_proxy_check(self, db, query):
         check = db.query(entity.CheckDefinition)
         if query.get('check_id'):
             check = check.filter_by(id=query['check_id'])
         else:
             check = check.filter_by(name=query['check_name'])
         check = check.first()
-        await self.db_release()
         if not check:
-            return self._response({'result': 'check_not_exists', 'error': True})
+            return 'check_not_exists'
 
-        db = await self.db_aquire()
-        proxy = db.query(entity.Proxy).filter(entity.Proxy.id == query['proxy_id']).first()
-        await self.db_release()
-        if not proxy:
-            return self._response({'result': 'proxy_not_exists', 'error': True})
+        proxy_id = db.query(entity.Proxy.id).filter(entity.Proxy.id == query['proxy_id']).scalar()
+        if not proxy_id:
+            return 'proxy_not_exists'
 
-        entity.get_or_create(entity.ProxyCheckDefinition, proxy=proxy, check_definition=check)
-        db.commit()
-        await self.db_release()
+        entity.add_proxy_check_definitions([(proxy_id, check.id)], session=db)
+        return 'ok'
 
-        return self._response({'result': 'ok', 'error': False})
-
-    async def remove_proxy_check(self, request):
+    async def add_proxy_check(self, request):
         try:
-            query = self.remove_proxy_check_validate(request)
+            query = self.add_proxy_check_validate(request)
         except APIException as e:
             return Response(text=json.dumps({'result': str(e), 'error': True}))
 
-        db = await self.db_aquire()
+        result = await self.db.run(self._add_proxy_check, query)
 
+        return self._response({'result': result, 'error': result != 'ok'})
+
+    def _remove_proxy_check(self, db, query):
         to_remove = db.query(entity.ProxyCheckDefinition).join(entity.ProxyCheckDefinition.check_definition)
         filter_by = [entity.ProxyCheckDefinition.proxy_id == query['proxy_id']]
         if query.get('check_id'):
@@ -519,13 +841,22 @@ class Server(web.Application):
             filter_by.append(entity.CheckDefinition.name == query['check_name'])
         to_remove = to_remove.filter(*filter_by).first()
 
-        if to_remove:
-            is_really_removed = db.query(entity.ProxyCheckDefinition).filter_by(id=to_remove.id).delete()
-        else:
-            is_really_removed = False
+        if not to_remove:
+            return False
+
+        is_really_removed = db.query(entity.ProxyCheckDefinition).filter_by(id=to_remove.id).delete()
+        (db.query(entity.Proxy)
+            .filter_by(id=query['proxy_id'])
+            .update({'updated_at': datetime.datetime.utcnow()}, synchronize_session=False))
+        return is_really_removed
+
+    async def remove_proxy_check(self, request):
+        try:
+            query = self.remove_proxy_check_validate(request)
+        except APIException as e:
+            return Response(text=json.dumps({'result': str(e), 'error': True}))
 
-        db.commit()
-        await self.db_release()
+        is_really_removed = await self.db.run(self._remove_proxy_check, query)
 
         return self._response({'result': 'ok' if is_really_removed else 'not_exists', 'error': False})
 
@@ -542,6 +873,8 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('-H', '--host', required=False, default=settings.SERVER_HOST)
     parser.add_argument('-p', '--port', required=False, type=int, default=settings.SERVER_PORT)
+    parser.add_argument('--processes', required=False, type=int, default=0, help='run checks in that many worker processes')
+    parser.add_argument('--no-checker', action='store_true', default=False, help='only serve API, checks are done by node.py processes')
     args = parser.parse_args()
 
     worker_count = 1
@@ -556,13 +889,23 @@ def main():
 
         # Running manager
         manager = Manager()
-        asyncio.ensure_future(manager.start())
+        if not args.no_checker:
+            asyncio.ensure_future(manager.start())
 
         # Runnning worker(s)
-        for i in range(worker_count):
-            worker = Worker(concurent_requests=concurent_requests)
-            manager.workers.append(worker)
-            asyncio.ensure_future(worker.start())
+        if args.no_checker:
+            server.logger.info('Checker is disabled, proxies are checked by nodes')
+        elif args.processes:
+            manager.partition_by_hash = True
+            for i in range(args.processes):
+                worker = ShardWorker(i, concurent_requests=concurent_requests)
+                manager.workers.append(worker)
+                asyncio.ensure_future(worker.start())
+        else:
+            for i in range(worker_count):
+                worker = Worker(concurent_requests=concurent_requests)
+                manager.workers.append(worker)
+                asyncio.ensure_future(worker.start())
 
         loop.run_forever()
     except KeyboardInterrupt:
@@ -576,6 +919,15 @@ def main():
         loop.run_until_complete(manager.stop())
         loop.run_until_complete(manager.wait_stop())
 
+        # Stopping worker processes, they send back results of running checks
+        if args.processes and not args.no_checker:
+            loop.run_until_complete(asyncio.gather(*[x.stop() for x in manager.workers]))
+            loop.run_until_complete(asyncio.gather(*[x.wait_stop() for x in manager.workers]))
+
+        # Writing buffered check results
+        loop.run_until_complete(entity.get_result_writer().close())
+        parse_executor.shutdown()
+
 
 
 if __name__ == '__main__':
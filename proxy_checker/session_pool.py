@@ -0,0 +1,105 @@
+import collections
+import logging
+import time
+
+import aiohttp
+from aiosocksy.connector import ProxyConnector, ProxyClientRequest
+
+import settings
+
+
+class PooledSession:
+    def __init__(self, key):
+        self.key = key
+        self.session = aiohttp.ClientSession(
+            connector=ProxyConnector(
+                verify_ssl=False,
+                limit=0,
+                keepalive_timeout=settings.SESSION_POOL_IDLE_TIMEOUT,
+            ),
+            request_class=ProxyClientRequest,
+        )
+        self.in_use = 0
+        self.last_used_at = time.time()
+
+    @property
+    def is_idle(self):
+        return not self.in_use
+
+    async def close(self):
+        await self.session.close()
+
+
+class SessionContext:
+    def __init__(self, pool, proxy):
+        self._pool = pool
+        self._proxy = proxy
+        self._pooled_session = None
+
+    async def __aenter__(self):
+        self._pooled_session = await self._pool.acquire(self._proxy)
+        return self._pooled_session.session
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._pool.release(self._pooled_session)
+
+
+class SessionPool:
+    """Keeps one client session per proxy, so checks against the same
+    proxy reuse its keep-alive connections instead of dialing again."""
+
+    def __init__(self, max_size=None, idle_timeout=None):
+        self.max_size = max_size or settings.SESSION_POOL_MAX_SIZE
+        self.idle_timeout = idle_timeout or settings.SESSION_POOL_IDLE_TIMEOUT
+        self._sessions = collections.OrderedDict()
+        self.logger = logging.getLogger(__class__.__name__)
+        self.logger.setLevel(settings.LOG_LEVEL)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    @staticmethod
+    def make_key(proxy):
+        return (proxy.protocol or 'http', proxy.host, str(proxy.port))
+
+    def session(self, proxy):
+        return SessionContext(self, proxy)
+
+    async def acquire(self, proxy):
+        key = self.make_key(proxy)
+        pooled_session = self._sessions.get(key)
+        if pooled_session is None:
+            await self._evict()
+            pooled_session = PooledSession(key)
+            self._sessions[key] = pooled_session
+        else:
+            self._sessions.move_to_end(key)
+        pooled_session.in_use += 1
+        pooled_session.last_used_at = time.time()
+        return pooled_session
+
+    async def release(self, pooled_session):
+        pooled_session.in_use -= 1
+        pooled_session.last_used_at = time.time()
+
+    async def _evict(self):
+        # Sessions are kept in least recently used order, so idle and
+        # overflowing ones are always found at the beginning
+        expire_before = time.time() - self.idle_timeout
+        to_close = []
+        for key, pooled_session in self._sessions.items():
+            is_expired = pooled_session.last_used_at < expire_before
+            is_overflow = len(self._sessions) - len(to_close) >= self.max_size
+            if not is_expired and not is_overflow:
+                break
+            if pooled_session.is_idle:
+                to_close.append(key)
+
+        for key in to_close:
+            self.logger.debug('Closing session for {}://{}:{}'.format(*key))
+            await self._sessions.pop(key).close()
+
+    async def close(self):
+        sessions, self._sessions = self._sessions, collections.OrderedDict()
+        for pooled_session in sessions.values():
+            await pooled_session.close()
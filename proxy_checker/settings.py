@@ -10,10 +10,77 @@ DEFAULT_TIMEOUT = 2
 DEFAULT_CONCURENT_REQUESTS = 50
 POSSIBLE_PROTOCOLS = ['http', 'socks4', 'socks5']
 
+SESSION_POOL_MAX_SIZE = 1024
+SESSION_POOL_IDLE_TIMEOUT = 60
+
+# None to parse pages on event loop, 'process' or 'thread' to use pool
+PARSE_EXECUTOR = None
+PARSE_EXECUTOR_WORKERS = None
+PARSE_EXECUTOR_MIN_SIZE = 16384
+
+# Read response body in chunks and stop as soon as check result is known,
+# can be overridden by 'stream' key of check definition
+STREAM_RESPONSE_BODY = False
+STREAM_CHUNK_SIZE = 16384
+STREAM_EVALUATE_EVERY = 65536
+MAX_BODY_SIZE = 1024*1024
+
+PORT_PROBE_OPEN_TTL = 60
+PORT_PROBE_CLOSED_TTL = 15
+PORT_PROBE_CACHE_SIZE = 65536
+
+PROTOCOL_SNIFF_TIMEOUT = 3
+PROTOCOL_SNIFF_CONCURRENCY = 500
+# Address SOCKS4 and HTTP CONNECT handshakes ask proxy to connect to
+PROTOCOL_SNIFF_TARGET = ('8.8.8.8', 53)
+
+# Tighten check timeout to percentile of observed latency multiplied by
+# factor, can be enabled per check by 'adaptive_timeout' key of definition
+ADAPTIVE_TIMEOUT = False
+ADAPTIVE_TIMEOUT_PER_PROXY = False
+ADAPTIVE_TIMEOUT_PERCENTILE = 95
+ADAPTIVE_TIMEOUT_FACTOR = 2
+ADAPTIVE_TIMEOUT_FLOOR = 1
+ADAPTIVE_TIMEOUT_MIN_SAMPLES = 50
+ADAPTIVE_TIMEOUT_WINDOW = 1000
+
+# What MultiCheck does for proxies which look dead: 'all', 'probe' or 'gate'
+MULTI_CHECK_POLICY = 'all'
+
+# Checker nodes, see node.py
+NODE_LEASE_TIME = 300
+NODE_POLL_EVERY = 1
+NODE_SYNC_EVERY = 5
+
+# Default limits of requests to every target host, None for no limit. Can
+# be set per check by 'max_concurrency', 'rate_limit' (requests per second)
+# and 'rate_burst' keys of definition
+HOST_MAX_CONCURRENCY = None
+HOST_RATE_LIMIT = None
+HOST_RATE_BURST = None
+
+# Streaming mode of check_file: proxies checked at once and lines read
+# from input at once
+PIPELINE_WINDOW = 1000
+PIPELINE_READ_BATCH_SIZE = 500
+# Proxies left without verdict are given up after workers were idle that long
+PIPELINE_IDLE_TIMEOUT = 5
+
+RESULT_WRITER_BATCH_SIZE = 500
+RESULT_WRITER_FLUSH_EVERY = 1
+RESULT_WRITER_MAX_PENDING = 10000
+# Batches failed with transient database errors are written again that many
+# times, first retry after delay in seconds which doubles every time
+RESULT_WRITER_RETRIES = 3
+RESULT_WRITER_RETRY_DELAY = 1
+
 TRUE_VALUES = ('1', 'true', 'True', 'on')
 
 SERVER_HOST = '0.0.0.0'
 SERVER_PORT = 3300
+# Largest request body in bytes, bodies of add_bulk are lists of thousands
+# of proxies
+SERVER_CLIENT_MAX_SIZE = 64 * 1024 * 1024
 
 def enable_debug_mode():
     global LOG_LEVEL, PROGRESS_BAR_ENABLED
@@ -43,7 +110,13 @@ DB = {
     'database': 'proxy_checker',
 }
 
+DB_POOL_SIZE = 10
+DB_THREADS = 10
+# Max count of values in one IN (...) clause, SQLite allows 999 variables
+DB_CHUNK_SIZE = 500
+
 DEFAULT_RECHECK_EVERY = 3600
+LIST_PAGE_SIZE = 1000
 
 try:
     from settings_local import *
@@ -0,0 +1,221 @@
+import asyncio
+import concurrent.futures
+import logging
+import multiprocessing
+import time
+
+import entity
+from result_writer import ResultWriter
+import settings
+from worker import Worker
+
+
+def serialize_proxy(proxy):
+    """Plain dict of proxy and its check definitions which can be sent to
+    shard process"""
+    return {
+        'id': proxy.id,
+        'host': proxy.host,
+        'port': proxy.port,
+        'protocol': proxy.protocol,
+        'recheck_every': proxy.recheck_every,
+        'check_definitions': [
+            (x.id, x.name, x.definition, x.netloc)
+            for x in proxy.check_definitions
+        ],
+    }
+
+
+class QueueResultWriter(ResultWriter):
+    """Result writer of shard process. Batches are sent to parent process
+    which writes them to database."""
+
+    def __init__(self, result_queue, table):
+        super().__init__(engine=None, table=table)
+        self.result_queue = result_queue
+
+    def write(self, rows):
+        self.result_queue.put(('rows', rows))
+
+
+class ShardProcessWorker(Worker):
+    """Worker running in shard process. Items are (proxy, check definitions)
+    pairs, as proxies there are not bound to any session."""
+
+    def make_check(self, item):
+        proxy, check_definitions = item
+        return entity.MultiCheck(*check_definitions, session_pool=self.session_pool, policy=self.check_policy).check(proxy)
+
+
+def run_shard(shard_id, item_queue, result_queue, concurent_requests, check_policy, log_level):
+    settings.LOG_LEVEL = log_level
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    logger = logging.getLogger('Shard{}'.format(shard_id))
+    logger.setLevel(settings.LOG_LEVEL)
+
+    writer = QueueResultWriter(result_queue, table=entity.CheckResult.__table__)
+    entity.get_result_writer.writer = writer
+    worker = ShardProcessWorker(concurent_requests=concurent_requests, check_policy=check_policy)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    check_definitions = {}
+    reported = {'count': 0}
+
+    def make_item(data):
+        proxy = entity.Proxy(
+            id=data['id'],
+            host=data['host'],
+            port=data['port'],
+            protocol=data['protocol'],
+            recheck_every=data['recheck_every'],
+        )
+        checks = []
+        for check_id, name, definition, netloc in data['check_definitions']:
+            key = (check_id, definition)
+            if key not in check_definitions:
+                check_definitions[key] = entity.CheckDefinition(id=check_id, name=name, definition=definition, netloc=netloc)
+            checks.append(check_definitions[key])
+        return proxy, checks
+
+    def report_processed():
+        count = worker._processed_count - reported['count']
+        if count:
+            reported['count'] += count
+            result_queue.put(('processed', count))
+
+    async def read_items():
+        while True:
+            batch = await loop.run_in_executor(executor, item_queue.get)
+            if batch is None:
+                break
+            for data in batch:
+                worker.put(make_item(data))
+        await worker.stop()
+
+    async def report_loop():
+        while True:
+            report_processed()
+            await asyncio.sleep(0.5)
+
+    async def run():
+        reporter = asyncio.ensure_future(report_loop())
+        await asyncio.gather(worker.start(), read_items())
+        await writer.close()
+        reporter.cancel()
+        report_processed()
+
+    logger.info('Shard process started')
+    try:
+        loop.run_until_complete(run())
+    finally:
+        executor.shutdown(wait=False)
+        result_queue.put(('stopped', None))
+        loop.close()
+    logger.info('Shard process stopped')
+
+
+class ShardWorker:
+    """Worker interface for Manager backed by a separate process with its
+    own event loop, worker and connection pool. Items are sent to the
+    process in batches, check results are sent back and written by the
+    result writer of this process."""
+
+    def __init__(self, shard_id, concurent_requests=None, progress_bar=None, check_policy=None):
+        self.shard_id = shard_id
+        self.concurent_requests = concurent_requests or settings.DEFAULT_CONCURENT_REQUESTS
+        self.check_policy = check_policy or settings.MULTI_CHECK_POLICY
+        self.logger = logging.getLogger(__class__.__name__)
+        self.logger.setLevel(settings.LOG_LEVEL)
+
+        context = multiprocessing.get_context('spawn')
+        self._item_queue = context.Queue()
+        self._result_queue = context.Queue()
+        self._process = context.Process(
+            target=run_shard,
+            args=(shard_id, self._item_queue, self._result_queue, self.concurent_requests, self.check_policy, settings.LOG_LEVEL),
+            daemon=True,
+        )
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._pending = []
+        self._is_flush_scheduled = False
+        self._is_running = False
+        self._stopped = asyncio.Event()
+        self._progress_bar = progress_bar
+        self._sent_count = 0
+        self._processed_count = 0
+        self._started_at = time.time()
+
+    @property
+    def queue_size(self):
+        return self._sent_count - self._processed_count
+
+    @property
+    def in_progress(self):
+        return self.queue_size
+
+    @property
+    def is_running(self):
+        return self._is_running
+
+    @property
+    def is_have_item_to_process(self):
+        return self.queue_size != 0
+
+    @property
+    def performance(self):
+        delta_time = time.time() - self._started_at
+        return int(self._processed_count/delta_time)
+
+    def put(self, item):
+        self._pending.append(serialize_proxy(item))
+        self._sent_count += 1
+        if not self._is_flush_scheduled:
+            self._is_flush_scheduled = True
+            asyncio.get_event_loop().call_soon(self._flush_items)
+
+    def _flush_items(self):
+        self._is_flush_scheduled = False
+        if self._pending:
+            batch, self._pending = self._pending, []
+            self._item_queue.put(batch)
+
+    def update_progress_bar(self, count):
+        if self._progress_bar is None:
+            return False
+        self._progress_bar.total = self._sent_count
+        self._progress_bar.update(count)
+
+    async def start(self):
+        self._is_running = True
+        self._stopped.clear()
+        self._process.start()
+        self.logger.info('Shard {} started in process {}'.format(self.shard_id, self._process.pid))
+
+        loop = asyncio.get_event_loop()
+        result_writer = entity.get_result_writer()
+        while True:
+            kind, data = await loop.run_in_executor(self._executor, self._result_queue.get)
+            if kind == 'rows':
+                for row in data:
+                    await result_writer.put_row(row)
+            elif kind == 'processed':
+                self._processed_count += data
+                self.update_progress_bar(data)
+            elif kind == 'stopped':
+                break
+
+        await loop.run_in_executor(self._executor, self._process.join)
+        self._executor.shutdown(wait=False)
+        self._is_running = False
+        self._stopped.set()
+        self.logger.info('Shard {} stopped'.format(self.shard_id))
+
+    async def stop(self):
+        self._flush_items()
+        self._item_queue.put(None)
+
+    async def wait_stop(self):
+        if self.is_running:
+            await self._stopped.wait()
+        if self._progress_bar:
+            self._progress_bar.close()
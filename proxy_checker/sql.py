@@ -1,33 +1,52 @@
-_GET_PROXIES = """
-SELECT *
-FROM (
-    SELECT proxy.id, check_result.id as check_id, proxy.protocol, proxy.host, proxy.port, check_result.is_passed, proxy.recheck_every, (
-        SELECT COUNT(*) 
-        FROM proxy_check_definition 
+_IS_ALIVE = """EXISTS (
+        SELECT 1
+        FROM proxy_check_definition
+        WHERE proxy_check_definition.proxy_id = proxy.id
+    ) AND NOT EXISTS (
+        SELECT 1
+        FROM proxy_check_definition
+        LEFT JOIN proxy_check_state ON proxy_check_state.proxy_id = proxy_check_definition.proxy_id
+            AND proxy_check_state.check_id = proxy_check_definition.check_definition_id
         WHERE proxy_check_definition.proxy_id = proxy.id
-    ) as checks_count
-    FROM proxy 
-    LEFT JOIN check_result ON proxy.id = check_result.proxy_id 
-    GROUP BY check_result.check_id, proxy.id
-    ORDER BY check_result.done_at DESC
-) as t
+        AND (proxy_check_state.is_passed IS NULL OR proxy_check_state.is_passed = 0)
+    )"""
+
+_GET_PROXIES = """
+SELECT proxy.id, proxy.protocol, proxy.host, proxy.port, proxy.recheck_every, 
+    CASE WHEN {is_alive} THEN 1 ELSE 0 END as is_passed
+FROM proxy 
 {where}
-GROUP BY t.id
-{having}
+ORDER BY proxy.id
+{limit}
 """
 
-GET_ALIVE_PROXIES = _GET_PROXIES.format(where='WHERE t.is_passed = TRUE', having='HAVING COUNT(*) = t.checks_count')
-GET_PROXIES = _GET_PROXIES.format(where='', having='')
+GET_ALIVE_PROXIES = _GET_PROXIES.format(is_alive=_IS_ALIVE, where='WHERE '+_IS_ALIVE, limit='')
+GET_PROXIES = _GET_PROXIES.format(is_alive=_IS_ALIVE, where='', limit='')
+
+GET_ALIVE_PROXIES_PAGE = _GET_PROXIES.format(is_alive=_IS_ALIVE, where='WHERE proxy.id > :after_id AND '+_IS_ALIVE, limit='LIMIT :limit')
+GET_PROXIES_PAGE = _GET_PROXIES.format(is_alive=_IS_ALIVE, where='WHERE proxy.id > :after_id', limit='LIMIT :limit')
 
 GET_BANNED_AT = """
-SELECT proxy.id, check_definition.netloc
-FROM proxy 
-JOIN check_result ON proxy.id = check_result.proxy_id 
-JOIN check_definition ON check_result.check_id = check_definition.id
-WHERE check_result.is_passed = TRUE
-AND check_result.is_banned = TRUE
-GROUP BY check_result.check_id, proxy.id, check_definition.netloc, check_result.done_at
-ORDER BY check_result.done_at DESC
+SELECT proxy_check_state.proxy_id as id, check_definition.netloc
+FROM proxy_check_state
+JOIN check_definition ON proxy_check_state.check_id = check_definition.id
+WHERE proxy_check_state.is_passed = 1
+AND proxy_check_state.is_banned = 1
+"""
+
+GET_BANNED_AT_BY_PROXY_IDS = GET_BANNED_AT + """AND proxy_check_state.proxy_id IN :ids
+"""
+
+REBUILD_PROXY_CHECK_STATE = """
+INSERT INTO proxy_check_state (proxy_id, check_id, is_passed, is_banned, status, time, error, done_at)
+SELECT r.proxy_id, r.check_id, r.is_passed, r.is_banned, r.status, r.time, r.error, r.done_at
+FROM check_result r
+WHERE r.id = (
+    SELECT MAX(r2.id)
+    FROM check_result r2
+    WHERE r2.proxy_id = r.proxy_id
+    AND r2.check_id = r.check_id
+)
 """
 
 
@@ -36,3 +55,15 @@ SELECT pcd.proxy_id, pcd.check_definition_id, cd.name
 FROM proxy_check_definition pcd
 INNER JOIN check_definition cd ON cd.id = pcd.check_definition_id
 """
+
+GET_PROXY_CHECKS_BY_PROXY_IDS = GET_PROXY_CHECKS + """WHERE pcd.proxy_id IN :ids
+"""
+
+GET_PROXY_VERDICTS = """
+SELECT pcd.proxy_id, cd.netloc, proxy_check_state.is_passed, proxy_check_state.is_banned, proxy_check_state.time
+FROM proxy_check_definition pcd
+INNER JOIN check_definition cd ON cd.id = pcd.check_definition_id
+LEFT JOIN proxy_check_state ON proxy_check_state.proxy_id = pcd.proxy_id
+    AND proxy_check_state.check_id = pcd.check_definition_id
+WHERE pcd.proxy_id IN :ids
+"""
@@ -0,0 +1,26 @@
+import os
+import unittest
+
+import entity
+
+
+class SQLiteTestCase(unittest.TestCase):
+    """Makes engine of temporary sqlite database the default one of entity
+    for every test, models are created unless create_models is False"""
+
+    db_file_name = 'test.db'
+    create_models = True
+
+    def setUp(self):
+        self.db_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), self.db_file_name)
+        if os.path.exists(self.db_file_path):
+            os.remove(self.db_file_path)
+        self.previous_engine = entity.get_engine.engine
+        self.engine = entity.get_engine(database_url=entity.get_sqlite_database_url(self.db_file_path), force=True)
+        if self.create_models:
+            entity.create_models(engine=self.engine)
+
+    def tearDown(self):
+        self.engine.dispose()
+        entity.get_engine.engine = self.previous_engine
+        os.remove(self.db_file_path)
@@ -0,0 +1,43 @@
+import unittest
+
+from adaptive_timeout import LatencyTracker, percentile
+
+
+class TestLatencyTracker(unittest.TestCase):
+    def setUp(self):
+        self.tracker = LatencyTracker(window=100, min_samples=10, percent=95, factor=2, floor=0.5, per_proxy=True)
+
+    def test_percentile(self):
+        self.assertEqual(percentile(range(101), 95), 95)
+        self.assertEqual(percentile([3, 1, 2], 50), 2)
+
+    def test_definition_timeout_until_enough_samples(self):
+        for i in range(9):
+            self.tracker.record(1, i, 0.1)
+        self.assertEqual(self.tracker.get_timeout(1, 10), 10)
+
+    def test_timeout_is_tightened(self):
+        for i in range(100):
+            self.tracker.record(1, i, i/100)
+        self.assertAlmostEqual(self.tracker.get_timeout(1, 10), 0.94*2)
+        self.assertEqual(self.tracker.get_timeout(1, 1), 1)
+
+    def test_floor(self):
+        for i in range(10):
+            self.tracker.record(1, i, 0.01)
+        self.assertEqual(self.tracker.get_timeout(1, 10), 0.5)
+
+    def test_zero_floor(self):
+        tracker = LatencyTracker(window=100, min_samples=10, factor=2, floor=0)
+        for i in range(10):
+            tracker.record(1, i, 0.01)
+        self.assertEqual(tracker.floor, 0)
+        self.assertAlmostEqual(tracker.get_timeout(1, 10), 0.02)
+
+    def test_per_proxy(self):
+        for i in range(10):
+            self.tracker.record(1, 1, 0.1)
+            self.tracker.record(1, 2, 2)
+        self.assertAlmostEqual(self.tracker.get_timeout(1, 10, proxy_id=1), 0.5)
+        self.assertAlmostEqual(self.tracker.get_timeout(1, 10, proxy_id=2), 4)
+        self.assertAlmostEqual(self.tracker.get_timeout(1, 10, proxy_id=3), 4)
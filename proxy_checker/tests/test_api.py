@@ -140,6 +140,11 @@ class TestAPI(asynctest.TestCase):
         result = await self.request('add_check', {'definition': json.dumps(definition)}, http_method='post')
         self.assertEqual(result, {'result': {'id': 1}, 'error': False})
 
+    async def test_add_check_definition_unknown_key(self):
+        definition = {'url': 'http://google.com', 'max_concurency': 1}
+        result = await self.request('add_check', {'definition': json.dumps(definition)}, http_method='post')
+        self.assertEqual(result, {'result': 'Attribute \'max_concurency\' is not allowed in check definition', 'error': True})
+
 
     async def test_add_check_definition_by_name(self):
         definition = {'url': 'http://google.com'}
@@ -491,3 +496,113 @@ class TestAPI(asynctest.TestCase):
             {'result': 'not_exists', 'error': True},
             {'result': 'not_exists', 'error': True},
         ])
+
+    async def test_list_pagination(self):
+        for port in (3331, 3332, 3333):
+            await self.request('add', {'proxy': 'http://google.com:{}'.format(port)}, http_method='post')
+
+        result = await self.request('list', {'limit': 2}, http_method='post')
+        self.assertEqual([x['id'] for x in result['result']], [1, 2])
+        self.assertEqual(result['next_after_id'], 2)
+
+        result = await self.request('list', {'limit': 2, 'after_id': result['next_after_id']}, http_method='post')
+        self.assertEqual([x['id'] for x in result['result']], [3])
+        self.assertEqual(result['next_after_id'], None)
+
+    async def test_list_pagination_wrong_limit(self):
+        result = await self.request('list', {'limit': 0}, http_method='post')
+        self.assertEqual(result, {'result': 'Value of attribute \'limit\' should be positive int, but \'0\' got', 'error': True})
+
+    async def test_list_ndjson(self):
+        for port in (3331, 3332):
+            await self.request('add', {'proxy': 'http://google.com:{}'.format(port)}, http_method='post')
+
+        url = 'http://{}:{}/list?format=ndjson'.format(self._host, self._port)
+        async with self.session.get(url) as response:
+            content = await response.text()
+
+        result = [json.loads(x) for x in content.splitlines()]
+        self.assertEqual([x['proxy'] for x in result], ['http://google.com:3331', 'http://google.com:3332'])
+
+    async def post_body(self, method, body, params={}):
+        url = 'http://{}:{}/{}?{}'.format(self._host, self._port, method, urllib.parse.urlencode(params))
+        async with self.session.post(url, data=body) as response:
+            return json.loads(await response.text())
+
+    async def test_add_bulk(self):
+        result = await self.request('add_check', {
+                'definition': json.dumps({'url': 'http://google.com'}),
+                'name': 'test123'
+            },
+            http_method='post'
+        )
+        self.assertEqual(result, {'result': {'id': 1, 'name': 'test123'}, 'error': False})
+
+        result = await self.post_body('add_bulk', json.dumps([
+            'http://google.com:3331',
+            {'proxy': 'http://google.com:3332', 'checks': ['test123']},
+            'http://google.com:3331',
+            'wrong',
+        ]))
+        self.assertEqual(result['error'], False)
+        self.assertEqual(result['result']['ids'], [1, 2])
+        self.assertEqual(result['result']['added'], 2)
+        self.assertEqual(result['result']['checks_added'], 1)
+        self.assertEqual([x['index'] for x in result['result']['rejected']], [3])
+
+        result = await self.request('list', http_method='post')
+        self.assertEqual([x['checks'] for x in result['result']], [[], [{'id': 1, 'name': 'test123'}]])
+
+    async def test_add_bulk_duplicates(self):
+        for name in ('a', 'b'):
+            await self.request('add_check', {'definition': json.dumps({'url': 'http://{}.com'.format(name)}), 'name': name}, http_method='post')
+
+        result = await self.post_body('add_bulk', json.dumps([
+            {'proxy': 'http://google.com:3331', 'checks': ['a']},
+            {'proxy': 'http://google.com:3331', 'checks': ['b', 'not_exists'], 'recheck_every': 123},
+        ]))
+        self.assertEqual(result['result']['ids'], [1])
+        self.assertEqual(result['result']['checks_added'], 2)
+        self.assertEqual(result['result']['rejected'], [{'index': 1, 'item': 'not_exists', 'error': 'check_not_exists'}])
+
+        result = await self.request('list', http_method='post')
+        self.assertEqual(result['result'][0]['recheck_every'], 123)
+        self.assertEqual(sorted(x['name'] for x in result['result'][0]['checks']), ['a', 'b'])
+
+    async def test_add_bulk_lines(self):
+        result = await self.request('add', {'proxy': 'http://google.com:3331'}, http_method='post')
+        self.assertEqual(result, {'result': {'id': 1}, 'error': False})
+
+        result = await self.post_body('add_bulk', 'http://google.com:3331\nhttp://google.com:3332\n', {'recheck_every': 123})
+        self.assertEqual(result['result']['ids'], [1, 2])
+        self.assertEqual(result['result']['added'], 1)
+        self.assertEqual(result['result']['existing'], 1)
+
+        result = await self.request('list', http_method='post')
+        self.assertEqual([x['recheck_every'] for x in result['result']], [self.app.recheck_every, 123])
+
+    async def test_add_bulk_large_body(self):
+        body = '\n'.join('http://127.0.{}.{}:{}'.format(i // 250, i % 250, 10000 + i) for i in range(50000))
+        self.assertGreater(len(body), 1024 * 1024)
+        result = await self.post_body('add_bulk', body)
+        self.assertEqual(result['error'], False)
+        self.assertEqual(result['result']['added'], 50000)
+
+    async def test_add_proxy_check_bulk(self):
+        result = await self.request('add_check', {
+                'definition': json.dumps({'url': 'http://google.com'}),
+                'name': 'test123'
+            },
+            http_method='post'
+        )
+        result = await self.post_body('add_bulk', 'http://google.com:3331\nhttp://google.com:3332')
+        self.assertEqual(result['result']['ids'], [1, 2])
+
+        result = await self.post_body('add_proxy_check_bulk', json.dumps([
+            {'proxy_id': 1, 'check_id': 1},
+            {'proxy_id': 2, 'check_name': 'test123'},
+            {'proxy_id': 3, 'check_id': 1},
+            {'proxy_id': 1, 'check_name': 'not_exists'},
+        ]))
+        self.assertEqual(result['result']['added'], 2)
+        self.assertEqual([x['error'] for x in result['result']['rejected']], ['proxy_not_exists', 'check_not_exists'])
@@ -0,0 +1,103 @@
+import entity
+from tests import SQLiteTestCase
+
+
+class TestGetOrCreateMany(SQLiteTestCase):
+    db_file_name = 'test_get_or_create_many.db'
+
+    def setUp(self):
+        super().setUp()
+        self.session = entity.make_session()
+
+    def tearDown(self):
+        self.session.close()
+        super().tearDown()
+
+    def test_get_or_create_many(self):
+        existing = entity.Proxy(protocol='http', host='127.0.0.1', port='80')
+        self.session.add(existing)
+        self.session.commit()
+
+        ids, created = entity.get_or_create_many([
+            'http://127.0.0.2:80',
+            'http://127.0.0.1:80',
+            {'protocol': 'socks5', 'host': '127.0.0.1', 'port': '80', 'recheck_every': 10},
+            'http://127.0.0.2:80',
+        ], session=self.session, defaults={'recheck_every': 5})
+        self.session.commit()
+
+        self.assertEqual(list(ids.keys()), [
+            ('http', '127.0.0.2', '80'),
+            ('http', '127.0.0.1', '80'),
+            ('socks5', '127.0.0.1', '80'),
+        ])
+        self.assertEqual(ids[('http', '127.0.0.1', '80')], existing.id)
+        self.assertEqual(created, [('http', '127.0.0.2', '80'), ('socks5', '127.0.0.1', '80')])
+        self.assertEqual(self.session.query(entity.Proxy).count(), 3)
+        recheck_every = dict(self.session.query(entity.Proxy.protocol, entity.Proxy.recheck_every).filter(entity.Proxy.id != existing.id))
+        self.assertEqual(recheck_every, {'http': 5, 'socks5': 10})
+
+        ids_again, created_again = entity.get_or_create_many(['http://127.0.0.2:80'], session=self.session)
+        self.assertEqual(created_again, [])
+        self.assertEqual(ids_again[('http', '127.0.0.2', '80')], ids[('http', '127.0.0.2', '80')])
+
+    def test_add_proxy_check_definitions(self):
+        check = entity.CheckDefinition(definition='{"url": "http://a.com"}', netloc='a.com')
+        self.session.add(check)
+        self.session.commit()
+        ids, created = entity.get_or_create_many(['http://127.0.0.1:80', 'http://127.0.0.2:80'], session=self.session)
+        proxy_ids = list(ids.values())
+
+        added = entity.add_proxy_check_definitions([(proxy_ids[0], check.id)], session=self.session)
+        self.assertEqual(added, 1)
+        added = entity.add_proxy_check_definitions([(x, check.id) for x in proxy_ids], session=self.session)
+        self.assertEqual(added, 1)
+        self.session.commit()
+        self.assertEqual(self.session.query(entity.ProxyCheckDefinition).count(), 2)
+
+        proxies = entity.load_proxies(proxy_ids, session=self.session)
+        self.assertEqual([x.id for x in proxies], proxy_ids)
+        self.assertEqual([[x.id for x in proxy.check_definitions] for proxy in proxies], [[check.id], [check.id]])
+
+    def test_same_proxies_from_two_sessions(self):
+        other_session = entity.make_session()
+        get_proxy_ids = entity.get_proxy_ids
+
+        def get_proxy_ids_racing(keys, session=None, lock=False):
+            # The other session inserts one of proxies after this one has
+            # looked for them, but before it inserts
+            result = get_proxy_ids(keys, session=session, lock=lock)
+            if session is self.session and not lock and not other_session.query(entity.Proxy).count():
+                entity.get_or_create_many(['http://127.0.0.2:80'], session=other_session)
+                other_session.commit()
+            return result
+
+        entity.get_proxy_ids = get_proxy_ids_racing
+        try:
+            ids, created = entity.get_or_create_many(['http://127.0.0.1:80', 'http://127.0.0.2:80'], session=self.session)
+            self.session.commit()
+        finally:
+            entity.get_proxy_ids = get_proxy_ids
+            other_session.close()
+
+        other_ids, other_created = entity.get_or_create_many(['http://127.0.0.2:80'], session=self.session)
+        self.assertEqual(created, [('http', '127.0.0.1', '80')])
+        self.assertEqual(ids[('http', '127.0.0.2', '80')], other_ids[('http', '127.0.0.2', '80')])
+        self.assertEqual(self.session.query(entity.Proxy).count(), 2)
+
+    def test_missing_protocol_is_default_one(self):
+        legacy = entity.Proxy(protocol='', host='127.0.0.1', port='80')
+        self.session.add(legacy)
+        self.session.commit()
+
+        ids, created = entity.get_or_create_many([
+            '127.0.0.2:80',
+            'http://127.0.0.2:80',
+            {'protocol': '', 'host': '127.0.0.2', 'port': '80'},
+            'http://127.0.0.1:80',
+        ], session=self.session)
+        self.session.commit()
+
+        self.assertEqual(dict(ids), {('http', '127.0.0.2', '80'): ids[('http', '127.0.0.2', '80')], ('http', '127.0.0.1', '80'): legacy.id})
+        self.assertEqual(created, [('http', '127.0.0.2', '80')])
+        self.assertEqual(self.session.query(entity.Proxy).count(), 2)
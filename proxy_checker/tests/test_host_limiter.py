@@ -0,0 +1,73 @@
+import asyncio
+import time
+
+import asynctest
+
+from host_limiter import HostLimiter, TokenBucket
+
+
+class TestHostLimiter(asynctest.TestCase):
+    async def test_concurrency_limit(self):
+        limiter = HostLimiter()
+        running = []
+        max_running = []
+
+        async def request():
+            async with limiter.limit('example.com', max_concurrency=2):
+                running.append(1)
+                max_running.append(len(running))
+                await asyncio.sleep(0.01)
+                running.pop()
+
+        await asyncio.gather(*[request() for i in range(10)])
+        self.assertEqual(max(max_running), 2)
+        stats = limiter.stats['example.com']
+        self.assertEqual(stats['acquired'], 10)
+        self.assertGreater(stats['wait_total'], 0)
+
+    async def test_rate_limit(self):
+        limiter = HostLimiter()
+        start_time = time.monotonic()
+
+        async def request():
+            async with limiter.limit('example.com', rate_limit=100, rate_burst=1):
+                pass
+
+        await asyncio.gather(*[request() for i in range(6)])
+        self.assertGreaterEqual(time.monotonic() - start_time, 0.045)
+
+    async def test_hosts_are_limited_separately(self):
+        limiter = HostLimiter()
+        async with limiter.limit('a.com', max_concurrency=1):
+            await asyncio.wait_for(limiter.limit('b.com', max_concurrency=1).__aenter__(), 0.1)
+
+    async def test_definitions_of_host_share_strictest_limit(self):
+        limiter = HostLimiter()
+        running = []
+        max_running = []
+
+        async def request(max_concurrency):
+            async with limiter.limit('example.com', max_concurrency=max_concurrency):
+                running.append(1)
+                max_running.append(len(running))
+                await asyncio.sleep(0.01)
+                running.pop()
+
+        await asyncio.gather(*[request(3 if i % 2 else 2) for i in range(10)])
+        self.assertEqual(max(max_running), 2)
+        self.assertEqual(limiter.stats['example.com']['acquired'], 10)
+
+    async def test_cancelled_waiter(self):
+        limiter = HostLimiter()
+        async with limiter.limit('example.com', max_concurrency=1):
+            waiter = asyncio.ensure_future(limiter.limit('example.com').__aenter__())
+            await asyncio.sleep(0)
+            waiter.cancel()
+        await asyncio.wait_for(limiter.limit('example.com').__aenter__(), 0.1)
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=10, burst=2)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertAlmostEqual(bucket.reserve(), 0.1, places=2)
+        self.assertAlmostEqual(bucket.reserve(), 0.2, places=2)
@@ -0,0 +1,139 @@
+import time
+import unittest
+
+import entity
+from manager import Manager
+from tests import SQLiteTestCase
+
+
+class FakeProxy:
+    def __init__(self, name, recheck_every=None):
+        self.name = name
+        self.recheck_every = recheck_every
+
+    def __str__(self):
+        return self.name
+
+
+class FakeWorker:
+    is_running = True
+    queue_size = 0
+
+    def __init__(self):
+        self.items = []
+
+    def put(self, item):
+        self.items.append(item)
+
+
+class TestManagerSchedule(unittest.TestCase):
+    def setUp(self):
+        self.manager = Manager()
+        self.worker = FakeWorker()
+        self.manager.workers.append(self.worker)
+
+    def test_new_items_are_processed_once(self):
+        self.manager.put(FakeProxy('a'))
+        self.manager.put(FakeProxy('b', recheck_every=3600))
+
+        self.manager._process_due_items()
+        self.manager._process_due_items()
+
+        self.assertEqual([str(x) for x in self.worker.items], ['a', 'b'])
+        self.assertEqual(self.manager.scheduling_lag['count'], 2)
+
+    def test_reschedule_on_recheck_every_change(self):
+        self.manager.put(FakeProxy('a', recheck_every=3600))
+        self.manager._process_due_items()
+
+        self.manager.put(FakeProxy('a', recheck_every=0.01))
+        time.sleep(0.02)
+        self.manager._process_due_items()
+
+        self.assertEqual([str(x) for x in self.worker.items], ['a', 'a'])
+
+    def test_retry_when_no_workers_running(self):
+        self.worker.is_running = False
+        self.manager.retry_every = 0.01
+        self.manager.put(FakeProxy('a'))
+        self.manager._process_due_items()
+        self.assertEqual(self.worker.items, [])
+
+        self.worker.is_running = True
+        time.sleep(0.02)
+        self.manager._process_due_items()
+        self.assertEqual([str(x) for x in self.worker.items], ['a'])
+
+
+class TestManagerPartition(unittest.TestCase):
+    def setUp(self):
+        self.manager = Manager()
+        self.manager.partition_by_hash = True
+        self.workers = [FakeWorker() for i in range(4)]
+        self.manager.workers.extend(self.workers)
+
+    def test_same_item_goes_to_same_worker(self):
+        names = ['proxy{}'.format(i) for i in range(100)]
+        for name in names:
+            self.manager.put(FakeProxy(name, recheck_every=0.01))
+        self.manager._process_due_items()
+        first_round = [sorted(str(x) for x in worker.items) for worker in self.workers]
+
+        time.sleep(0.02)
+        for worker in self.workers:
+            worker.items = []
+        self.manager._process_due_items()
+        second_round = [sorted(str(x) for x in worker.items) for worker in self.workers]
+
+        self.assertEqual(first_round, second_round)
+        self.assertTrue(all(first_round))
+
+    def test_retry_when_shard_is_not_running(self):
+        self.manager.retry_every = 0.01
+        for worker in self.workers:
+            worker.is_running = False
+        self.manager.put(FakeProxy('a'))
+        self.manager._process_due_items()
+        self.assertEqual(sum(len(x.items) for x in self.workers), 0)
+        self.assertEqual(self.manager.scheduled_count, 1)
+
+
+class TestManagerSync(SQLiteTestCase):
+    db_file_name = 'test_manager.db'
+
+    def setUp(self):
+        super().setUp()
+        self.session = entity.make_session()
+        self.manager = Manager()
+        # only proxies changed after the previous sync are loaded again
+        self.manager.sync_overlap = 0
+
+    def tearDown(self):
+        if self.manager._sync_session is not None:
+            self.manager._sync_session.close()
+        self.session.close()
+        super().tearDown()
+
+    def test_check_removal_is_synced(self):
+        checks = [
+            entity.CheckDefinition(name='a', definition='{"url": "http://a.com"}', netloc='a.com'),
+            entity.CheckDefinition(name='b', definition='{"url": "http://b.com"}', netloc='b.com'),
+        ]
+        self.session.add_all(checks)
+        self.session.commit()
+        ids, created = entity.get_or_create_many(['http://127.0.0.1:80'], session=self.session)
+        proxy_id = ids[('http', '127.0.0.1', '80')]
+        entity.add_proxy_check_definitions([(proxy_id, x.id) for x in checks], session=self.session)
+        self.session.commit()
+
+        proxies, removed_ids = self.manager._fetch_changes()
+        self.assertEqual([sorted(x.netloc for x in proxy.check_definitions) for proxy in proxies], [['a.com', 'b.com']])
+
+        removed = entity.remove_check_definitions([checks[0].id], session=self.session)
+        self.session.commit()
+        self.assertEqual(removed, 1)
+
+        proxies, removed_ids = self.manager._fetch_changes()
+        self.assertEqual([x.id for x in proxies], [proxy_id])
+        self.assertEqual([x.netloc for x in proxies[0].check_definitions], ['b.com'])
+        self.assertEqual(self.session.query(entity.ProxyCheckDefinition).count(), 1)
@@ -0,0 +1,65 @@
+import asynctest
+
+import entity
+
+
+class FakeCheck:
+    def __init__(self, name, timeout=3, is_gate=False, status=200):
+        self.name = name
+        self.timeout = timeout
+        self.is_gate = is_gate
+        self.status = status
+        self.calls = []
+
+    async def check(self, proxy, session_pool=None):
+        self.calls.append('check')
+        return entity.CheckResult(status=self.status, error=self.name)
+
+    async def skip(self, proxy, reason):
+        self.calls.append('skip')
+        return entity.CheckResult(status=None, error='skipped')
+
+
+class FakeProxy:
+    host = '127.0.0.1'
+    port = '8080'
+
+
+class TestMultiCheck(asynctest.TestCase):
+    def setUp(self):
+        self.proxy = FakeProxy()
+
+    def set_port_open(self, is_open):
+        patcher = asynctest.patch('entity.check_port_open', asynctest.CoroutineMock(return_value=is_open))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_all(self):
+        self.set_port_open(False)
+        checks = [FakeCheck('a'), FakeCheck('b')]
+        await entity.MultiCheck(*checks, policy='all').check(self.proxy)
+        self.assertEqual([x.calls for x in checks], [['check'], ['check']])
+
+    async def test_probe(self):
+        self.set_port_open(False)
+        checks = [FakeCheck('a'), FakeCheck('b')]
+        await entity.MultiCheck(*checks, policy='probe').check(self.proxy)
+        self.assertEqual([x.calls for x in checks], [['skip'], ['skip']])
+
+    async def test_gate_failed(self):
+        self.set_port_open(True)
+        checks = [FakeCheck('a', timeout=5), FakeCheck('b', timeout=1, status=None), FakeCheck('c', timeout=5)]
+        results = await entity.MultiCheck(*checks, policy='gate').check(self.proxy)
+        self.assertEqual([x.calls for x in checks], [['skip'], ['check'], ['skip']])
+        self.assertEqual([x.error for x in results], ['skipped', 'b', 'skipped'])
+
+    async def test_gate_passed(self):
+        self.set_port_open(True)
+        checks = [FakeCheck('a'), FakeCheck('b', is_gate=True), FakeCheck('c')]
+        results = await entity.MultiCheck(*checks, policy='gate').check(self.proxy)
+        self.assertEqual([x.calls for x in checks], [['check'], ['check'], ['check']])
+        self.assertEqual([x.error for x in results], ['a', 'b', 'c'])
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            entity.MultiCheck(FakeCheck('a'), policy='some')
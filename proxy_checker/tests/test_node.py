@@ -0,0 +1,88 @@
+import datetime
+
+from sqlalchemy.orm import sessionmaker
+
+import entity
+from node import LeaseStore
+from tests import SQLiteTestCase
+
+
+class TestLeaseStore(SQLiteTestCase):
+    db_file_name = 'test_node.db'
+
+    def setUp(self):
+        super().setUp()
+
+        session = self.make_session()
+        for i in range(10):
+            session.add(entity.Proxy(host='127.0.0.{}'.format(i), port='8080', protocol='http', recheck_every=60 if i % 2 else None))
+        session.commit()
+        session.close()
+
+    def make_session(self):
+        # as in database.Database, leased proxies are used after commit
+        return sessionmaker(bind=self.engine, autoflush=False, expire_on_commit=False)()
+
+    def run_in_session(self, func, *args):
+        session = self.make_session()
+        try:
+            result = func(session, *args)
+            session.commit()
+            return result
+        finally:
+            session.close()
+
+    def test_nodes_lease_different_proxies(self):
+        first, second = LeaseStore('first'), LeaseStore('second')
+        self.run_in_session(first.sync)
+        self.run_in_session(second.sync)
+
+        first_proxies, first_token = self.run_in_session(first.acquire, 4)
+        second_proxies, second_token = self.run_in_session(second.acquire, 100)
+        first_ids = {x.id for x in first_proxies}
+        second_ids = {x.id for x in second_proxies}
+
+        self.assertEqual(len(first_ids), 4)
+        self.assertEqual(len(second_ids), 6)
+        self.assertFalse(first_ids & second_ids)
+        self.assertEqual(self.run_in_session(second.acquire, 100)[0], [])
+
+    def test_expired_lease_is_taken_over(self):
+        first, second = LeaseStore('first', lease_time=-1), LeaseStore('second')
+        self.run_in_session(first.sync)
+        first_proxies, first_token = self.run_in_session(first.acquire, 100)
+        second_proxies, second_token = self.run_in_session(second.acquire, 100)
+        self.assertEqual({x.id for x in first_proxies}, {x.id for x in second_proxies})
+
+        # release by the previous owner does not touch taken over lease
+        self.run_in_session(first.release, [
+            {'proxy_id': x.id, 'token': first_token, 'next_check_at': None}
+            for x in first_proxies
+        ])
+        self.assertEqual(self.run_in_session(first.acquire, 100)[0], [])
+
+    def test_release_schedules_next_check(self):
+        store = LeaseStore('first')
+        self.run_in_session(store.sync)
+        proxies, token = self.run_in_session(store.acquire, 100)
+        past = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+        self.run_in_session(store.release, [
+            {'proxy_id': x.id, 'token': token, 'next_check_at': past if x.recheck_every else None}
+            for x in proxies
+        ])
+
+        proxies, token = self.run_in_session(store.acquire, 100)
+        self.assertEqual(len(proxies), 5)
+        self.assertTrue(all(x.recheck_every for x in proxies))
+
+    def test_removed_proxy_lease_is_dropped(self):
+        store = LeaseStore('first')
+        self.run_in_session(store.sync)
+        session = self.make_session()
+        session.query(entity.Proxy).filter(entity.Proxy.host == '127.0.0.1').delete()
+        session.commit()
+        session.close()
+        self.run_in_session(store.sync)
+
+        proxies, token = self.run_in_session(store.acquire, 100)
+        self.assertEqual(len(proxies), 9)
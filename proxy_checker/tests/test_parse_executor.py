@@ -0,0 +1,46 @@
+import unittest
+
+import lxml.etree
+
+import parse_executor
+from xpath_check import XPathCheck, BanXPathCheck
+
+
+def make_compiled(*xpath_list):
+    return [(x, lxml.etree.XPath(str(x))) for x in xpath_list]
+
+
+class TestStreamMatcher(unittest.TestCase):
+    page = b'<html><body>' + b'<p>x</p>'*10 + b'<b>alive</b>' + b'<p>y</p>'*10000 + b'</body></html>'
+
+    def feed(self, matcher, chunk_size=1024):
+        position = 0
+        while not matcher.is_final and position < len(self.page):
+            matcher.feed(self.page[position:position+chunk_size])
+            position += chunk_size
+        return position
+
+    def test_stops_on_alive_match(self):
+        matcher = parse_executor.StreamMatcher(make_compiled(XPathCheck('.//b')), evaluate_every=1024)
+        position = self.feed(matcher)
+        self.assertLess(position, len(self.page))
+        self.assertEqual(matcher.close(), parse_executor.Verdict(True, False, ['.//b']))
+
+    def test_reads_everything_while_ban_is_possible(self):
+        compiled = make_compiled(XPathCheck('.//b'), BanXPathCheck('.//i'))
+        matcher = parse_executor.StreamMatcher(compiled, evaluate_every=1024)
+        position = self.feed(matcher)
+        self.assertGreaterEqual(position, len(self.page))
+        self.assertEqual(matcher.close(), parse_executor.Verdict(True, False, ['.//b']))
+
+    def test_same_verdict_as_full_parse(self):
+        compiled = make_compiled(XPathCheck('.//b'), XPathCheck('.//p'), BanXPathCheck('.//p[text()="y"]'))
+        matcher = parse_executor.StreamMatcher(compiled, evaluate_every=1024)
+        self.feed(matcher)
+        streamed = matcher.close()
+        full = parse_executor.evaluate_compiled(self.page, compiled)
+        self.assertEqual((streamed.is_matched, streamed.is_banned), (full.is_matched, full.is_banned))
+
+    def test_empty_body(self):
+        matcher = parse_executor.StreamMatcher(make_compiled(XPathCheck('.//b')))
+        self.assertEqual(matcher.close(), parse_executor.Verdict(False, False, []))
@@ -0,0 +1,64 @@
+import asyncio
+import io
+import json
+
+import asynctest
+
+from pipeline import Pipeline
+import records
+
+
+class FakeManager:
+    def __init__(self, result_writer, alive_ports):
+        self.result_writer = result_writer
+        self.alive_ports = alive_ports
+        self.workers = []
+        self.scheduled_count = 0
+        self.pipeline = None
+        self.max_in_flight = 0
+        self.removed = []
+
+    def put(self, proxy):
+        self.max_in_flight = max(self.max_in_flight, self.pipeline.in_flight_count)
+        asyncio.ensure_future(self.check(proxy))
+
+    async def check(self, proxy):
+        for check in proxy.check_definitions:
+            await asyncio.sleep(0)
+            await self.result_writer.put_row({
+                'proxy_id': proxy.id,
+                'check_id': check.id,
+                'is_passed': proxy.port in self.alive_ports,
+                'is_banned': False,
+                'time': 1,
+            })
+
+    def remove(self, proxy_id):
+        self.removed.append(proxy_id)
+
+
+class TestPipeline(asynctest.TestCase):
+    async def test_run(self):
+        checks = [
+            records.make_check_definition(1, 'http://a.com'),
+            records.make_check_definition(2, 'http://b.com'),
+        ]
+        result_writer = records.MemoryResultWriter()
+        manager = FakeManager(result_writer, alive_ports=('1', '3'))
+        output = io.StringIO()
+        pipeline = Pipeline(manager, checks, result_writer, output, output_format='jsonl', window=2)
+        manager.pipeline = pipeline
+
+        lines = io.StringIO('http://127.0.0.1:1\n\nhttp://127.0.0.1:2\nhttp://127.0.0.1:1\nhttp://127.0.0.1:3\n')
+        await pipeline.run(lines)
+
+        output = [json.loads(x) for x in output.getvalue().splitlines()]
+        self.assertEqual(sorted(x['proxy'] for x in output), ['http://127.0.0.1:1', 'http://127.0.0.1:3'])
+        self.assertEqual(output[0]['time'], 1)
+        self.assertEqual(pipeline.read_count, 5)
+        self.assertEqual(pipeline.checked_count, 3)
+        self.assertEqual(pipeline.alive_count, 2)
+        self.assertLessEqual(manager.max_in_flight, 2)
+        self.assertEqual(sorted(manager.removed), [1, 2, 3])
+        self.assertEqual(result_writer.state, {})
+        self.assertEqual(pipeline.in_flight_count, 0)
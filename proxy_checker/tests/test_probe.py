@@ -0,0 +1,51 @@
+import asyncio
+
+import asynctest
+
+from probe import PortProbe
+
+
+class TestPortProbe(asynctest.TestCase):
+    async def setUp(self):
+        self.connections = []
+        self.server = await asyncio.start_server(self.on_connection, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.probe = PortProbe(open_ttl=60, closed_ttl=60, cache_size=16)
+
+    async def tearDown(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def on_connection(self, reader, writer):
+        self.connections.append(writer)
+        # probe should close connection by itself
+        await reader.read()
+        writer.close()
+
+    async def test_open_port(self):
+        result = await self.probe.probe('127.0.0.1', self.port)
+        self.assertTrue(result.is_open)
+        self.assertIsNotNone(self.probe.get_latency('127.0.0.1', self.port))
+        await asyncio.sleep(0.1)
+        self.assertEqual(len(self.connections), 1)
+        self.assertTrue(self.connections[0].transport.is_closing())
+
+    async def test_concurrent_probes_are_coalesced(self):
+        results = await asyncio.gather(*[self.probe.probe('127.0.0.1', self.port) for i in range(10)])
+        self.assertTrue(all(x.is_open for x in results))
+        self.assertEqual(self.probe.probe_count, 1)
+        self.assertEqual(self.probe.coalesced_count, 9)
+
+        await self.probe.probe('127.0.0.1', self.port)
+        self.assertEqual(self.probe.probe_count, 1)
+
+    async def test_closed_port_is_cached(self):
+        self.server.close()
+        await self.server.wait_closed()
+        result = await self.probe.probe('127.0.0.1', self.port, timeout=1)
+        self.assertFalse(result.is_open)
+        self.assertIsNotNone(result.error)
+        self.assertIsNone(self.probe.get_latency('127.0.0.1', self.port))
+
+        await self.probe.probe('127.0.0.1', self.port, timeout=1)
+        self.assertEqual(self.probe.probe_count, 1)
@@ -0,0 +1,61 @@
+import asyncio
+
+import asynctest
+
+import probe
+from protocol_sniffer import ProtocolSniffer
+
+
+class TestProtocolSniffer(asynctest.TestCase):
+    async def setUp(self):
+        probe.get_port_probe.probe = probe.PortProbe()
+        self.sniffer = ProtocolSniffer(timeout=1, target=('127.0.0.1', 80))
+        self.servers = []
+
+    async def tearDown(self):
+        for server in self.servers:
+            server.close()
+            await server.wait_closed()
+
+    async def start_server(self, response):
+        async def on_connection(reader, writer):
+            await reader.read(1)
+            writer.write(response)
+            await writer.drain()
+            writer.close()
+        server = await asyncio.start_server(on_connection, '127.0.0.1', 0)
+        self.servers.append(server)
+        return server.sockets[0].getsockname()[1]
+
+    async def test_socks5(self):
+        port = await self.start_server(b'\x05\x00')
+        self.assertEqual(await self.sniffer.sniff('127.0.0.1', port), ['socks5'])
+
+    async def test_socks4(self):
+        port = await self.start_server(b'\x00\x5a\x00\x00\x00\x00\x00\x00')
+        self.assertEqual(await self.sniffer.sniff('127.0.0.1', port), ['socks4'])
+
+    async def test_http(self):
+        port = await self.start_server(b'HTTP/1.1 405 Method Not Allowed\r\n\r\n')
+        self.assertEqual(await self.sniffer.sniff('127.0.0.1', port), ['http'])
+
+    async def test_socks4_hostname_target(self):
+        sniffer = ProtocolSniffer(timeout=1, target=('localhost', 80))
+        self.assertEqual(sniffer._socks4_request, b'\x04\x01\x00\x50\x00\x00\x00\x01\x00localhost\x00')
+        port = await self.start_server(b'\x00\x5a\x00\x00\x00\x00\x00\x00')
+        self.assertEqual(await sniffer.sniff('127.0.0.1', port), ['socks4'])
+
+    async def test_expand(self):
+        http_port = await self.start_server(b'HTTP/1.1 200 OK\r\n\r\n')
+        socks5_port = await self.start_server(b'\x05\x00')
+        self.sniffer.concurrency = 2
+        proxies = await self.sniffer.expand([
+            '127.0.0.1:{}'.format(http_port),
+            '127.0.0.1:{}'.format(socks5_port),
+            'socks4://127.0.0.1:{}'.format(http_port),
+        ])
+        self.assertEqual(proxies, [
+            '127.0.0.1:{}'.format(http_port),
+            'socks5://127.0.0.1:{}'.format(socks5_port),
+            'socks4://127.0.0.1:{}'.format(http_port),
+        ])
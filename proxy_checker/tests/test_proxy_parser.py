@@ -0,0 +1,54 @@
+import unittest
+
+import proxy_parser
+from proxy_parser import ParsedProxy, ProxyParseError
+
+
+class TestProxyParser(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(proxy_parser.parse('1.2.3.4:80'), [ParsedProxy('', '1.2.3.4', '80', None, None)])
+        self.assertEqual(proxy_parser.parse(' socks5://1.2.3.4:1080 '), [ParsedProxy('socks5', '1.2.3.4', '1080', None, None)])
+
+    def test_normalize(self):
+        self.assertEqual(str(proxy_parser.parse_one('HTTP://Example.COM:0080/')), 'http://example.com:80')
+        self.assertEqual(str(proxy_parser.parse_one('010.001.1.1:80')), '10.1.1.1:80')
+        self.assertEqual(proxy_parser.parse_one('socks5://[2001:DB8:0::1]:1080').host, '2001:db8::1')
+        self.assertEqual(str(proxy_parser.parse_one('socks5://[2001:DB8:0::1]:1080')), 'socks5://[2001:db8::1]:1080')
+
+    def test_credentials(self):
+        proxy = proxy_parser.parse_one('http://user:p@ss@1.2.3.4:80')
+        self.assertEqual((proxy.username, proxy.password, proxy.host), ('user', 'p@ss', '1.2.3.4'))
+        self.assertEqual(str(proxy), 'http://user:p@ss@1.2.3.4:80')
+
+    def test_port_range(self):
+        self.assertEqual([x.port for x in proxy_parser.parse('1.2.3.4:8080-8082')], ['8080', '8081', '8082'])
+        with self.assertRaises(ProxyParseError):
+            proxy_parser.parse_one('1.2.3.4:8080-8082')
+        with self.assertRaises(ProxyParseError):
+            proxy_parser.parse('1.2.3.4:8082-8080')
+        with self.assertRaises(ProxyParseError):
+            proxy_parser.parse('1.2.3.4:1-65535')
+
+    def test_wrong(self):
+        for proxy in ('1.2.3.4', '1.2.3.4:0', '1.2.3.4:65536', '256.1.1.1:80', '1.2.3:80', 'https://1.2.3.4:80', '::1:80', '[::g]:80', 'a b:80', 'host_name:80'):
+            with self.assertRaises(ProxyParseError, msg=proxy):
+                proxy_parser.parse(proxy)
+
+    def test_parse_many(self):
+        proxies, rejected = proxy_parser.parse_many([
+            '# comment',
+            '1.2.3.4:80',
+            '',
+            'wrong',
+            'HTTP://1.2.3.4:80',
+            '1.2.3.4:0080',
+            'http://1.2.3.4:80-81',
+        ])
+        self.assertEqual([str(x) for x in proxies], ['1.2.3.4:80', 'http://1.2.3.4:80', 'http://1.2.3.4:81'])
+        self.assertEqual([(x[0], x[1]) for x in rejected], [(3, 'wrong')])
+
+    def test_parse_many_without_credentials(self):
+        proxies, rejected = proxy_parser.parse_many(['user:pass@1.2.3.4:80', '1.2.3.4:81'], allow_credentials=False)
+        self.assertEqual([str(x) for x in proxies], ['1.2.3.4:81'])
+        self.assertEqual([(x[0], x[1]) for x in rejected], [(0, 'user:pass@1.2.3.4:80')])
+        self.assertNotIn('pass', rejected[0][2])
@@ -0,0 +1,46 @@
+import asynctest
+from sqlalchemy import Column, Integer, MetaData, Table
+import sqlalchemy.exc
+
+from result_writer import ResultWriter
+
+
+table = Table('result', MetaData(), Column('id', Integer, primary_key=True), Column('value', Integer))
+
+
+class FlakyResultWriter(ResultWriter):
+    def __init__(self, errors):
+        super().__init__(engine=None, table=table, flush_every=0.01)
+        self.retry_delay = 0.01
+        self.errors = list(errors)
+        self.written = []
+
+    def write(self, rows):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.written.extend(rows)
+
+
+def make_error(error_class):
+    return error_class('INSERT', {}, Exception('error'))
+
+
+class TestResultWriter(asynctest.TestCase):
+    async def test_transient_error_is_retried(self):
+        writer = FlakyResultWriter([make_error(sqlalchemy.exc.OperationalError)] * 2)
+        await writer.put_row({'value': 1})
+        await writer.flush()
+        self.assertEqual(writer.written, [{'value': 1}])
+        self.assertEqual((writer.written_count, writer.lost_count), (1, 0))
+        await writer.close()
+
+    async def test_batch_is_lost(self):
+        writer = FlakyResultWriter([make_error(sqlalchemy.exc.OperationalError)] * 4 + [make_error(sqlalchemy.exc.IntegrityError)])
+        await writer.put_row({'value': 1})
+        await writer.flush()
+        await writer.put_row({'value': 2})
+        await writer.flush()
+        self.assertEqual(writer.written, [])
+        self.assertEqual((writer.written_count, writer.lost_count), (0, 2))
+        self.assertEqual(writer.errors, [])
+        await writer.close()
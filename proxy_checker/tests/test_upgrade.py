@@ -0,0 +1,40 @@
+from sqlalchemy import inspect
+
+import entity
+from tests import SQLiteTestCase
+
+
+class TestUpgradeModels(SQLiteTestCase):
+    db_file_name = 'test_upgrade.db'
+    # tables are created as older versions did
+    create_models = False
+
+    def test_proxy_updated_at_is_added(self):
+        # proxy table as created by older versions
+        self.engine.execute('CREATE TABLE proxy (id INTEGER PRIMARY KEY, host VARCHAR(1024), port VARCHAR(1024), protocol VARCHAR(1024), recheck_every INTEGER, created_at DATETIME)')
+        self.engine.execute("INSERT INTO proxy (host, port, protocol) VALUES ('127.0.0.1', '8080', 'http')")
+
+        entity.create_models(engine=self.engine)
+
+        self.assertIn('updated_at', [x['name'] for x in inspect(self.engine).get_columns('proxy')])
+        self.assertIn('ix_proxy_updated_at', [x['name'] for x in inspect(self.engine).get_indexes('proxy')])
+        session = entity.make_session()
+        proxy = session.query(entity.Proxy).one()
+        self.assertIsNotNone(proxy.updated_at)
+        session.close()
+
+        # nothing to do for up to date tables
+        entity.create_models(engine=self.engine)
+
+    def test_proxy_check_state_is_rebuilt(self):
+        # check_result table as created by older versions, without state
+        self.engine.execute('CREATE TABLE check_result (id INTEGER PRIMARY KEY, is_passed BOOLEAN, is_banned BOOLEAN, status INTEGER, time INTEGER, error VARCHAR(1024), proxy_id INTEGER, check_id INTEGER, done_at DATETIME)')
+        self.engine.execute('INSERT INTO check_result (proxy_id, check_id, is_passed, time) VALUES (1, 1, 0, 1), (1, 1, 1, 2), (2, 1, 0, 3)')
+
+        entity.create_models(engine=self.engine)
+
+        self.assertIn('check_result_proxy_check_done_at_ix', [x['name'] for x in inspect(self.engine).get_indexes('check_result')])
+        session = entity.make_session()
+        state = session.query(entity.ProxyCheckState.proxy_id, entity.ProxyCheckState.is_passed).order_by(entity.ProxyCheckState.proxy_id).all()
+        self.assertEqual(state, [(1, True), (2, False)])
+        session.close()
@@ -0,0 +1,51 @@
+import entity
+from tests import SQLiteTestCase
+
+
+class TestVerdicts(SQLiteTestCase):
+    db_file_name = 'test_verdicts.db'
+
+    def setUp(self):
+        super().setUp()
+        self.session = entity.make_session()
+
+        self.checks = [
+            entity.CheckDefinition(definition='{"url": "http://a.com"}', netloc='a.com'),
+            entity.CheckDefinition(definition='{"url": "http://b.com"}', netloc='b.com'),
+        ]
+        self.proxies = [entity.Proxy(host='127.0.0.{}'.format(i), port='8080', protocol='http') for i in range(4)]
+        self.session.add_all(self.checks + self.proxies)
+        self.session.flush()
+        for proxy in self.proxies[:3]:
+            for check in self.checks:
+                self.session.add(entity.ProxyCheckDefinition(proxy_id=proxy.id, check_definition_id=check.id))
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+        super().tearDown()
+
+    def add_state(self, proxy, check, is_passed, is_banned=False, time=1):
+        self.session.add(entity.ProxyCheckState(
+            proxy_id=proxy.id,
+            check_id=check.id,
+            is_passed=is_passed,
+            is_banned=is_banned,
+            time=time,
+        ))
+
+    def test_verdicts(self):
+        alive, failed, not_checked, without_checks = self.proxies
+        self.add_state(alive, self.checks[0], True, time=1)
+        self.add_state(alive, self.checks[1], True, is_banned=True, time=3)
+        self.add_state(failed, self.checks[0], True)
+        self.add_state(failed, self.checks[1], False)
+        self.session.commit()
+
+        verdicts = entity.get_verdicts([x.id for x in self.proxies], session=self.session)
+        self.assertEqual(verdicts[alive.id], entity.ProxyVerdict(True, ['b.com'], 2))
+        self.assertFalse(verdicts[failed.id].is_alive)
+        self.assertEqual(verdicts[not_checked.id], entity.ProxyVerdict(False, [], -1))
+        self.assertEqual(verdicts[without_checks.id], entity.ProxyVerdict(False, [], -1))
+        self.assertTrue(alive.is_alive)
+        self.assertEqual(alive.banned_on, ['b.com'])
@@ -3,26 +3,36 @@ import entity
 import logging
 import time
 
+from session_pool import SessionPool
 import settings
 
 
 class Worker:
-    def __init__(self, concurent_requests=None, progress_bar=None):
+    def __init__(self, concurent_requests=None, progress_bar=None, check_policy=None):
         self.queue = asyncio.Queue()
         self.concurent_requests = concurent_requests or settings.DEFAULT_CONCURENT_REQUESTS
+        self.check_policy = check_policy or settings.MULTI_CHECK_POLICY
         self.logger = logging.getLogger(__class__.__name__)
         self.logger.setLevel(settings.LOG_LEVEL)
         self._is_running = False
         self._stop_after_queue_processed = False
-        self._internal_queue = []
+        self._slots = asyncio.Semaphore(self.concurent_requests)
+        self._stop_requested = asyncio.Event()
+        self._stopped = asyncio.Event()
+        self._tasks = set()
         self._progress_bar = progress_bar
         self._processed_count = 0
         self._started_at = time.time()
+        self.session_pool = SessionPool()
 
     @property
     def queue_size(self):
         return self.queue.qsize()
 
+    @property
+    def in_progress(self):
+        return len(self._tasks)
+
     @property
     def is_running(self):
         return self._is_running
@@ -33,7 +43,7 @@ class Worker:
 
     @property
     def is_have_item_to_process(self):
-        return self.queue.qsize() != 0 or len(self._internal_queue) != 0
+        return self.queue.qsize() != 0 or len(self._tasks) != 0
 
     def on_task_finished(self):
         self._processed_count += 1
@@ -50,44 +60,64 @@ class Worker:
         delta_time = time.time() - self._started_at
         return int(self._processed_count/delta_time)
 
+    def make_check(self, item):
+        return entity.MultiCheck(*item.check_definitions, session_pool=self.session_pool, policy=self.check_policy).check(item)
+
+    def _on_task_done(self, future):
+        self._tasks.discard(future)
+        self._slots.release()
+        if not future.cancelled() and future.exception() is not None:
+            self.logger.error('Check failed with unexpected error: {!r}'.format(future.exception()))
+        self.on_task_finished()
+
+    async def _get_item(self):
+        """Returns next item from the queue or None if the worker was
+        asked to stop and there is nothing left to take."""
+        if not self.queue.empty():
+            return self.queue.get_nowait()
+        if self._stop_after_queue_processed:
+            return None
+
+        get_item = asyncio.ensure_future(self.queue.get())
+        stop_requested = asyncio.ensure_future(self._stop_requested.wait())
+        await asyncio.wait((get_item, stop_requested), return_when=asyncio.FIRST_COMPLETED)
+        stop_requested.cancel()
+        if get_item.done():
+            return get_item.result()
+        get_item.cancel()
+        return await self._get_item()
+
     async def start(self):
         self.logger.info('Worker main loop started')
         self._is_running = True
-
-        while self._is_running:
-            if self.queue.qsize() != 0:
-                item = await self.queue.get()
-                check = entity.MultiCheck(*item.check_definitions).check
-                self._internal_queue.append(asyncio.ensure_future(check(item)))
-
-            is_continue = True
-            while is_continue:
-                to_del = [i for i, f in enumerate(self._internal_queue) if f.done()]
-                for i in sorted(to_del, reverse=True):
-                    self.on_task_finished()
-                    del self._internal_queue[i]
-
-                await asyncio.sleep(0.1)
-
-                is_task_queue_full = len(self._internal_queue) >= self.concurent_requests 
-                is_task_queue_not_empty = len(self._internal_queue)
-                is_process_queue_empty = self.queue.qsize() == 0
-                is_continue = is_task_queue_full or (is_process_queue_empty and is_task_queue_not_empty)
-
-
-            # Waiting for new tasks
-            self._is_running = self.is_have_item_to_process
-            if not self.is_have_item_to_process and not self._stop_after_queue_processed:
-                self._is_running = True
-                await asyncio.sleep(0.5)
-
+        self._stopped.clear()
+
+        while True:
+            await self._slots.acquire()
+            item = await self._get_item()
+            if item is None:
+                self._slots.release()
+                if not self._tasks:
+                    break
+                # Items may still arrive while the last checks are running
+                await asyncio.wait(list(self._tasks))
+                continue
+
+            future = asyncio.ensure_future(self.make_check(item))
+            self._tasks.add(future)
+            future.add_done_callback(self._on_task_done)
+
+        await self.session_pool.close()
+        self._is_running = False
+        self._stopped.set()
         self.logger.info('Worker main loop stopped')
 
     async def stop(self):
         self._stop_after_queue_processed = True
+        self._stop_requested.set()
 
     async def wait_stop(self):
-        while self.is_running:
-            await asyncio.sleep(0.1)
+        if self.is_running:
+            await self._stopped.wait()
         if self._progress_bar:
             self._progress_bar.close()
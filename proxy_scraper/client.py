@@ -3,54 +3,103 @@ import logging
 import urllib.parse
 
 import treq
-from twisted.internet import defer
+from twisted.internet import defer, reactor, task
+from twisted.web.client import HTTPConnectionPool
+
+from proxy_checker import proxy_parser
 
 
 class ProxyCheckerClient:
-    def __init__(self, host, port):
+    def __init__(self, host, port, batch_size=500, flush_every=5, max_in_flight=2, retries=3, retry_delay=1):
         self._host = host
         self._port = port
+        self.batch_size = batch_size
+        self.flush_every = flush_every
+        self.retries = retries
+        self.retry_delay = retry_delay
         self.logger = logging.getLogger('ProxyCheckerClient')
         self.logger.info('Initialized client for proxy checker on {}:{}'.format(self._host, self._port))
 
-    def request(self, method, data):
-        self.logger.debug('Doing request "{}" with params: {}'.format(method, data))
-        return treq.post('http://{host}:{port}/{method}?{data}'.format(
+        self._buffer = []
+        self._in_flight = set()
+        self._semaphore = defer.DeferredSemaphore(max_in_flight)
+        self._pool = HTTPConnectionPool(reactor, persistent=True)
+        self._pool.maxPersistentPerHost = max_in_flight
+        self._flush_loop = task.LoopingCall(self.flush)
+
+    def make_url(self, method, data=None):
+        return 'http://{host}:{port}/{method}?{data}'.format(
             host=self._host,
             port=self._port,
             method=method,
-            data=urllib.parse.urlencode(data),
-        ))
+            data=urllib.parse.urlencode(data or {}),
+        )
+
+    def request(self, method, data=None, body=None):
+        self.logger.debug('Doing request "{}" with params: {}'.format(method, data))
+        return treq.post(self.make_url(method, data), data=body, pool=self._pool)
+
+    def start(self):
+        if not self._flush_loop.running:
+            self._flush_loop.start(self.flush_every, now=False)
 
-    @defer.inlineCallbacks
     def add(self, ip, port, checks=None):
-        defer = self.request(
-            method='add',
-            data={
-                'proxy': '{}:{}'.format(ip, port),
-            }
-        )
-        if checks:
-            defer.addCallback(lambda x: self.add_proxy_check_callback(x, checks))
-        yield defer
+        """Buffers proxy to be sent with the next batch. Returned deferred
+        has already fired unless the proxy fills the batch, then it is the
+        one of flush, which fires after the batch is sent and answered
+        (waiting for a free slot first when too many batches are in
+        flight), so callers are slowed down to the speed of the server."""
+        self._buffer.append({
+            'proxy': proxy_parser.make_proxy_string('', ip, port),
+            'checks': list(checks or []),
+        })
+        if len(self._buffer) >= self.batch_size:
+            return self.flush()
+        return defer.succeed(None)
+
+    def flush(self):
+        if not self._buffer:
+            return defer.succeed(None)
+        batch, self._buffer = self._buffer, []
+
+        d = self._semaphore.run(self._send_batch, batch)
+        self._in_flight.add(d)
+
+        def on_done(result):
+            self._in_flight.discard(d)
+            return result
+        d.addBoth(on_done)
+        return d
+
+    @defer.inlineCallbacks
+    def _send_batch(self, batch):
+        body = json.dumps(batch).encode()
+        for attempt in range(1, self.retries + 1):
+            try:
+                response = yield self.request(method='add_bulk', body=body)
+                content = yield response.text()
+                data = json.loads(content)
+                if data.get('error') == True:
+                    raise ValueError(data.get('result'))
+            except Exception as e:
+                self.logger.warning('Could not send batch of {} proxies (attempt {}/{}): {}'.format(len(batch), attempt, self.retries, e))
+                if attempt < self.retries:
+                    yield task.deferLater(reactor, self.retry_delay * attempt, lambda: None)
+                continue
+
+            result = data['result']
+            if result['rejected']:
+                self.logger.warning('Proxy checker rejected: {}'.format(result['rejected']))
+            self.logger.info('Sent {} proxies, {} added, {} already existed'.format(len(batch), result['added'], result['existing']))
+            return result
 
-        return True
+        self.logger.error('Dropped batch of {} proxies after {} attempts'.format(len(batch), self.retries))
+        return None
 
     @defer.inlineCallbacks
-    def add_proxy_check_callback(self, response, checks):
-        body = yield response.text()
-        data = json.loads(body)
-        if data.get('error') == True:
-            self.logger.warning('Got error: {}'.format(data))
-            return False
-        proxy_id = data['result']['id']
-
-        checks = [] or checks
-        for check_name in checks:
-            yield self.request(
-                method='add_proxy_check',
-                data={
-                    'proxy_id': proxy_id,
-                    'check_name': check_name
-                }
-            )
\ No newline at end of file
+    def close(self):
+        if self._flush_loop.running:
+            self._flush_loop.stop()
+        yield self.flush()
+        yield defer.DeferredList(list(self._in_flight))
+        yield self._pool.closeCachedConnections()
@@ -1,8 +1,3 @@
-import json
-import urllib.parse
-
-import treq
-
 from proxy_scraper.client import ProxyCheckerClient
 
 
@@ -14,12 +9,24 @@ class ProxyPipeline:
         obj.client = ProxyCheckerClient(
             host=settings.get('PROXY_CHECKER_HOST'),
             port=settings.get('PROXY_CHECKER_PORT'),
+            batch_size=settings.getint('PROXY_CHECKER_BATCH_SIZE'),
+            flush_every=settings.getfloat('PROXY_CHECKER_FLUSH_EVERY'),
+            max_in_flight=settings.getint('PROXY_CHECKER_MAX_IN_FLIGHT'),
+            retries=settings.getint('PROXY_CHECKER_RETRIES'),
         )
         return obj
 
+    def open_spider(self, spider):
+        self.client.start()
+
+    def close_spider(self, spider):
+        return self.client.close()
+
     def process_item(self, item, spider):
-        return self.client.add(
+        d = self.client.add(
             ip=item['ip'],
             port=item['port'],
             checks=item.get('checks'),
         )
+        d.addCallback(lambda _: item)
+        return d
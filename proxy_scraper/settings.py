@@ -91,3 +91,8 @@ ITEM_PIPELINES = {
 
 PROXY_CHECKER_HOST = 'localhost'
 PROXY_CHECKER_PORT = 3300
+# Proxies are sent in batches to /add_bulk when batch is full or by timer
+PROXY_CHECKER_BATCH_SIZE = 500
+PROXY_CHECKER_FLUSH_EVERY = 5
+PROXY_CHECKER_MAX_IN_FLIGHT = 2
+PROXY_CHECKER_RETRIES = 3
@@ -1,7 +1,6 @@
-import re
-
 import scrapy
 
+from proxy_checker import proxy_parser
 from proxy_scraper.items import ProxyItem
 
 
@@ -17,18 +16,16 @@ class TableSpider(BaseSpider):
     row_xpath = './/table//tr[not(.//th)]'
     column_xpath = './/td//text()'
     column_map = {'ip': 0, 'port': 1}
-    _ip_regrexp = '^(([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])\.){3}([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])$'
     checks = []
 
-    def check_is_ip_ok(self, ip):
-        return re.match(self._ip_regrexp, ip)
-
-    def check_is_port_ok(self, port):
+    def parse_proxy(self, ip, port):
+        """Canonical (ip, port), proxies which are the same but written
+        differently are not sent twice"""
         try:
-            port = int(port)
-        except:
-            return False
-        return port > 0 and port <= 65535
+            proxy = proxy_parser.parse_one('{}:{}'.format(ip, port))
+        except proxy_parser.ProxyParseError as e:
+            raise WrongResult(str(e))
+        return proxy.host, proxy.port
 
     def parse(self, response):
         rows = response.xpath(self.row_xpath)
@@ -38,18 +35,13 @@ class TableSpider(BaseSpider):
                 if self.column_map['ip'] == self.column_map['port']:
                     data = columns[self.column_map['ip']].extract()
                     try:
-                        ip, port = data.split(':')
+                        ip, port = data.rsplit(':', 1)
                     except ValueError:
                         raise WrongResult('Can not split by ":": {}'.format(data))
                 else:
                     ip = columns[self.column_map['ip']].extract()
                     port = columns[self.column_map['port']].extract()
-                ip, port = ip.strip(), port.strip()
-
-                if not self.check_is_ip_ok(ip):
-                    raise WrongResult('Wrong ip: {}'.format(ip))
-                if not self.check_is_port_ok(port):
-                    raise WrongResult('Wrong port: {}'.format(port))
+                ip, port = self.parse_proxy(ip.strip(), port.strip())
             except (WrongResult, IndexError) as e:
                 print(e)
                 continue